@@ -1,57 +1,129 @@
-from flask import Flask, request, jsonify, send_file
-from flask_cors import CORS
-from utils.file_processing import process_file
-import os
-import logging
-import openai
-from dotenv import load_dotenv
-from models import session, UserRequest  # Model for saving requests
 import json
-from gtts import gTTS
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
 from datetime import datetime
-from elasticsearch import Elasticsearch
 
-# Initialize Elasticsearch connection
-es = Elasticsearch(
-    cloud_id="08b3dd79313b4064b845f7f3bb950f55:dXMtY2VudHJhbDEuZ2NwLmNsb3VkLmVzLmlvOjQ0MyRjNjhiNTI5MjhlZDk0ZjQyYjRjYTRkM2UwNWY1NzIwZCQ1MTM0YzJmOGRhMWY0Mzg3YTZmZTNiYzczYTE5MGVmMQ==",  # Replace with your Cloud ID
-    basic_auth=("elastic", "EDLUByRRMXi3R4Zu5vGtO0za")  # Replace with your credentials
+from dotenv import load_dotenv
+
+# Load environment variables from .env file (before the settings in utils are read)
+load_dotenv()
+
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser
+from flask_cors import CORS
+from utils.file_processing import extract_pages, iter_page_structures, map_file, process_file
+from utils.audit_log import AuditLogger
+from utils.batch import (
+    BATCH_EXTRACT_WORKERS,
+    BATCH_FOLDER,
+    BATCH_IN_FLIGHT,
+    BATCH_LLM_WORKERS,
+    BATCH_RETRIEVE_WORKERS,
+    BatchRunner,
+    batch_progress,
+    extract_zip,
+)
+from utils.change_store import MemoryChangeStore, create_change_store
+from utils.chunking import (
+    CHUNK_THRESHOLD_TOKENS,
+    estimate_tokens,
+    find_relevant_chunks,
+    merge_chunks,
+    run_chunked,
+    select_relevant_chunks,
+    split_into_chunks,
+)
+from utils.document_versions import (
+    MemoryVersionStore,
+    changed_paragraphs,
+    create_version_store,
+    split_paragraphs,
+    structural_diff,
+)
+from utils.extraction_cache import ExtractionCache
+from utils.jobs import JobQueue, JobError
+from utils.llm import DEFAULT_MODEL, DEFAULT_TEMPERATURE, get_llm_client, rate_limiter as llm_rate_limiter
+from utils.llm_cache import LLMResponseCache, create_backend, make_cache_key
+from utils.metrics import (
+    TRACE_HEADERS,
+    end_trace,
+    log_payload,
+    payload_logging,
+    registry as metrics_registry,
+    request_seconds,
+    server_timing,
+    start_trace,
+    timer,
+)
+from utils.model_registry import MODEL_PRELOAD, registry as model_registry
+from utils.pdf_export import pdf_chunks, stats as pdf_export_stats, text_to_pages
+from utils.prompt_processing import (
+    ExplanationSplitter,
+    build_messages,
+    build_previous_info,
+    build_prompt,
+    build_structured_prompt,
+    parse_reused_elements,
+    split_analysis,
+)
+from utils.search_store import BulkIndexer, create_store
+from utils.structured_output import (
+    OUTPUT_FORMAT,
+    StructuredOutputParser,
+    parse_structured_output,
+    stats as structured_output_stats,
+)
+from utils.tts import TTSService
+from utils.uploads import UPLOAD_CHUNK_SIZE, UploadError, UploadStore
+from utils.validation import preload_validation_model, validate_pages
+from utils.vector_index import VectorIndex
+
+# Heavy libraries (OpenAI, SQLAlchemy, PDF/OCR, NumPy, transformers) are imported by utils on first use,
+# so a worker boots without them. Check with: python -m benchmarks.bench_startup
+
+# Search storage for past operations (Elasticsearch, SQLite FTS or in-memory; see SEARCH_BACKEND)
+search_store = create_store()
+
+# Operations are indexed in bulk off the request thread
+search_indexer = BulkIndexer(search_store, "user_requests", stage="es_index")
+
+# Local vector index of past operations; embeddings are computed once, at write time.
+# Only kept up to date when it is used for retrieval (RETRIEVER=vector) unless VECTOR_INDEX_ENABLED=1
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX_ENABLED", "1" if os.getenv("RETRIEVER") == "vector" else "0") == "1"
+vector_index = VectorIndex() if VECTOR_INDEX_ENABLED else None
+vector_indexer = (
+    BulkIndexer(vector_index, "user_requests", dead_letter_path="static/vector_dead_letter.jsonl", stage="vector_index")
+    if vector_index is not None else None
 )
 
 def save_to_elasticsearch(index, data):
     """
-    Saves data to the specified Elasticsearch index.
+    Saves data to the specified search index.
     """
     try:
-        response = es.index(index=index, document=data)
-        return response["_id"]  # Returns the document ID
+        return search_store.index(index, data)
+    except RuntimeError:
+        raise
     except Exception as e:
         raise RuntimeError(f"Failed to index data in Elasticsearch: {e}")
 
 def search_in_elasticsearch(index, query):
     """
-    Searches data in the specified Elasticsearch index.
+    Searches data in the specified search index.
     """
     try:
-        body = {
-            "query": {
-                "multi_match": {
-                    "query": query,
-                    "fields": ["instructions", "document_text", "analysis"]
-                }
-            }
-        }
-        response = es.search(index=index, body=body)
-        return [hit["_source"] for hit in response["hits"]["hits"]]
+        return search_store.search(index, query)
+    except RuntimeError:
+        raise
     except Exception as e:
         raise RuntimeError(f"Failed to search data in Elasticsearch: {e}")
 
-# Load environment variables from .env file
-load_dotenv()
-print(f"Loaded API Key: {os.getenv('OPENAI_API_KEY')}")
-
-# Get the OpenAI API key from environment
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,  # Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
@@ -62,292 +134,1137 @@ logging.basicConfig(
     ]
 )
 
-app = Flask(__name__)
-CORS(app)  # To allow requests from the frontend
-
 UPLOAD_FOLDER = 'static/uploaded_docs'
 TEMP_FOLDER = 'static/temp'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(TEMP_FOLDER, exist_ok=True)
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['TEMP_FOLDER'] = TEMP_FOLDER
+# All endpoints are registered on this blueprint; the app itself is built by create_app()
+api = Blueprint('api', __name__)
+
+# Apps built by create_app(), so queued jobs run on the app that submitted them
+apps = weakref.WeakValueDictionary()
+
+def get_upload_store():
+    """
+    Returns the upload store of the current app (unique names, size limit, resumable
+    sessions, aged out by a background janitor); created per app in create_app().
+    """
+    return current_app.extensions['upload_store']
+
+# Content-addressed cache of extraction results (keyed by SHA-256 of the upload)
+extraction_cache = ExtractionCache()
 
-# Variable for temporarily storing changes
-temp_changes = {}
+# Write-behind request log (batched inserts into user_requests)
+audit_log = AuditLogger()
 
-@app.route('/')
+# Cache of model responses keyed on the normalized prompt inputs
+llm_cache = LLMResponseCache(create_backend())
+
+# Speech synthesis with an on-disk audio cache (engine selected by TTS_ENGINE)
+tts_service = TTSService()
+
+# Background job queue for /jobs endpoints (state persisted in SQLite)
+job_queue = JobQueue()
+
+# Latest changes per session (or job), shared between workers (CHANGE_STORE=sqlite by default).
+# Job workers in child processes could not publish changes to an in-memory store, so refuse to start.
+change_store = create_change_store()
+if job_queue.mode == "process" and isinstance(change_store, MemoryChangeStore):
+    raise RuntimeError("JOB_EXECUTOR=process requires a shared change store: set CHANGE_STORE=sqlite "
+                       "so changes from job workers are visible to /get_explanation and /speak_changes.")
+
+# Document versions for iterative editing, shared between workers (DOCUMENT_STORE=sqlite by default)
+version_store = create_version_store()
+if job_queue.mode == "process" and isinstance(version_store, MemoryVersionStore):
+    raise RuntimeError("JOB_EXECUTOR=process requires a shared document store: set DOCUMENT_STORE=sqlite "
+                       "so versions created by job workers are visible to /documents.")
+
+@api.route('/')
 def home():
     logging.info("Home endpoint was accessed.")
     return jsonify({"message": "Document Validator Backend is Running!"})
 
 def save_request_to_db(endpoint, request_data, response_data):
     """
-    Saves the request and response to the database.
+    Queues the request and response for the background database writer.
     """
+    with timer("db_save"):
+        audit_log.log(endpoint, request_data, response_data)
+
+def upload_error(endpoint, file_name, error, status):
+    """
+    Logs and records a rejected upload; returns the error response and status code.
+    """
+    logging.error(f"Upload rejected: {error}")
+    response = {"error": error}
+    save_request_to_db(endpoint, {"file_name": file_name} if file_name else {}, response)
+    return response, status
+
+def parse_upload_form(upload_store, max_content_length=None):
+    """
+    Parses the multipart request body, writing file parts straight into the upload store,
+    where they are hashed and size-checked as they arrive instead of being spooled first.
+    Returns (form, files); each file's stream is an UploadWriter that the caller must
+    finish() or discard().
+    """
+    writers = []
+
+    def stream_factory(total_content_length, content_type, filename=None, content_length=None):
+        writers.append(upload_store.open(filename))
+        return writers[-1]
+
+    parser = FormDataParser(stream_factory, max_content_length=max_content_length)
     try:
-        log_entry = UserRequest(
-            endpoint=endpoint,
-            request_data=json.dumps(request_data),  # Convert to JSON string
-            response_data=json.dumps(response_data),  # Convert to JSON string
-        )
-        session.add(log_entry)
-        session.commit()
-        logging.info("Request successfully saved to the database.")
-    except Exception as e:
-        logging.error(f"Failed to save request to the database: {e}")
-        session.rollback()
+        _, form, files = parser.parse_from_environ(request.environ)
+    except BaseException:
+        for writer in writers:
+            writer.discard()
+        raise
+    return form, files
 
-# API for uploading a document
-@app.route('/upload', methods=['POST'])
-def upload_document():
-    logging.info("Upload endpoint was accessed.")
-    if 'file' not in request.files:
-        logging.error("No file was uploaded.")
-        response = {"error": "No file uploaded"}
-        save_request_to_db('/upload', {}, response)
-        return jsonify(response), 400
-    file = request.files['file']
-    if file.filename == '':
-        logging.error("No file selected for upload.")
-        response = {"error": "No selected file"}
-        save_request_to_db('/upload', {}, response)
-        return jsonify(response), 400
-
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    logging.info(f"Saving file to {file_path}.")
-    file.save(file_path)
+def discard_uploads(files, keep=()):
+    """
+    Removes the parsed file parts that the endpoint does not use.
+    """
+    for _, file in files.items(multi=True):
+        if file not in keep:
+            file.stream.discard()
 
+def receive_upload(endpoint='/upload'):
+    """
+    Streams an upload into the upload store and returns (file_path, file_name, file_hash, error).
+    Accepts a multipart "file" field or the raw request body with the name in X-Filename
+    (or ?filename=). Neither is buffered before it reaches the store.
+    """
+    upload_store = get_upload_store()
+    if request.mimetype == 'multipart/form-data':
+        # The parser stops reading once the body exceeds the limit (plus room for the form fields)
+        try:
+            _, files = parse_upload_form(upload_store, upload_store.max_bytes + UPLOAD_CHUNK_SIZE)
+        except RequestEntityTooLarge:
+            return None, None, None, upload_error(endpoint, None, "Upload exceeds the size limit.", 413)
+        except UploadError as e:
+            return None, None, None, upload_error(endpoint, None, str(e), e.status)
+        file = files.get('file')
+        if file is None or file.filename == '':
+            discard_uploads(files)
+            error = "No file uploaded" if file is None else "No selected file"
+            return None, None, None, upload_error(endpoint, None, error, 400)
+        discard_uploads(files, keep=(file,))
+        file_name = file.filename
+        try:
+            file_path, file_hash = file.stream.finish()
+        except OSError as e:
+            file.stream.discard()
+            return None, None, None, upload_error(endpoint, file_name, f"Failed to store the upload: {e}", 500)
+    else:
+        file_name = request.headers.get('X-Filename') or request.args.get('filename')
+        if not file_name or not request.content_length:
+            return None, None, None, upload_error(endpoint, None, "No file uploaded", 400)
+        try:
+            file_path, file_hash = upload_store.save(request.stream, file_name, request.content_length)
+        except UploadError as e:
+            return None, None, None, upload_error(endpoint, file_name, str(e), e.status)
+    logging.info(f"Saved upload {file_name} to {file_path}.")
+    return file_path, file_name, file_hash, None
+
+def handle_upload(file_path, file_name, file_hash):
+    """
+    Extracts text from a saved upload (using the extraction cache).
+    Returns the response body and HTTP status code.
+    """
     try:
-        logging.info(f"Processing file {file_path}.")
-        results = process_file(file_path)
-        
+        results = extraction_cache.get(file_hash)
+        if results is not None:
+            logging.info(f"Extraction cache hit for {file_path} ({file_hash}).")
+            if not os.path.exists(results.get("source", "")):
+                # Keep a readable source file for building the document structure later
+                results["source"] = file_path
+                extraction_cache.put(file_hash, results)
+        else:
+            logging.info(f"Processing file {file_path}.")
+            # The extractor reads the just-written file through a memory map instead of reopening it
+            with timer("extract"), map_file(file_path) as source:
+                results = process_file(source, with_pages=True)
+            if "text" in results:
+                results["source"] = file_path
+                extraction_cache.put(file_hash, results)
+        # Per-page metadata and the source path stay in the cache; the results shape is unchanged
+        results = {key: value for key, value in results.items() if key not in ("pages", "source")}
+
         if "text" in results:
-            logging.info(f"Processing successful. Extracted text: {results['text'][:500]}...")
+            logging.info(f"Processing successful. Extracted {len(results['text'])} characters.")
+            log_payload("Extracted text", results['text'])
         else:
             logging.error(f"Processing failed. Error: {results.get('error')}")
 
-        response = {"message": "File uploaded and processed", "results": results}
-        save_request_to_db('/upload', {"file_name": file.filename}, response)
-        return jsonify(response), 200
+        response = {"message": "File uploaded and processed", "results": results, "file_hash": file_hash}
+        save_request_to_db('/upload', {"file_name": file_name}, response)
+        return response, 200
     except Exception as e:
         logging.error(f"Error during file processing: {e}")
         response = {"error": "Failed to process file"}
-        save_request_to_db('/upload', {"file_name": file.filename}, response)
+        save_request_to_db('/upload', {"file_name": file_name}, response)
+        return response, 500
+
+# API for uploading a document
+@api.route('/upload', methods=['POST'])
+def upload_document():
+    logging.info("Upload endpoint was accessed.")
+    file_path, file_name, file_hash, error = receive_upload()
+    if error:
+        return jsonify(error[0]), error[1]
+
+    response, status = handle_upload(file_path, file_name, file_hash)
+    return jsonify(response), status
+
+# API for validating the text of a document page by page
+@api.route('/validate', methods=['POST'])
+def validate_document_endpoint():
+    logging.info("Validate endpoint was accessed.")
+    file_path, file_name, _, error = receive_upload('/validate')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    try:
+        with map_file(file_path) as source:
+            pages = extract_pages(source)
+        results = validate_pages(pages)
+    except Exception as e:
+        logging.error(f"Error during document validation: {e}")
+        response = {"error": "Failed to validate document"}
+        save_request_to_db('/validate', {"file_name": file_name}, response)
         return jsonify(response), 500
 
-# Function to parse the 'Explanation' section and extract reused elements
-def parse_reused_elements(explanation):
+    labels = {}
+    for page in results:
+        if page["validation"]:
+            label = page["validation"]["label"]
+            labels[label] = labels.get(label, 0) + 1
+    response = {"message": "Document validated", "pages": results, "labels": labels}
+    save_request_to_db('/validate', {"file_name": file_name}, response)
+    return jsonify(response), 200
+
+# Resumable uploads for large files: create a session, PATCH parts from the current offset
+# (after a dropped connection GET returns the offset to resume from), then complete
+@api.route('/uploads', methods=['POST'])
+def create_upload_session():
+    data = request.json or {}
+    if not data.get('filename'):
+        return jsonify({"error": "filename is required."}), 400
+    try:
+        session = get_upload_store().create_session(data['filename'], data.get('size'))
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify({**session, "chunk_size": UPLOAD_CHUNK_SIZE, "max_bytes": get_upload_store().max_bytes}), 201
+
+@api.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    session = get_upload_store().get_session(upload_id)
+    if session is None:
+        return jsonify({"error": "Upload not found."}), 404
+    return jsonify(session), 200
+
+@api.route('/uploads/<upload_id>', methods=['PATCH'])
+def append_upload_part(upload_id):
     """
-    Parses the 'Explanation' section and extracts details about reused elements.
-    Returns a list of dictionaries with keys 'content', 'origin', and 'application'.
+    Appends the raw request body at the offset given in the Upload-Offset header.
     """
-    reused_elements = []
-    lines = explanation.splitlines()
-    in_reused_section = False
-    current_element = {}
-    for line in lines:
-        line = line.strip()
-        if line.lower().startswith("detailed list of reused elements"):
-            in_reused_section = True
-            continue
-        elif in_reused_section and line == '':
-            # Empty line may indicate the end of the section
-            if current_element:
-                reused_elements.append(current_element)
-                current_element = {}
-            in_reused_section = False
-            continue
-        if in_reused_section:
-            if line.lower().startswith("no information was reused from previous operations"):
-                # Explicit indication that no information was reused
-                in_reused_section = False
-                break
-            elif line.startswith("- Exact content reused:"):
-                if current_element:
-                    reused_elements.append(current_element)
-                    current_element = {}
-                current_element['content'] = line.replace("- Exact content reused:", "").strip()
-            elif line.startswith("- Origin (which previous operation):"):
-                current_element['origin'] = line.replace("- Origin (which previous operation):", "").strip()
-            elif line.startswith("- How it was applied:"):
-                current_element['application'] = line.replace("- How it was applied:", "").strip()
-    if current_element:
-        reused_elements.append(current_element)
-    return reused_elements
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({"error": "Upload-Offset header is required."}), 400
+    try:
+        offset = get_upload_store().append(upload_id, offset, request.stream)
+    except KeyError:
+        return jsonify({"error": "Upload not found."}), 404
+    except UploadError as e:
+        return jsonify({"error": str(e), "offset": getattr(e, 'offset', None)}), e.status
+    return jsonify({"upload_id": upload_id, "offset": offset}), 200
 
-# API for prompt processing
-@app.route('/process_prompt', methods=['POST'])
-def process_prompt():
+@api.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
     """
-    Process the prompt by analyzing and improving specific parts of the document based on instructions,
-    including information from past operations if relevant.
+    Finishes a resumable upload (optionally checking its SHA-256) and processes it like /upload.
     """
-    global temp_changes
-    logging.info("Processing prompt endpoint was accessed.")
-    data = request.json
+    logging.info("Upload completion endpoint was accessed.")
+    data = request.get_json(silent=True) or {}
+    session = get_upload_store().get_session(upload_id)
+    if session is None:
+        return jsonify({"error": "Upload not found."}), 404
+    try:
+        file_path, file_hash = get_upload_store().complete(upload_id, data.get('sha256'))
+    except UploadError as e:
+        response, status = upload_error('/upload', session['filename'], str(e), e.status)
+        return jsonify({**response, "offset": getattr(e, 'offset', None)}), status
+    response, status = handle_upload(file_path, session['filename'], file_hash)
+    return jsonify(response), status
+
+@api.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    if not get_upload_store().abort(upload_id):
+        return jsonify({"error": "Upload not found."}), 404
+    return '', 204
+
+def get_document_structure(file_hash):
+    """
+    Returns the DocumentPack (pages, blocks, lines with bounding boxes and fonts) of an
+    uploaded file, building it from the uploaded file on first use. None if unknown.
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", file_hash):
+        return None
+    pack = extraction_cache.get_pack(file_hash)
+    if pack is not None:
+        return pack
+    # Only the source path is needed, so the lookup is not counted as an extraction cache hit or miss
+    cached = extraction_cache.peek(file_hash)
+    source = cached.get("source") if cached else None
+    if not source or not os.path.exists(source):
+        return None
+    logging.info(f"Building document structure for {source} ({file_hash}).")
+    return extraction_cache.put_pack(file_hash, iter_page_structures(source))
+
+# APIs for the structured (page-level) extraction of an uploaded file
+@api.route('/structure/<file_hash>', methods=['GET'])
+def document_structure(file_hash):
+    """
+    Returns the page count of the structured document for a file hash returned by /upload.
+    """
+    try:
+        pack = get_document_structure(file_hash)
+    except Exception as e:
+        logging.error(f"Error during structure extraction: {e}")
+        return jsonify({"error": "Failed to extract document structure"}), 500
+    if pack is None:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify({"file_hash": file_hash, "pages": len(pack)}), 200
+
+@api.route('/structure/<file_hash>/pages/<int:page_number>', methods=['GET'])
+def document_structure_page(file_hash, page_number):
+    """
+    Returns one page of the structured document without loading the other pages.
+    """
+    try:
+        pack = get_document_structure(file_hash)
+    except Exception as e:
+        logging.error(f"Error during structure extraction: {e}")
+        return jsonify({"error": "Failed to extract document structure"}), 500
+    if pack is None:
+        return jsonify({"error": "Document not found"}), 404
+    try:
+        return jsonify(pack.page(page_number)), 200
+    except IndexError as e:
+        return jsonify({"error": str(e)}), 404
 
+def validate_prompt_request(data, endpoint='/process_prompt'):
+    """
+    Extracts instructions and document text (sent directly or by document_id) from the request data.
+    Returns (instructions, document_text, None) or (None, None, (response, status)).
+    """
     # Get user instructions and document text
     instructions = data.get('instructions', '').strip()
     document_text = data.get('document_text', '').strip()
 
-    logging.info(f"Received instructions: {instructions}")
-    logging.info(f"Received document text (first 500 chars): {document_text[:500]}...")
+    # Follow-up prompts may reference a stored document version instead of re-sending the text
+    if not document_text and data.get('document_id'):
+        version = version_store.get_version(data['document_id'], data.get('base_version'))
+        if version is None:
+            logging.error(f"Document {data['document_id']} not found.")
+            response = {"error": "Document not found."}
+            save_request_to_db(endpoint, data, response)
+            return None, None, (response, 404)
+        document_text = version['text']
+
+    logging.info(f"Received instructions ({len(instructions)} chars) and document text ({len(document_text)} chars).")
+    log_payload("Received instructions", instructions)
+    log_payload("Received document text", document_text)
 
     if not instructions:
         logging.error("No instructions provided.")
         response = {"error": "Instructions are required."}
-        save_request_to_db('/process_prompt', data, response)
-        return jsonify(response), 400
+        save_request_to_db(endpoint, data, response)
+        return None, None, (response, 400)
 
     if not document_text:
         logging.error("No document text provided.")
         response = {"error": "Document text is required."}
-        save_request_to_db('/process_prompt', data, response)
-        return jsonify(response), 400
+        save_request_to_db(endpoint, data, response)
+        return None, None, (response, 400)
+
+    # Chunk and paragraph selections are lists of indexes ("changed" is also accepted for paragraphs)
+    for field in ('target_chunks', 'target_paragraphs'):
+        targets = data.get(field)
+        if targets is None or (field == 'target_paragraphs' and targets == "changed"):
+            continue
+        if not isinstance(targets, list) or not all(
+            isinstance(index, int) and not isinstance(index, bool) for index in targets
+        ):
+            logging.error(f"Invalid {field}: {targets!r}")
+            response = {"error": f"{field} must be a list of integer indexes."}
+            save_request_to_db(endpoint, data, response)
+            return None, None, (response, 400)
+
+    return instructions, document_text, None
+
+def lookup_previous_info(instructions):
+    """
+    Looks up related past operations and formats them as prompt context.
+    """
+    # Fetch related data with the configured retriever ("keyword" or "vector")
+    logging.info(f"Searching for related past operations ({current_app.config['RETRIEVER']} retriever).")
+    with timer("search"):
+        if current_app.config['RETRIEVER'] == "vector" and vector_index is not None:
+            past_responses = vector_index.search("user_requests", instructions)
+        else:
+            past_responses = search_in_elasticsearch("user_requests", instructions)
+
+    # Build context with previous responses
+    previous_info = build_previous_info(past_responses)
+    if past_responses and payload_logging():
+        logging.info("Details of found past operations:")
+        for i, response in enumerate(past_responses, 1):
+            logging.info(f"Operation {i} Instructions: {response.get('instructions', 'N/A')}")
+            logging.info(f"Operation {i} Analysis: {response.get('analysis', 'N/A')[:500]}...")
+
+    logging.info(f"Found {len(past_responses)} related past operations.")
+    return previous_info
+
+def prompt_messages(instructions, document_text, previous_info):
+    """
+    Builds the model messages for the configured output format (LLM_OUTPUT_FORMAT).
+    """
+    builder = build_structured_prompt if OUTPUT_FORMAT == "json" else build_prompt
+    return build_messages(builder(instructions, document_text, previous_info))
+
+def prompt_cache_key(instructions, document_text, previous_info):
+    return make_cache_key(DEFAULT_MODEL, DEFAULT_TEMPERATURE, instructions, document_text, previous_info, OUTPUT_FORMAT)
+
+def parse_analysis(analysis):
+    """
+    Splits a complete model response into (content, explanation, reused_elements).
+    In the json output format malformed responses fall back to the text parser.
+    """
+    if OUTPUT_FORMAT == "json":
+        return parse_structured_output(analysis)
+    content, explanation = split_analysis(analysis)
+    return content, explanation, None
+
+def complete_prompt(instructions, document_text, previous_info):
+    """
+    Sends the prompt to the language model through the response cache.
+    """
+    with timer("prompt_build"):
+        messages = prompt_messages(instructions, document_text, previous_info)
+        key = prompt_cache_key(instructions, document_text, previous_info)
+
+    def compute():
+        with timer("llm"):
+            return get_llm_client().complete(messages)
+
+    return llm_cache.get_or_compute(key, compute)
+
+def stream_prompt(instructions, document_text, previous_info):
+    """
+    Yields model output tokens, serving a cached response in one piece when available.
+    """
+    key = prompt_cache_key(instructions, document_text, previous_info)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    with timer("prompt_build"):
+        messages = prompt_messages(instructions, document_text, previous_info)
+    started = time.perf_counter()
+    tokens = []
+    with timer("llm"):
+        for token in get_llm_client().stream(messages):
+            tokens.append(token)
+            yield token
+    llm_cache.put(key, "".join(tokens), time.perf_counter() - started)
+
+def select_document_chunks(data, instructions, chunks):
+    """
+    Returns the indexes of the chunks a request processes: the explicit target_chunks,
+    the chunks mentioned by the instructions when targeted, else all of them.
+    """
+    if data.get('target_chunks') is not None:
+        return [index for index in data['target_chunks'] if 0 <= index < len(chunks)]
+    if data.get('targeted'):
+        return select_relevant_chunks(chunks, instructions)
+    return list(range(len(chunks)))
+
+def process_document_in_chunks(data, instructions, document_text, previous_info=None):
+    """
+    Map-reduce path for documents larger than the model context: the document is split
+    on page/paragraph boundaries, the selected chunks are processed concurrently and
+    the results are stitched back together. previous_info is looked up when not given.
+    Returns (content, explanation, reused_elements, chunk_info).
+    """
+    chunks = split_into_chunks(document_text)
+    selected = select_document_chunks(data, instructions, chunks)
+
+    if previous_info is None:
+        previous_info = lookup_previous_info(instructions)
+
+    def process_chunk(chunk_text):
+        analysis = complete_prompt(instructions, chunk_text.strip(), previous_info)
+        with timer("parse"):
+            return parse_analysis(analysis)
+
+    content, explanation, reused_elements = run_chunked(chunks, process_chunk, selected)
+    return content, explanation, reused_elements, {"total": len(chunks), "processed": selected}
+
+def get_base_version(data, document_text):
+    """
+    Returns the stored version a prompt request works on, recording the submitted text
+    as a new version when it is a new document or differs from the latest version
+    (e.g. after the user accepted or rejected some changes).
+    """
+    document_id = data.get('document_id') or str(uuid.uuid4())
+    latest = version_store.get_version(document_id)
+    requested = version_store.get_version(document_id, data['base_version']) if data.get('base_version') else None
+    if requested is not None and requested['text'] == document_text:
+        base = requested
+    elif latest is not None and latest['text'] == document_text:
+        base = latest
+    else:
+        parent = latest['version'] if latest is not None else None
+        number = version_store.add_version(document_id, document_text, parent=parent, source="client")
+        base = version_store.get_version(document_id, number)
+    data['document_id'], data['base_version'] = document_id, base['version']
+    return base
+
+def process_document_incrementally(data, instructions, base):
+    """
+    Follow-up edits of a versioned document: only the paragraphs targeted by the request
+    (explicit target_paragraphs, "changed" for the paragraphs changed in the base version,
+    else paragraphs mentioned by the instructions) are sent to the model and patched back in.
+    Returns (content, explanation, reused_elements, region_info), or None when the whole
+    document has to be processed (e.g. "Translate into French" mentions no paragraph).
+    """
+    paragraphs = split_paragraphs(base['text'])
+    targets = data.get('target_paragraphs')
+    if targets == "changed":
+        parent = version_store.get_version(data['document_id'], base['parent']) if base['parent'] else None
+        selected = changed_paragraphs(parent['text'], base['text']) if parent is not None else []
+    elif targets is not None:
+        selected = [index for index in targets if 0 <= index < len(paragraphs)]
+    else:
+        selected = find_relevant_chunks(paragraphs, instructions)
+    if not selected or len(selected) == len(paragraphs):
+        return None
+
+    # Adjacent selected paragraphs form one region, so the model sees them together
+    selected = set(selected)
+    regions, targeted = [], []
+    for index, paragraph in enumerate(paragraphs):
+        if index in selected and index - 1 in selected:
+            regions[-1] += paragraph
+            continue
+        if index in selected:
+            targeted.append(len(regions))
+        regions.append(paragraph)
+
+    previous_info = lookup_previous_info(instructions)
+
+    def process_region(region_text):
+        analysis = complete_prompt(instructions, region_text.strip(), previous_info)
+        with timer("parse"):
+            return parse_analysis(analysis)
+
+    content, explanation, reused_elements = run_chunked(regions, process_region, targeted)
+    return content, explanation, reused_elements, {"paragraphs": len(paragraphs), "processed": sorted(selected)}
+
+def get_prompt_session_id(data):
+    """
+    Returns the session id of a prompt request, assigning a new one if the client sent none.
+    """
+    if not data.get('session_id'):
+        data['session_id'] = str(uuid.uuid4())
+    return data['session_id']
+
+def finalize_prompt(data, instructions, document_text, content, explanation, endpoint='/process_prompt',
+                    reused_elements=None):
+    """
+    Parses reused elements, stores the changes for the session, records the result as a
+    new document version and persists the operation.
+    Returns the response body and the reused elements.
+    """
+    session_id = get_prompt_session_id(data)
+    base = get_base_version(data, document_text)
+    version = version_store.add_version(
+        data['document_id'], content, parent=base['version'], source="model",
+        instructions=instructions, explanation=explanation,
+    )
+
+    # Log the full explanation (sampled, see LOG_PAYLOAD_SAMPLE)
+    log_payload("Full explanation", explanation)
+
+    # Parse the explanation to extract reused elements (chunked runs pass them pre-merged)
+    if reused_elements is None:
+        with timer("parse"):
+            reused_elements = parse_reused_elements(explanation)
+
+    # Log details of reused elements
+    logging.info(f"Reused {len(reused_elements)} elements from past operations.")
+    if reused_elements and payload_logging():
+        for element in reused_elements:
+            logging.info(f"Content reused: {element.get('content')}")
+            logging.info(f"Origin: {element.get('origin')}")
+            logging.info(f"Application: {element.get('application')}")
+
+    # Save changes for this session
+    change_store.put(session_id, {
+        "instructions": instructions,
+        "document_text": document_text,
+        "analysis": content,
+        "explanation": explanation,
+    })
+
+    response_data = {
+        "message": "Prompt processed successfully",
+        "analysis": content,
+        "explanation": explanation,
+        "session_id": session_id,
+        "document_id": data['document_id'],
+        "version": version,
+        "base_version": base['version'],
+    }
+    save_request_to_db(endpoint, data, response_data)
+
+    # Queue the request and response for bulk indexing
+    data_to_save = {
+        "instructions": instructions,
+        "document_text": document_text,
+        "analysis": content,
+        "explanation": explanation,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    search_indexer.add(data_to_save)
+    if current_app.config['TTS_PREGENERATE']:
+        tts_service.pregenerate(explanation)
+    if vector_indexer is not None:
+        vector_indexer.add(data_to_save)
+
+    return response_data, reused_elements
+
+def handle_process_prompt(data):
+    """
+    Analyzes and improves specific parts of the document based on instructions,
+    including information from past operations if relevant.
+    Returns the response body and HTTP status code.
+    """
+    instructions, document_text, error = validate_prompt_request(data)
+    if error:
+        return error
 
     try:
-        # Fetch related data from Elasticsearch
-        logging.info("Searching for related past operations in Elasticsearch.")
-        past_responses = search_in_elasticsearch("user_requests", instructions)
-
-        # Build context with previous responses
-        previous_info = ""
-        if past_responses:
-            logging.info("Details of found past operations:")
-            for i, response in enumerate(past_responses, 1):
-                previous_info += f"Previous Operation {i}:\n"
-                previous_info += f"Instructions: {response.get('instructions', 'N/A')}\n"
-                previous_info += f"Analysis: {response.get('analysis', 'N/A')}\n\n"
-                logging.info(f"Operation {i} Instructions: {response.get('instructions', 'N/A')}")
-                logging.info(f"Operation {i} Analysis: {response.get('analysis', 'N/A')[:500]}...")
-
-        logging.info(f"Found {len(past_responses)} related past operations.")
-
-        # Prompt instructions for OpenAI API
-        prompt_instructions = (
-            f"Using the following instructions:\n\n{instructions}\n\n"
-            "Please analyze the document below and make improvements specifically "
-            "based on the instructions provided. This includes:\n"
-            "1. Adding any missing or necessary information.\n"
-            "2. Removing redundant or unnecessary information.\n"
-            "3. Rephrasing unclear or overly complex sentences to improve readability.\n"
-            "4. Keeping unchanged parts of the document intact if they do not require any updates.\n\n"
-            "Consider the following previous operations if relevant:\n\n"
-            f"{previous_info}\n\n"
-            "**Important:** If any information from past operations is reused, you must specify clearly:\n"
-            "1. **Exact elements reused**: List the specific phrases, sentences, or ideas taken from previous operations.\n"
-            "2. **Origin of elements**: Indicate from which specific operation each element was taken.\n"
-            "3. **Application in current analysis**: Explain how each element was applied in the current document.\n\n"
-            "At the end of the modified document, provide a detailed explanation of the changes made, structured as follows:\n"
-            "1. **Summary of new changes**: Briefly summarize the improvements made.\n"
-            "2. **Detailed List of Reused Elements**: For each reused element, provide its exact content, origin, and how it was used.\n"
-            "   - If no information was reused from previous operations, state explicitly: 'No information was reused from previous operations.'\n\n"
-            "Ensure that you include the section 'Detailed List of Reused Elements' in your explanation, even if it states that no information was reused.\n\n"
-            f"Document:\n{document_text}\n\n"
-            "**Output format:**\n"
-            "1. **Updated Document Content**\n"
-            "2. **Explanation of Changes** (prefixed with 'Explanation:')\n"
-            "   - **Summary of New Changes**\n"
-            "   - **Detailed List of Reused Elements**\n"
-            "     - For each element:\n"
-            "       - Exact content reused\n"
-            "       - Origin (which previous operation)\n"
-            "       - How it was applied\n"
-        )
+        # Follow-up prompts on a versioned document only re-process the targeted regions
+        if data.get('document_id') and data.get('incremental', True):
+            base = get_base_version(data, document_text)
+            result = process_document_incrementally(data, instructions, base) if base['version'] > 1 else None
+            if result is not None:
+                content, explanation, reused_elements, region_info = result
+                response_data, _ = finalize_prompt(
+                    data, instructions, document_text, content, explanation, reused_elements=reused_elements
+                )
+                return {**response_data, "regions": region_info}, 200
 
-        # Send data to OpenAI API
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a text improvement assistant."},
-                {"role": "user", "content": prompt_instructions},
-            ],
-            max_tokens=2000,
-            temperature=0.5,
-        )
-        analysis = response.choices[0].message["content"]
-        logging.info(f"Analysis completed (first 500 chars): {analysis[:500]}...")
+        if estimate_tokens(document_text) > CHUNK_THRESHOLD_TOKENS:
+            content, explanation, reused_elements, chunk_info = process_document_in_chunks(
+                data, instructions, document_text
+            )
+            response_data, _ = finalize_prompt(
+                data, instructions, document_text, content, explanation, reused_elements=reused_elements
+            )
+            return {**response_data, "chunks": chunk_info}, 200
+
+        # Send data to the language model
+        previous_info = lookup_previous_info(instructions)
+        analysis = complete_prompt(instructions, document_text, previous_info)
+        log_payload("Analysis completed", analysis)
 
         # Split the analysis into document content and explanation
-        if "Explanation:" in analysis:
-            content, explanation = analysis.split("Explanation:", 1)
-            content = content.strip()
-            explanation = explanation.strip()
-        else:
-            content = analysis.strip()
-            explanation = "No explanation provided by the model."
-
-        # Log the full explanation
-        logging.info(f"Full explanation:\n{explanation}")
-
-        # Parse the explanation to extract reused elements
-        reused_elements = parse_reused_elements(explanation)
-
-        # Log details of reused elements
-        if reused_elements:
-            logging.info("Reused elements from past operations:")
-            for element in reused_elements:
-                logging.info(f"Content reused: {element['content']}")
-                logging.info(f"Origin: {element['origin']}")
-                logging.info(f"Application: {element['application']}")
-        else:
-            logging.info("No reused elements from past operations.")
-
-        # Save changes to temp_changes
-        temp_changes = {
-            "instructions": instructions,
-            "document_text": document_text,
-            "analysis": content,
-            "explanation": explanation,
-        }
-
-        response_data = {"message": "Prompt processed successfully", "analysis": content, "explanation": explanation}
-        save_request_to_db('/process_prompt', data, response_data)
-
-        # Save the request and response to Elasticsearch
-        data_to_save = {
-            "instructions": instructions,
-            "document_text": document_text,
-            "analysis": content,
-            "explanation": explanation,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        save_to_elasticsearch("user_requests", data_to_save)
-
-        return jsonify(response_data), 200
+        with timer("parse"):
+            content, explanation, reused_elements = parse_analysis(analysis)
+
+        response_data, _ = finalize_prompt(
+            data, instructions, document_text, content, explanation, reused_elements=reused_elements
+        )
+        return response_data, 200
 
     except Exception as e:
         logging.error(f"Error during prompt processing: {e}")
         response = {"error": "Failed to process prompt"}
         save_request_to_db('/process_prompt', data, response)
-        return jsonify(response), 500
+        return response, 500
+
+# API for prompt processing
+@api.route('/process_prompt', methods=['POST'])
+def process_prompt():
+    """
+    Process the prompt synchronously in the request thread.
+    """
+    logging.info("Processing prompt endpoint was accessed.")
+    response, status = handle_process_prompt(request.json)
+    return jsonify(response), status
+
+def sse_event(event, data):
+    """
+    Formats a single Server-Sent Events message with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# API for streaming prompt processing
+@api.route('/process_prompt_stream', methods=['POST'])
+def process_prompt_stream():
+    """
+    Streams the model output as Server-Sent Events while it is generated.
+    Emits 'content' and 'explanation' events with text deltas, then a final
+    'result' event with the parsed response (or an 'error' event).
+    Documents larger than the model context are processed chunk by chunk (as in
+    /process_prompt): the deltas of each selected chunk carry its "chunk" index and
+    the 'result' event holds the stitched document and the chunk info.
+    """
+    logging.info("Streaming prompt endpoint was accessed.")
+    data = request.json
+    instructions, document_text, error = validate_prompt_request(data, '/process_prompt_stream')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    def new_splitter():
+        return StructuredOutputParser() if OUTPUT_FORMAT == "json" else ExplanationSplitter()
+
+    def stream_parts(text, previous_info, event_data):
+        # Yields SSE events for the model output on one text and returns its parsed result
+        splitter = new_splitter()
+        for token in stream_prompt(instructions, text, previous_info):
+            for section, piece in splitter.feed(token):
+                yield sse_event(section, {"text": piece, **event_data})
+        with timer("parse"):
+            content, explanation = splitter.finish()
+        return content, explanation, splitter.reused_elements
+
+    def generate():
+        try:
+            previous_info = lookup_previous_info(instructions)
+            chunk_info = None
+            if estimate_tokens(document_text) > CHUNK_THRESHOLD_TOKENS:
+                chunks = split_into_chunks(document_text)
+                selected = select_document_chunks(data, instructions, chunks)
+                logging.info(f"Streaming {len(selected)} of {len(chunks)} document chunks.")
+                updated = {}
+                for index in sorted(set(selected)):
+                    updated[index] = yield from stream_parts(chunks[index].strip(), previous_info, {"chunk": index})
+                content, explanation, reused_elements = merge_chunks(chunks, updated)
+                chunk_info = {"total": len(chunks), "processed": selected}
+            else:
+                content, explanation, reused_elements = yield from stream_parts(document_text, previous_info, {})
+            response_data, reused_elements = finalize_prompt(
+                data, instructions, document_text, content, explanation, '/process_prompt_stream',
+                reused_elements
+            )
+            if chunk_info is not None:
+                response_data = {**response_data, "chunks": chunk_info}
+            yield sse_event("result", {**response_data, "reused_elements": reused_elements})
+        except Exception as e:
+            logging.error(f"Error during streaming prompt processing: {e}")
+            response = {"error": "Failed to process prompt"}
+            save_request_to_db('/process_prompt_stream', data, response)
+            yield sse_event("error", response)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+def flush_background_writers():
+    """
+    Waits for queued request log and index writes. Only needed in process-mode job
+    workers, which exit without running atexit hooks.
+    """
+    if job_queue.mode != "process":
+        return
+    audit_log.flush()
+    search_indexer.flush()
+    if vector_indexer is not None:
+        vector_indexer.flush()
+
+def submit_job(kind, payload):
+    """
+    Queues a job that runs on the current app (its folders and flags).
+    """
+    return job_queue.submit(kind, {**payload, "app_id": current_app.extensions['app_id']})
+
+def job_app(payload):
+    """
+    Returns the app a job was submitted from. Jobs recovered after a restart and jobs run
+    in JOB_EXECUTOR=process children use the app built from the environment.
+    """
+    return apps.get(payload.pop("app_id", None)) or app
+
+def run_upload_job(payload):
+    """
+    Job handler for asynchronous uploads.
+    """
+    with job_app(payload).app_context():
+        response, status = handle_upload(payload["file_path"], payload["file_name"], payload["file_hash"])
+    flush_background_writers()
+    if status >= 400:
+        raise JobError(response.get("error", "Upload failed"))
+    return response
+
+def run_process_prompt_job(payload):
+    """
+    Job handler for asynchronous prompt processing.
+    """
+    with job_app(payload).app_context():
+        response, status = handle_process_prompt(payload)
+    flush_background_writers()
+    if status >= 400:
+        raise JobError(response.get("error", "Prompt processing failed"))
+    return response
+
+job_queue.register("upload", run_upload_job)
+job_queue.register("process_prompt", run_process_prompt_job)
+
+@api.route('/jobs/upload', methods=['POST'])
+def enqueue_upload():
+    """
+    Saves the uploaded file and queues its processing. Returns a job id immediately.
+    """
+    file_path, file_name, file_hash, error = receive_upload()
+    if error:
+        return jsonify(error[0]), error[1]
+
+    job_id = submit_job("upload", {"file_path": file_path, "file_name": file_name, "file_hash": file_hash})
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+@api.route('/jobs/process_prompt', methods=['POST'])
+def enqueue_process_prompt():
+    """
+    Queues prompt processing. Returns a job id immediately.
+    """
+    data = request.json or {}
+    # Same checks as /process_prompt, so document_id follow-ups are accepted here too
+    _, _, error = validate_prompt_request(data, '/jobs/process_prompt')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    session_id = get_prompt_session_id(data)
+    job_id = submit_job("process_prompt", data)
+    return jsonify({"job_id": job_id, "session_id": session_id, "status": "queued"}), 202
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Returns the status of a job, with its result or error once it has finished.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@api.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    Returns the result of a finished job (202 while it is still pending).
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "done":
+        return jsonify(job["result"]), 200
+    if job["status"] == "failed":
+        return jsonify({"error": job["error"]}), 500
+    return jsonify({"job_id": job_id, "status": job["status"]}), 202
+
+def batch_stages(flask_app, instructions, extract_workers=BATCH_EXTRACT_WORKERS,
+                 retrieve_workers=BATCH_RETRIEVE_WORKERS, llm_workers=BATCH_LLM_WORKERS):
+    """
+    Pipeline stages of a batch for BatchRunner: extraction (through the extraction cache),
+    lookup of related past operations and the model call, each with its own thread pool.
+    The stage threads run in the app context of flask_app. Results are only logged and
+    indexed (finalize_batch_document), not versioned or voiced like interactive prompts.
+    """
+    previous_info = {}
+    previous_info_lock = threading.Lock()
+
+    def extract(record):
+        with flask_app.app_context():
+            response, status = handle_upload(record['path'], record['file'], record['file_hash'])
+        results = response.get('results', {})
+        if status >= 400 or 'text' not in results:
+            raise ValueError(results.get('error') or response.get('error') or "Extraction failed")
+        record['_text'] = results['text'].strip()
+
+    def retrieve(record):
+        # Related operations depend only on the instructions, so they are looked up once per batch
+        with previous_info_lock:
+            if 'value' not in previous_info:
+                with flask_app.app_context():
+                    previous_info['value'] = lookup_previous_info(instructions)
+        record['_previous_info'] = previous_info['value']
+
+    def generate(record):
+        document_text = record['_text']
+        data = {"instructions": instructions, "document_text": document_text}
+        with flask_app.app_context():
+            if estimate_tokens(document_text) > CHUNK_THRESHOLD_TOKENS:
+                content, explanation, reused_elements, record['chunks'] = process_document_in_chunks(
+                    data, instructions, document_text, record['_previous_info']
+                )
+            else:
+                analysis = complete_prompt(instructions, document_text, record['_previous_info'])
+                with timer("parse"):
+                    content, explanation, reused_elements = parse_analysis(analysis)
+            reused_elements = finalize_batch_document(data, content, explanation, reused_elements)
+        record.update(analysis=content, explanation=explanation, reused_elements=reused_elements)
+
+    return [("extract", extract, extract_workers), ("retrieve", retrieve, retrieve_workers), ("llm", generate, llm_workers)]
+
+def finalize_batch_document(data, content, explanation, reused_elements=None):
+    """
+    Records one processed batch document: the request log entry and the search index
+    (so later prompts find it as a past operation). Returns the reused elements.
+    """
+    if reused_elements is None:
+        with timer("parse"):
+            reused_elements = parse_reused_elements(explanation)
+    save_request_to_db('/batch', data, {"analysis": content, "explanation": explanation})
+    search_indexer.add({
+        "instructions": data['instructions'],
+        "document_text": data['document_text'],
+        "analysis": content,
+        "explanation": explanation,
+        "timestamp": datetime.utcnow().isoformat()
+    })
+    return reused_elements
+
+def run_batch(items, instructions, output_path, in_flight=BATCH_IN_FLIGHT, **workers):
+    """
+    Runs one instruction over many documents ({"file", "path", "file_hash"}), appending a
+    JSON line per document to output_path. Documents already done in output_path are skipped.
+    Runs on the current app.
+    """
+    stages = batch_stages(current_app._get_current_object(), instructions, **workers)
+    runner = BatchRunner(stages, output_path, in_flight)
+    return runner.run(items, instructions)
+
+def batch_paths(batch_id):
+    """
+    Returns the manifest and results paths of a batch, or None for a malformed id.
+    """
+    if not re.fullmatch(r"[0-9a-f]{32}", batch_id):
+        return None
+    base = os.path.join(current_app.config['BATCH_FOLDER'], batch_id)
+    return f"{base}.json", f"{base}.jsonl"
+
+def run_batch_job(payload):
+    """
+    Job handler for /batch. A recovered job resumes from the documents already in its results file.
+    """
+    with job_app(payload).app_context():
+        summary = run_batch(payload["items"], payload["instructions"], batch_paths(payload["batch_id"])[1])
+    flush_background_writers()
+    return summary
+
+job_queue.register("batch", run_batch_job)
+
+# API for processing many documents with one instruction
+@api.route('/batch', methods=['POST'])
+def create_batch():
+    """
+    Accepts multipart "files" (PDFs, images or .zip archives of them) and an "instructions"
+    field and queues the batch. Returns the batch id immediately; results are written as
+    JSON lines while documents finish (GET /batch/<batch_id>/results).
+    """
+    logging.info("Batch endpoint was accessed.")
+    upload_store = get_upload_store()
+    try:
+        form, parsed_files = parse_upload_form(upload_store)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    instructions = form.get('instructions', '').strip()
+    files = [file for file in parsed_files.getlist('files') if file.filename]
+    if not instructions or not files:
+        discard_uploads(parsed_files)
+        return jsonify({"error": "Instructions and at least one file are required."}), 400
+    discard_uploads(parsed_files, keep=files)
+
+    items = []
+    try:
+        for index, file in enumerate(files):
+            try:
+                file_path, file_hash = file.stream.finish()
+            except BaseException:
+                for rest in files[index:]:
+                    rest.stream.discard()
+                raise
+            if file.filename.lower().endswith('.zip'):
+                items.extend(extract_zip(file_path, upload_store))
+                os.remove(file_path)
+            else:
+                items.append({"file": file.filename, "path": file_path, "file_hash": file_hash})
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    if not items:
+        return jsonify({"error": "No supported documents in the upload."}), 400
+
+    batch_id = uuid.uuid4().hex
+    manifest_path, _ = batch_paths(batch_id)
+    job_id = submit_job("batch", {"batch_id": batch_id, "instructions": instructions, "items": items})
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"batch_id": batch_id, "job_id": job_id, "instructions": instructions, "total": len(items),
+                   "files": [item["file"] for item in items]}, f)
+    return jsonify({"batch_id": batch_id, "job_id": job_id, "total": len(items), "status": "queued"}), 202
+
+def load_batch_manifest(batch_id):
+    paths = batch_paths(batch_id)
+    if paths is None or not os.path.exists(paths[0]):
+        return None, None
+    with open(paths[0], "r", encoding="utf-8") as f:
+        return json.load(f), paths[1]
+
+@api.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """
+    Returns the progress of a batch (documents done, failed and pending) and its job status.
+    """
+    manifest, results_path = load_batch_manifest(batch_id)
+    if manifest is None:
+        return jsonify({"error": "Batch not found"}), 404
+    job = job_queue.get(manifest['job_id'])
+    return jsonify({
+        "batch_id": batch_id,
+        "status": job["status"] if job else "unknown",
+        **batch_progress(results_path, manifest['total'], manifest['instructions']),
+    }), 200
+
+@api.route('/batch/<batch_id>/results', methods=['GET'])
+def get_batch_results(batch_id):
+    """
+    Streams the JSON lines written so far (one per finished document).
+    """
+    manifest, results_path = load_batch_manifest(batch_id)
+    if manifest is None:
+        return jsonify({"error": "Batch not found"}), 404
+
+    def generate():
+        if not os.path.exists(results_path):
+            return
+        with open(results_path, "r", encoding="utf-8") as f:
+            yield from f
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+def get_session_changes():
+    """
+    Looks up the stored changes for the session id (query parameter or X-Session-Id header)
+    or for the session of a finished prompt job.
+    """
+    session_id = request.args.get('session_id') or request.headers.get('X-Session-Id')
+    job_id = request.args.get('job_id')
+    if not session_id and job_id:
+        job = job_queue.get(job_id)
+        if job and job["result"]:
+            session_id = job["result"].get("session_id")
+    if not session_id:
+        return None
+    return change_store.get(session_id)
 
 # API for speaking changes
-@app.route('/speak_changes', methods=['GET'])
+@api.route('/speak_changes', methods=['GET'])
 def speak_changes():
     """
-    Speaks the latest changes.
+    Speaks the latest changes of a session (?session_id=... or ?job_id=...).
+    Audio is served from the TTS cache (usually pre-generated) and streamed chunk by chunk.
     """
-    global temp_changes
-    if not temp_changes:
+    changes = get_session_changes()
+    if not changes:
         return jsonify({"error": "No changes available for speaking."}), 400
 
     # Text to speak (explanation of changes)
-    text_to_speak = temp_changes.get('explanation', 'No explanation available.')
-    audio_path = os.path.join(app.config['TEMP_FOLDER'], 'output.mp3')
+    text_to_speak = changes.get('explanation') or 'No explanation available.'
+    lang = request.args.get('lang', 'en')
 
     try:
-        # Use gTTS for speech synthesis
-        tts = gTTS(text=text_to_speak, lang='en')  # Choose language, e.g., 'en' for English
-        tts.save(audio_path)
-
-        return send_file(audio_path, as_attachment=True)
+        audio_chunks = tts_service.stream(text_to_speak, lang)
+        # Wait for the first chunk so synthesis errors still produce an error response
+        first_chunk = next(audio_chunks)
     except Exception as e:
-        logging.error(f"Error during speech synthesis with gTTS: {e}")
+        logging.error(f"Error during speech synthesis: {e}")
         return jsonify({"error": "Failed to generate speech."}), 500
 
-@app.route('/save_to_elasticsearch', methods=['POST'])
+    def generate():
+        yield first_chunk
+        yield from audio_chunks
+
+    filename = f"output.{tts_service.synthesizer.extension}"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    return Response(stream_with_context(generate()), mimetype=tts_service.mimetype, headers=headers)
+
+@api.route('/stats', methods=['GET'])
+def stats():
+    """
+    Returns cache statistics.
+    """
+    return jsonify({
+        "extraction_cache": extraction_cache.stats(),
+        "llm_cache": llm_cache.stats(),
+        "models": model_registry.stats(),
+        "pdf_export": pdf_export_stats(),
+        "audit_log": audit_log.stats(),
+        "search_indexer": search_indexer.stats(),
+        "tts": tts_service.stats(),
+        "uploads": get_upload_store().stats(),
+        "llm_rate_limiter": llm_rate_limiter.stats(),
+        "structured_output": structured_output_stats(),
+        "vector_indexer": vector_indexer.stats() if vector_indexer is not None else None,
+    }), 200
+
+# Component statistics are exported as gauges on /metrics
+metrics_registry.collector("extraction_cache", extraction_cache.stats)
+metrics_registry.collector("llm_cache", llm_cache.stats)
+metrics_registry.collector("pdf_export", pdf_export_stats)
+metrics_registry.collector("audit_log", audit_log.stats)
+metrics_registry.collector("search_indexer", search_indexer.stats)
+metrics_registry.collector("tts", tts_service.stats)
+metrics_registry.collector("llm_rate_limiter", llm_rate_limiter.stats)
+metrics_registry.collector("structured_output", structured_output_stats)
+if vector_indexer is not None:
+    metrics_registry.collector("vector_indexer", vector_indexer.stats)
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Returns stage timings, token counters and component statistics in the Prometheus text format.
+    """
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+@api.before_app_request
+def begin_request_trace():
+    """
+    Starts the per-request stage trace and decides whether this request logs payloads.
+    """
+    request.started_at = time.perf_counter()
+    start_trace()
+
+@api.after_app_request
+def finish_request_trace(response):
+    """
+    Records the request duration and, with TRACE_HEADERS=1 or an "X-Trace: 1" request header,
+    returns the stage timings as Server-Timing. Streaming responses are measured up to the headers.
+    """
+    elapsed = time.perf_counter() - getattr(request, 'started_at', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    trace = end_trace()
+    if TRACE_HEADERS or request.headers.get('X-Trace') == '1':
+        response.headers['Server-Timing'] = ", ".join(
+            part for part in (server_timing(trace), f"total;dur={elapsed * 1000:.1f}") if part
+        )
+        response.headers['X-Request-ID'] = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    return response
+
+@api.route('/save_to_elasticsearch', methods=['POST'])
 def save_to_elasticsearch_endpoint():
     """
     Saves data to Elasticsearch.
@@ -364,7 +1281,7 @@ def save_to_elasticsearch_endpoint():
         logging.error(f"Error saving to Elasticsearch: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/search_in_elasticsearch', methods=['POST'])
+@api.route('/search_in_elasticsearch', methods=['POST'])
 def search_in_elasticsearch_endpoint():
     """
     Searches data in Elasticsearch.
@@ -382,16 +1299,166 @@ def search_in_elasticsearch_endpoint():
         logging.error(f"Error searching in Elasticsearch: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/get_explanation', methods=['GET'])
+@api.route('/get_explanation', methods=['GET'])
 def get_explanation():
     """
-    Returns the explanation text.
+    Returns the explanation text of a session (?session_id=... or ?job_id=...).
     """
-    global temp_changes
-    if not temp_changes or 'explanation' not in temp_changes:
+    changes = get_session_changes()
+    if not changes or not changes.get('explanation'):
         return jsonify({"error": "No explanation available"}), 400
 
-    return jsonify({"explanation": temp_changes['explanation']}), 200
+    return jsonify({"explanation": changes['explanation']}), 200
+
+# APIs for document versions
+@api.route('/documents/<document_id>', methods=['GET'])
+def get_document(document_id):
+    """
+    Returns a document version with its text (?version=N, latest by default).
+    """
+    version = version_store.get_version(document_id, request.args.get('version', type=int))
+    if version is None:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify(version), 200
+
+@api.route('/documents/<document_id>/versions', methods=['GET'])
+def list_document_versions(document_id):
+    """
+    Returns the version history of a document (without texts).
+    """
+    versions = version_store.list_versions(document_id)
+    if not versions:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify({"document_id": document_id, "versions": versions}), 200
+
+@api.route('/documents/<document_id>/versions', methods=['POST'])
+def save_document_version(document_id):
+    """
+    Stores the text edited on the client (accepted/rejected changes) as a new version.
+    """
+    data = request.json or {}
+    text = data.get('text', '').strip()
+    if not text:
+        return jsonify({"error": "Text is required"}), 400
+    latest = version_store.get_version(document_id)
+    if latest is not None and latest['text'] == text:
+        return jsonify({"document_id": document_id, "version": latest['version']}), 200
+    number = version_store.add_version(
+        document_id, text, parent=data.get('base_version') or (latest['version'] if latest else None)
+    )
+    return jsonify({"document_id": document_id, "version": number}), 201
+
+@api.route('/documents/<document_id>/diff', methods=['GET'])
+def get_document_diff(document_id):
+    """
+    Returns the paragraph/sentence-level diff between two versions
+    (?from=N&to=M; by default the latest version against its parent).
+    """
+    target = version_store.get_version(document_id, request.args.get('to', type=int))
+    if target is None:
+        return jsonify({"error": "Document not found"}), 404
+    source_version = request.args.get('from', type=int) or target['parent']
+    source = version_store.get_version(document_id, source_version) if source_version else None
+    if source is None:
+        return jsonify({"error": "No version to compare with"}), 400
+    return jsonify({
+        "document_id": document_id,
+        "from": source['version'],
+        "to": target['version'],
+        "diff": structural_diff(source['text'], target['text']),
+    }), 200
+
+def get_export_pages(data):
+    """
+    Resolves the pages to export: a stored document version (document_id, optional version),
+    the structured pages of an uploaded file (file_hash) or text/pages sent directly.
+    Returns (pages, filename) or None if the document is unknown.
+    """
+    if data.get('document_id'):
+        version = version_store.get_version(data['document_id'], int(data['version']) if data.get('version') else None)
+        if version is None:
+            return None
+        return text_to_pages(version['text']), f"{data['document_id']}_v{version['version']}.pdf"
+    if data.get('file_hash'):
+        pack = get_document_structure(data['file_hash'])
+        if pack is None:
+            return None
+        return list(pack.page_texts()), f"{data['file_hash'][:12]}.pdf"
+    if data.get('pages'):
+        return [
+            {"page_number": page.get('page_number', number), "text": page.get('text', '')}
+            for number, page in enumerate(data['pages'], start=1)
+        ], "document.pdf"
+    return text_to_pages(data.get('text', '')), "document.pdf"
+
+# API for exporting a document (with the accepted changes) as PDF
+@api.route('/export', methods=['POST'])
+def export_document():
+    """
+    Renders a document to PDF in memory and sends it in chunks (no temp file is written).
+    Fonts are parsed once per process and font subsets are cached (see utils.pdf_export).
+    """
+    data = request.json or {}
+    if not any(data.get(field) for field in ('document_id', 'file_hash', 'pages', 'text')):
+        return jsonify({"error": "document_id, file_hash, pages or text is required"}), 400
+
+    try:
+        resolved = get_export_pages(data)
+        if resolved is None:
+            return jsonify({"error": "Document not found"}), 404
+        pages, filename = resolved
+        # Render before responding so rendering errors still produce an error response
+        chunks = pdf_chunks(pages)
+        first_chunk = next(chunks)
+    except Exception as e:
+        logging.error(f"Error during PDF export: {e}")
+        return jsonify({"error": "Failed to export document"}), 500
+
+    def generate():
+        yield first_chunk
+        yield from chunks
+
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    return Response(stream_with_context(generate()), mimetype="application/pdf", headers=headers)
+
+def create_app(config=None):
+    """
+    Application factory: creates the Flask app, applies config overrides and registers the API.
+    """
+    app = Flask(__name__)
+    CORS(app)  # To allow requests from the frontend
+
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['TEMP_FOLDER'] = TEMP_FOLDER
+    app.config['BATCH_FOLDER'] = BATCH_FOLDER
+    app.config['RETRIEVER'] = os.getenv("RETRIEVER", "keyword")
+    app.config['TTS_PREGENERATE'] = os.getenv("TTS_PREGENERATE", "1") == "1"
+    if config:
+        app.config.update(config)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['TEMP_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['BATCH_FOLDER'], exist_ok=True)
+
+    # Per-app state: the upload store lives in the app's folder, jobs find the app by its id
+    app.extensions['upload_store'] = UploadStore(app.config['UPLOAD_FOLDER'])
+    app.extensions['app_id'] = uuid.uuid4().hex
+    apps[app.extensions['app_id']] = app
+    # One series per process: a later app (e.g. in tests) replaces the collector of the previous one
+    metrics_registry.collector("uploads", app.extensions['upload_store'].stats)
+
+    app.register_blueprint(api)
+
+    # Transformers models are loaded once per process: at startup with MODEL_PRELOAD=1, otherwise on first use
+    if MODEL_PRELOAD:
+        preload_validation_model()
+
+    # Jobs abandoned by dead workers are re-queued in the background so the worker can serve requests right away
+    if os.getenv("JOB_RECOVER", "1") == "1":
+        job_queue.start_recovery()
+
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     logging.info("Starting Flask application.")
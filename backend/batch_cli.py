@@ -0,0 +1,71 @@
+"""
+Runs one instruction over many documents through the backend pipeline (extraction,
+retrieval of related past operations, model call) and appends one JSON line per
+document to the output file as soon as it is done. Inputs are PDFs or images,
+directories (searched recursively) and .zip archives.
+
+    python batch_cli.py --instructions "Fix the dates" --output results.jsonl docs/ scans.zip
+
+Running it again with the same --output resumes the batch: documents already recorded
+as done are skipped and failed ones are retried.
+"""
+import argparse
+import json
+import os
+import sys
+
+from utils.batch import (
+    BATCH_EXTRACT_WORKERS,
+    BATCH_IN_FLIGHT,
+    BATCH_LLM_WORKERS,
+    BATCH_RETRIEVE_WORKERS,
+    collect_inputs,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="PDF or image files, directories or .zip archives.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--instructions", help="Instruction applied to every document.")
+    group.add_argument("--instructions-file", help="Read the instruction from this file.")
+    parser.add_argument("--output", required=True, help="JSONL results file (appended to; used to resume).")
+    parser.add_argument("--extract-workers", type=int, default=BATCH_EXTRACT_WORKERS)
+    parser.add_argument("--retrieve-workers", type=int, default=BATCH_RETRIEVE_WORKERS)
+    parser.add_argument("--llm-workers", type=int, default=BATCH_LLM_WORKERS)
+    parser.add_argument("--in-flight", type=int, default=BATCH_IN_FLIGHT, help="Documents in the pipeline at once.")
+    parser.add_argument("--llm-rpm", type=float, help="Model requests per minute (default: LLM_RATE_LIMIT_RPM).")
+    args = parser.parse_args()
+
+    instructions = args.instructions
+    if args.instructions_file:
+        with open(args.instructions_file, "r", encoding="utf-8") as f:
+            instructions = f.read()
+    if not instructions.strip():
+        parser.error("The instruction is empty.")
+
+    # The backend is imported only after the arguments are valid; queued server jobs are not resumed here
+    os.environ.setdefault("JOB_RECOVER", "0")
+    import app as backend
+    from utils.llm import rate_limiter
+
+    if args.llm_rpm is not None:
+        rate_limiter.set_rate(args.llm_rpm)
+
+    items = collect_inputs(args.inputs, backend.app.extensions['upload_store'])
+    if not items:
+        parser.error("No supported documents found.")
+
+    with backend.app.app_context():
+        summary = backend.run_batch(
+            items, instructions.strip(), args.output, args.in_flight,
+            extract_workers=args.extract_workers,
+            retrieve_workers=args.retrieve_workers,
+            llm_workers=args.llm_workers,
+        )
+    print(json.dumps({"total": len(items), **summary}, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
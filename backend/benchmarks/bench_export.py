@@ -0,0 +1,103 @@
+"""
+Compares PDF export of the sample documents in static/uploaded_docs: the previous
+save_styled_pdf (new FPDF and four TTF fonts per call, all fonts embedded) against
+utils.pdf_export (fonts parsed once per process, cached font subsets), cold and warm.
+
+    python -m benchmarks.bench_export --runs 5 --workers 1 --repeat 1
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+from utils import pdf_export
+from utils.file_processing import iter_pages
+
+
+def legacy_render(pages):
+    """The previous save_styled_pdf, rendering to memory instead of a file."""
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    for style, file_name in pdf_export.FONT_FILES:
+        pdf.add_font('DejaVu', style, os.path.join(pdf_export.EXPORT_FONT_DIR, file_name), uni=True)
+    for page in pages:
+        pdf.add_page()
+        pdf.set_font('DejaVu', style="B", size=14)
+        pdf.cell(200, 10, f"Page {page['page_number']}", ln=True, align='C')
+        pdf.set_font('DejaVu', size=12)
+        if page["text"]:
+            pdf.multi_cell(0, 10, page["text"])
+    return pdf.output(dest='S').encode("latin-1")
+
+
+def timed(function, runs):
+    timings, size = [], 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        size = len(function())
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, size
+
+
+def load_documents(pattern, repeat):
+    documents = {}
+    for path in sorted(glob.glob(pattern)):
+        pages = [{"page_number": page["page_number"], "text": page["text"]} for page in iter_pages(path, ocr=False)]
+        # --repeat makes longer documents from the same pages
+        pages = [dict(page, page_number=number) for number, page in enumerate(pages * repeat, start=1)]
+        documents[os.path.basename(path)] = pages
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", default="static/uploaded_docs/*.pdf", help="Glob of PDFs to export.")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per document and renderer.")
+    parser.add_argument("--repeat", type=int, default=1, help="Repeat the pages of each document N times.")
+    parser.add_argument("--workers", type=int, default=pdf_export.EXPORT_WORKERS, help="Render workers.")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    documents = load_documents(args.files, args.repeat)
+    if not documents:
+        parser.error(f"No files match {args.files}")
+
+    # The first export of the process parses the fonts and builds the subsets
+    first_name, first_pages = next(iter(documents.items()))
+    cold, _ = timed(lambda: pdf_export.render_pdf(first_pages, workers=args.workers), 1)
+
+    results = []
+    for name, pages in documents.items():
+        legacy, legacy_size = timed(lambda: legacy_render(pages), args.runs)
+        cached, cached_size = timed(lambda: pdf_export.render_pdf(pages, workers=args.workers), args.runs)
+        results.append({
+            "file": name,
+            "pages": len(pages),
+            "legacy_ms": round(statistics.median(legacy), 1),
+            "export_ms": round(statistics.median(cached), 1),
+            "speedup": round(statistics.median(legacy) / statistics.median(cached), 1),
+            "legacy_bytes": legacy_size,
+            "export_bytes": cached_size,
+        })
+
+    output = json.dumps({
+        "runs": args.runs,
+        "workers": args.workers,
+        "cold_export_ms": {first_name: round(cold[0], 1)},
+        "documents": results,
+        "export_stats": pdf_export.stats(),
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
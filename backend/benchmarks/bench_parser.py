@@ -0,0 +1,157 @@
+"""
+Times parsing of long model responses: the text format (split_analysis and
+parse_reused_elements, ExplanationSplitter when streamed) against the json format
+(utils.structured_output, in one piece and streamed token by token). Before timing,
+a set of malformed responses checks that the json parser falls back to the text parser.
+
+    python -m benchmarks.bench_parser --sizes 10000,100000,1000000 --runs 5 --token-chars 4
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+from utils import structured_output
+from utils.prompt_processing import ExplanationSplitter, parse_reused_elements, split_analysis
+from utils.structured_output import StructuredOutputParser, format_explanation, parse_structured_output
+
+WORDS = ["the", "candidate", "led", "a", "team", "of", "engineers", "résumé", "with", "\"quoted\"",
+         "results", "on", "time", "and", "under", "budget", "naïve", "tab\there", "backslash\\path"]
+
+# Malformed responses in the json format and the content the fallback should recover
+MALFORMED = {
+    "text format": ("Improved text.\n\nExplanation: Summary of New Changes: none", "Improved text."),
+    "truncated": ('{"content": "Improved text.", "summary": "Fix', None),
+    "wrong type": ('{"content": ["Improved text."]}', None),
+    "missing content": ('{"summary": "none", "reused_elements": []}', None),
+    "invalid escape": ('{"content": "Improved \\q text."}', None),
+    "bad literal": ('{"content": "Improved text.", "reused_elements": nul}', None),
+}
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_response(size, rng):
+    """A response of about size characters: half document content, half explanation."""
+    content, length = [], 0
+    while length < size // 2:
+        paragraph = " ".join(sentence(rng, 12) for _ in range(5))
+        content.append(paragraph)
+        length += len(paragraph) + 2
+    elements, length = [], 0
+    while length < size // 2:
+        element = {"content": sentence(rng, 15), "origin": f"Previous Operation {rng.randint(1, 5)}",
+                   "application": sentence(rng, 20)}
+        elements.append(element)
+        length += sum(len(value) for value in element.values()) + 80
+    content, summary = "\n\n".join(content), sentence(rng, 30)
+    text = f"{content}\n\nExplanation: {format_explanation(summary, elements)}"
+    structured = json.dumps({"content": content, "summary": summary, "reused_elements": elements}, ensure_ascii=False)
+    return text, structured, len(elements)
+
+
+def tokens(text, size):
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+
+def legacy_parse(text):
+    content, explanation = split_analysis(text)
+    return content, parse_reused_elements(explanation)
+
+
+def legacy_stream(pieces):
+    splitter = ExplanationSplitter()
+    for piece in pieces:
+        splitter.feed(piece)
+    content, explanation = splitter.finish()
+    return content, parse_reused_elements(explanation)
+
+
+def structured_parse(text):
+    content, _, reused_elements = parse_structured_output(text)
+    return content, reused_elements
+
+
+def structured_stream(pieces):
+    parser = StructuredOutputParser()
+    for piece in pieces:
+        parser.feed(piece)
+    content, _ = parser.finish()
+    return content, parser.reused_elements
+
+
+def timed(function, argument, runs):
+    timings, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function(argument)
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 1), result
+
+
+def check_fallbacks(token_chars):
+    """Every malformed response still yields the text parser result, in one piece and streamed."""
+    failures = []
+    for name, (response, expected) in MALFORMED.items():
+        expected = split_analysis(response)[0] if expected is None else expected
+        if structured_parse(response)[0] != expected or structured_stream(tokens(response, token_chars))[0] != expected:
+            failures.append(name)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated response sizes in characters.")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per size and parser.")
+    parser.add_argument("--token-chars", type=int, default=4, help="Characters per streamed token.")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    failures = check_fallbacks(args.token_chars)
+    if failures:
+        print(f"Fallback check failed for: {', '.join(failures)}", file=sys.stderr)
+        return 1
+
+    rng = random.Random(args.seed)
+    results = []
+    for size in [int(value) for value in args.sizes.split(",")]:
+        text, structured, elements = make_response(size, rng)
+        text_tokens, structured_tokens = tokens(text, args.token_chars), tokens(structured, args.token_chars)
+        legacy_ms, legacy = timed(legacy_parse, text, args.runs)
+        legacy_stream_ms, _ = timed(legacy_stream, text_tokens, args.runs)
+        parse_ms, parsed = timed(structured_parse, structured, args.runs)
+        stream_ms, streamed = timed(structured_stream, structured_tokens, args.runs)
+        if parsed != streamed or parsed[0] != legacy[0] or len(parsed[1]) != elements:
+            print(f"Parsers disagree on the {size}-character response", file=sys.stderr)
+            return 1
+        results.append({
+            "chars": len(structured),
+            "reused_elements": elements,
+            "text_ms": legacy_ms,
+            "text_stream_ms": legacy_stream_ms,
+            "json_ms": parse_ms,
+            "json_stream_ms": stream_ms,
+            "json_stream_us_per_kchar": round(stream_ms * 1000 / (len(structured) / 1000), 1),
+        })
+
+    output = json.dumps({
+        "runs": args.runs,
+        "token_chars": args.token_chars,
+        "malformed_fallbacks": len(MALFORMED),
+        "responses": results,
+        "structured_output_stats": structured_output.stats(),
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
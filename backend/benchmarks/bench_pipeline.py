@@ -0,0 +1,512 @@
+"""
+End-to-end benchmark of the document pipeline against local stub servers for OpenAI,
+Elasticsearch and TTS (see benchmarks.stubs), on the PDFs in static/uploaded_docs plus
+synthetic large PDFs.
+
+* stages: the pipeline helpers run in-process on every document (extraction, structure,
+  chunking, retrieval, LLM call, diff, speech, PDF export), each timed separately;
+* load: the backend runs as a separate server process and N concurrent clients call
+  /upload, /process_prompt, /process_prompt_stream, /speak_changes and /export.
+
+Reports p50/p95/p99 latency, throughput, peak RSS and per-stage timings as JSON, so results of
+two commits can be compared:
+
+    python -m benchmarks.bench_pipeline --clients 1,4,16 --requests 40 --output before.json
+    python -m benchmarks.bench_pipeline --compare before.json after.json --threshold 1.2
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stubs import add_stub_arguments, fake_text, start_stubs_from_args
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("upload", "process_prompt", "process_prompt_stream", "speak_changes", "export")
+STAGES = ("extract", "structure", "chunk", "retrieve", "llm", "diff", "tts", "export")
+INSTRUCTIONS = "Shorten the summary and fix the grammar in the first section"
+
+SERVER_SCRIPT = "import sys; from app import app; app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"
+
+
+def percentiles(values_ms):
+    values = sorted(values_ms)
+    if not values:
+        return {}
+
+    def rank(q):
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values), 2),
+        "p50_ms": round(rank(0.50), 2),
+        "p95_ms": round(rank(0.95), 2),
+        "p99_ms": round(rank(0.99), 2),
+        "max_ms": round(values[-1], 2),
+    }
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def rss_mb(pid, field="VmRSS"):
+    """Resident (VmRSS) or peak resident (VmHWM) memory of a process from /proc; None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def self_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_pdf(path, pages):
+    """
+    A text PDF of the given page count with a core font: PDFs rendered with the embedded DejaVu
+    fonts carry a full-range ToUnicode map that makes PyPDF2 extraction far slower than usual.
+    """
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_font("Helvetica", size=11)
+    for number in range(1, pages + 1):
+        pdf.add_page()
+        for paragraph in range(5):
+            pdf.multi_cell(0, 6, fake_text(f"{pages}-{number}-{paragraph}", 60) + ".")
+            pdf.ln(4)
+    pdf.output(path)
+
+
+def build_documents(pattern, synthetic_pages, workdir):
+    """Sample PDFs plus synthetic ones with the given page counts."""
+    documents = [{"name": os.path.basename(path), "path": path} for path in sorted(glob.glob(pattern))]
+    for pages in synthetic_pages:
+        path = os.path.join(workdir, f"synthetic_{pages}p.pdf")
+        synthetic_pdf(path, pages)
+        documents.append({"name": os.path.basename(path), "path": path})
+    for document in documents:
+        with open(document["path"], "rb") as f:
+            document["data"] = f.read()
+    return documents
+
+
+def extract_texts(documents):
+    """Extracts the text of every document; documents without text (scans without --ocr) are dropped."""
+    from utils.file_processing import process_file
+
+    extracted = []
+    for document in documents:
+        result = process_file(document["path"])
+        if "error" in result:
+            print(f"Skipping {document['name']}: {result['error']}", file=sys.stderr)
+            continue
+        extracted.append({**document, "text": result["text"]})
+    return extracted
+
+
+def run_stages(documents, runs):
+    """Times each pipeline helper in-process on every document."""
+    from utils.chunking import split_into_chunks
+    from utils.document_versions import structural_diff
+    from utils.file_processing import iter_page_structures, process_file
+    from utils.llm import OpenAIChatClient
+    from utils.pdf_export import render_pdf, text_to_pages
+    from utils.prompt_processing import build_messages, build_previous_info, build_prompt, split_analysis
+    from utils.search_store import ElasticsearchStore
+    from utils.tts import HTTPSynthesizer, split_sentences
+
+    store, client, synthesizer = ElasticsearchStore(), OpenAIChatClient(), HTTPSynthesizer()
+    store.search("user_requests", INSTRUCTIONS)  # Creates the Elasticsearch client outside the timings
+    results = []
+    for document in documents:
+        timings = {stage: [] for stage in STAGES}
+        for run in range(runs):
+            _, elapsed = timed(process_file, document["path"])
+            timings["extract"].append(elapsed)
+            text = document["text"]
+            structure, elapsed = timed(lambda: list(iter_page_structures(document["path"])))
+            timings["structure"].append(elapsed)
+            document["pages"] = len(structure)
+            _, elapsed = timed(split_into_chunks, text)
+            timings["chunk"].append(elapsed)
+            past, elapsed = timed(store.search, "user_requests", INSTRUCTIONS)
+            timings["retrieve"].append(elapsed)
+            # A distinct prompt per run, as the LLM cache is not involved here
+            messages = build_messages(build_prompt(f"{INSTRUCTIONS} ({run})", text, build_previous_info(past)))
+            analysis, elapsed = timed(client.complete, messages)
+            timings["llm"].append(elapsed)
+            content, explanation = split_analysis(analysis)
+            _, elapsed = timed(structural_diff, text, content)
+            timings["diff"].append(elapsed)
+            _, elapsed = timed(lambda: [synthesizer.synthesize(chunk, "en") for chunk in split_sentences(explanation)])
+            timings["tts"].append(elapsed)
+            _, elapsed = timed(render_pdf, text_to_pages(text))
+            timings["export"].append(elapsed)
+        for stage, values in timings.items():
+            results.append({"document": document["name"], "pages": document["pages"], "stage": stage,
+                            **percentiles(values)})
+    return results
+
+
+class ServerProcess:
+    """The backend (app.run, threaded) in a subprocess with its own working directory for uploads and databases."""
+
+    def __init__(self, workdir, env):
+        self.workdir = workdir
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log = open(os.path.join(workdir, "server.log"), "wb")
+        env = {**env, "PYTHONPATH": os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))}
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", SERVER_SCRIPT, str(self.port)],
+            cwd=workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        self._sampling = False
+        self._samples = []
+
+    def wait_ready(self, timeout=120):
+        import requests
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, see {self.log.name}")
+            try:
+                requests.get(self.url + "/", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError(f"Server did not start in {timeout}s, see {self.log.name}")
+
+    def sample_rss(self):
+        """Context for one scenario: samples the server RSS every 50 ms and returns the maximum."""
+        server = self
+
+        class Sampler:
+            def __enter__(self):
+                server._sampling, server._samples = True, []
+                self.thread = threading.Thread(target=server._sample, daemon=True)
+                self.thread.start()
+                return self
+
+            def __exit__(self, *exc):
+                server._sampling = False
+                self.thread.join()
+                self.max_mb = max((sample for sample in server._samples if sample is not None), default=None)
+
+        return Sampler()
+
+    def _sample(self):
+        while self._sampling:
+            self._samples.append(rss_mb(self.process.pid))
+            time.sleep(0.05)
+
+    def stop(self):
+        peak = rss_mb(self.process.pid, "VmHWM")
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+        if peak is None:
+            peak = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+        return peak
+
+
+class LoadRunner:
+    """Runs a scenario with N concurrent clients, each with its own HTTP session."""
+
+    def __init__(self, server, documents, timeout):
+        self.server = server
+        self.documents = documents
+        self.timeout = timeout
+        self._local = threading.local()
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def session(self):
+        import requests
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def next_id(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def post(self, path, **kwargs):
+        response = self.session().post(self.server.url + path, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def document(self, number):
+        return self.documents[number % len(self.documents)]
+
+    # Scenarios: one request each; the returned value is the time to first byte for streaming scenarios
+
+    def upload(self, number):
+        document = self.document(number)
+        # A unique file per request (trailing PDF comment), so every upload is extracted, not served from cache
+        data = document["data"] + f"\n%bench {number}\n".encode("ascii")
+        self.post("/upload", files={"file": (f"bench_{number}_{document['name']}", data, "application/pdf")})
+
+    def prompt_body(self, number):
+        return {"instructions": f"{INSTRUCTIONS} ({number})", "document_text": self.document(number)["text"],
+                "session_id": f"bench-{number}"}
+
+    def process_prompt(self, number):
+        self.post("/process_prompt", json=self.prompt_body(number))
+
+    def process_prompt_stream(self, number):
+        started = time.perf_counter()
+        response = self.post("/process_prompt_stream", json=self.prompt_body(number), stream=True)
+        first_byte = None
+        for _ in response.iter_content(chunk_size=None):
+            if first_byte is None:
+                first_byte = (time.perf_counter() - started) * 1000
+        return first_byte
+
+    def prepare_speak_changes(self, number):
+        self.process_prompt(number)
+
+    def speak_changes(self, number):
+        response = self.session().get(
+            self.server.url + "/speak_changes", params={"session_id": f"bench-{number}"}, timeout=self.timeout
+        )
+        response.raise_for_status()
+
+    def export(self, number):
+        self.post("/export", json={"text": self.document(number)["text"]})
+
+    def run(self, scenario, clients, total):
+        numbers = [self.next_id() for _ in range(total)]
+        prepare = getattr(self, f"prepare_{scenario}", None)
+        if prepare is not None:
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                list(executor.map(prepare, numbers))
+
+        request = getattr(self, scenario)
+        latencies, first_bytes, errors = [], [], []
+
+        def call(number):
+            started = time.perf_counter()
+            try:
+                first_byte = request(number)
+            except Exception as e:
+                errors.append(str(e))
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+            if first_byte is not None:
+                first_bytes.append(first_byte)
+
+        with self.server.sample_rss() as sampler:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                list(executor.map(call, numbers))
+            wall = time.perf_counter() - started
+
+        result = {
+            "scenario": scenario,
+            "clients": clients,
+            "requests": total,
+            "errors": len(errors),
+            "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+            **percentiles(latencies),
+            "server_rss_max_mb": sampler.max_mb,
+        }
+        if first_bytes:
+            result["ttfb"] = percentiles(first_bytes)
+        if errors:
+            result["first_error"] = errors[0]
+        return result
+
+
+def run_load(documents, args, stub_env, workdir):
+    env = {
+        **os.environ,
+        **stub_env,
+        "JOB_RECOVER": "0",
+        "OCR_ENABLED": "1" if args.ocr else "0",
+        "TTS_PREGENERATE": "1" if args.tts_pregenerate else "0",
+    }
+    server = ServerProcess(workdir, env)
+    try:
+        server.wait_ready()
+        runner = LoadRunner(server, documents, args.timeout)
+        results = []
+        for scenario in args.scenarios:
+            for clients in args.clients:
+                result = runner.run(scenario, clients, args.requests)
+                print(f"{scenario} x{clients}: p50 {result.get('p50_ms')} ms, "
+                      f"{result['throughput_rps']} req/s, {result['errors']} errors", file=sys.stderr)
+                results.append(result)
+    finally:
+        peak = server.stop()
+    return results, peak
+
+
+def compare(baseline_path, current_path, threshold, min_delta_ms):
+    """
+    Ratios current/baseline of p95 latency (and baseline/current of throughput); above threshold is
+    a regression. Latency changes smaller than min_delta_ms are ignored as noise.
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(current_path, encoding="utf-8") as f:
+        current = json.load(f)
+
+    baseline_args = baseline.get("meta", {}).get("args", {})
+    current_args = current.get("meta", {}).get("args", {})
+
+    def index(results, fields):
+        return {tuple(result[field] for field in fields): result for result in results}
+
+    rows = []
+    for section, fields in (("stages", ("document", "stage")), ("load", ("scenario", "clients"))):
+        old, new = index(baseline.get(section, []), fields), index(current.get(section, []), fields)
+        for key in sorted(old.keys() & new.keys(), key=str):
+            for metric, higher_is_worse in (("p95_ms", True), ("throughput_rps", False)):
+                before, after = old[key].get(metric), new[key].get(metric)
+                if not before or not after:
+                    continue
+                ratio = after / before if higher_is_worse else before / after
+                significant = not higher_is_worse or after - before >= min_delta_ms
+                rows.append({"section": section, "key": list(key), "metric": metric, "baseline": before,
+                             "current": after, "ratio": round(ratio, 3),
+                             "regression": ratio > threshold and significant})
+    return {
+        "baseline": baseline.get("meta", {}).get("commit"),
+        "current": current.get("meta", {}).get("commit"),
+        "threshold": threshold,
+        "min_delta_ms": min_delta_ms,
+        # Results are only comparable with the same settings (stub latencies, clients, documents)
+        "settings_differ": sorted(
+            key for key in set(baseline_args) | set(current_args) if baseline_args.get(key) != current_args.get(key)
+        ),
+        "regressions": sum(row["regression"] for row in rows),
+        "comparisons": rows,
+    }
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", default=os.path.join(BACKEND_DIR, "static/uploaded_docs/*.pdf"),
+                        help="Glob of sample PDFs.")
+    parser.add_argument("--synthetic-pages", type=int_list, default=[40, 160],
+                        help="Page counts of synthetic PDFs, comma-separated (empty for none).")
+    parser.add_argument("--stage-runs", type=int, default=3, help="In-process runs per document.")
+    parser.add_argument("--clients", type=int_list, default=[1, 4, 16], help="Concurrent clients, comma-separated.")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario and client count.")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS),
+                        help=f"Load scenarios, comma-separated ({','.join(SCENARIOS)}).")
+    parser.add_argument("--skip-stages", action="store_true", help="Only run the load scenarios.")
+    parser.add_argument("--skip-load", action="store_true", help="Only run the in-process stages.")
+    parser.add_argument("--ocr", action="store_true", help="OCR pages without a text layer (needs tesseract).")
+    parser.add_argument("--tts-pregenerate", action="store_true",
+                        help="Let the server pre-generate speech after each prompt (TTS_PREGENERATE=1).")
+    parser.add_argument("--timeout", type=float, default=300, help="Client timeout per request, seconds.")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the server working directory and logs.")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files instead of running the benchmark.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Ratio that counts as a regression.")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Smaller latency changes are noise.")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    if args.compare:
+        report = compare(*args.compare, args.threshold, args.min_delta_ms)
+        print(json.dumps(report, indent=2))
+        return 1 if report["regressions"] else 0
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stubs, stub_env = start_stubs_from_args(args)
+    # utils read their settings at import time, so the stubs must be configured first
+    os.environ.update(stub_env)
+    os.environ["OCR_ENABLED"] = "1" if args.ocr else "0"
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        documents = extract_texts(build_documents(args.files, args.synthetic_pages, workdir))
+        if not documents:
+            parser.error(f"No documents with text match {args.files}")
+        stages = [] if args.skip_stages else run_stages(documents, args.stage_runs)
+        load, server_peak = ([], None) if args.skip_load else run_load(documents, args, stub_env, workdir)
+    finally:
+        for stub in stubs.values():
+            stub.stop()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        },
+        "documents": [{"name": document["name"], "bytes": len(document["data"]), "pages": document.get("pages"),
+                       "chars": len(document["text"])} for document in documents],
+        "stages": stages,
+        "stages_peak_rss_mb": self_peak_rss_mb(),
+        "load": load,
+        "server_peak_rss_mb": server_peak,
+        "stubs": {name: stub.stats() for name, stub in stubs.items()},
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Compares recall and latency of the keyword retriever (SQLite FTS5, BM25) and the
+local vector index on a synthetic corpus of past operations with paraphrased queries.
+
+    python -m benchmarks.bench_retrieval --size 20000 --queries 200 -k 5
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from utils.search_store import SQLiteFTSStore
+from utils.vector_index import VectorIndex, create_embedder
+
+ACTIONS = [
+    ["shorten", "condense", "trim down", "make shorter"],
+    ["expand", "elaborate on", "add more detail to", "extend"],
+    ["rephrase", "reword", "rewrite", "paraphrase"],
+    ["remove", "delete", "drop", "get rid of"],
+    ["formalize", "make more formal", "use a formal tone in", "professionalize"],
+    ["proofread", "fix the grammar in", "correct mistakes in", "check spelling in"],
+]
+TOPICS = [
+    ["summary", "summaries", "overview"],
+    ["education section", "education", "studies section"],
+    ["work experience", "experience section", "employment history"],
+    ["contact details", "contacts", "contact information"],
+    ["skills list", "skills", "skill set"],
+    ["introduction", "intro", "opening paragraph"],
+    ["conclusion", "conclusions", "closing paragraph"],
+    ["project descriptions", "projects", "project section"],
+    ["references", "referees", "reference list"],
+    ["database schema description", "database schema", "schema section"],
+]
+FILLER = "document page table figure section paragraph line item list note appendix draft version".split()
+
+
+def build_corpus(size, rng):
+    """Returns documents; the first len(ACTIONS) * len(TOPICS) are the ground-truth targets."""
+    documents = []
+    for a, action in enumerate(ACTIONS):
+        for t, topic in enumerate(TOPICS):
+            documents.append({"instructions": f"{action[0]} the {topic[0]}", "analysis": "", "target": [a, t]})
+    while len(documents) < size:
+        words = rng.sample(FILLER, 4)
+        documents.append({"instructions": " ".join(words), "analysis": "", "target": None})
+    return documents
+
+
+def build_queries(count, rng):
+    queries = []
+    for _ in range(count):
+        a, t = rng.randrange(len(ACTIONS)), rng.randrange(len(TOPICS))
+        action = rng.choice(ACTIONS[a][1:])
+        topic = rng.choice(TOPICS[t])
+        queries.append((f"please {action} the {topic}", [a, t]))
+    return queries
+
+
+def evaluate(name, search, queries, k):
+    latencies, hits = [], 0
+    for query, target in queries:
+        started = time.perf_counter()
+        results = search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += any(result.get("target") == target for result in results)
+    latencies.sort()
+    return {
+        "retriever": name,
+        f"recall@{k}": round(hits / len(queries), 4),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=5000, help="Number of indexed operations.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--embedder", default="hashing", help="hashing or sentence-transformers")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = build_corpus(args.size, rng)
+    queries = build_queries(args.queries, rng)
+    results = {"size": args.size, "queries": args.queries, "k": args.k, "results": []}
+
+    with tempfile.TemporaryDirectory() as folder:
+        keyword_store = SQLiteFTSStore(os.path.join(folder, "fts.db"))
+        started = time.perf_counter()
+        keyword_store.bulk_index("bench", documents)
+        keyword_build = time.perf_counter() - started
+        keyword = evaluate("keyword", lambda q, k: keyword_store.search("bench", q, size=k), queries, args.k)
+        keyword["build_s"] = round(keyword_build, 3)
+        results["results"].append(keyword)
+
+        for quantized in (False, True):
+            vector_index = VectorIndex(
+                os.path.join(folder, f"vectors_{int(quantized)}"),
+                embedder=create_embedder(args.embedder),
+                quantized=quantized,
+                min_score=-1.0,
+            )
+            started = time.perf_counter()
+            for start in range(0, len(documents), 1000):
+                vector_index.bulk_index("bench", documents[start:start + 1000])
+            vector_build = time.perf_counter() - started
+            name = "vector-int8" if quantized else "vector"
+            vector = evaluate(name, lambda q, k: vector_index.search("bench", q, size=k), queries, args.k)
+            vector["build_s"] = round(vector_build, 3)
+            results["results"].append(vector)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
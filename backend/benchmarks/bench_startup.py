@@ -0,0 +1,115 @@
+"""
+Measures the cold start of the backend: wall time of `import app` in fresh
+interpreters, the import time contributed by each module and package
+(python -X importtime), and which heavy libraries are loaded at boot.
+
+    python -m benchmarks.bench_startup --runs 5 --top 15
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = [
+    "openai", "sqlalchemy", "elasticsearch", "gtts", "pytesseract", "PIL", "PyPDF2",
+    "pdfplumber", "fpdf", "numpy", "tiktoken", "transformers", "torch",
+]
+
+# Runs in a fresh interpreter: imports the app and serves one request
+BOOT_SCRIPT = f"""
+import json, sys, time
+started = time.perf_counter()
+import app
+boot = time.perf_counter() - started
+started = time.perf_counter()
+app.app.test_client().get("/")
+first_request = time.perf_counter() - started
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(json.dumps({{"boot_s": boot, "first_request_s": first_request, "heavy_loaded": loaded}}))
+"""
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_boot(env, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", BOOT_SCRIPT]
+    completed = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return result, completed.stderr
+
+
+def parse_importtime(stderr):
+    """Returns (module, depth, self_us, cumulative_us) for every import in the -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, len(indent) // 2, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def summarize_imports(entries, top):
+    """Direct imports of app.py by cumulative time, and self time summed per top-level package."""
+    # -X importtime prints children before their parent: app's subtree is the run of deeper entries just before it
+    end = next(i for i, (module, _, _, _) in enumerate(entries) if module == "app")
+    app_depth = entries[end][1]
+    start = end
+    while start > 0 and entries[start - 1][1] > app_depth:
+        start -= 1
+    subtree = entries[start:end + 1]
+    direct = sorted(
+        ((module, cumulative) for module, depth, _, cumulative in subtree if depth == app_depth + 1),
+        key=lambda item: -item[1],
+    )
+    packages = {}
+    for module, _, self_us, _ in subtree:
+        root = module.split(".")[0]
+        packages[root] = packages.get(root, 0) + self_us
+    by_package = sorted(packages.items(), key=lambda item: -item[1])
+    return {
+        "direct_imports_ms": {module: round(us / 1000, 1) for module, us in direct[:top]},
+        "by_package_ms": {package: round(us / 1000, 1) for package, us in by_package[:top]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time.")
+    parser.add_argument("--top", type=int, default=15, help="Modules and packages to list.")
+    parser.add_argument("--recover", action="store_true", help="Keep job recovery on during boot (JOB_RECOVER=1).")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("SEARCH_BACKEND", "memory")
+    env["JOB_RECOVER"] = "1" if args.recover else "0"
+
+    runs = [run_boot(env)[0] for _ in range(args.runs)]
+    profiled, stderr = run_boot(env, importtime=True)
+    boot = sorted(run["boot_s"] * 1000 for run in runs)
+    results = {
+        "runs": args.runs,
+        "boot_ms": {
+            "min": round(boot[0], 1),
+            "median": round(statistics.median(boot), 1),
+            "max": round(boot[-1], 1),
+        },
+        "first_request_ms": round(statistics.median(run["first_request_s"] * 1000 for run in runs), 1),
+        "heavy_loaded": profiled["heavy_loaded"],
+        **summarize_imports(parse_importtime(stderr), args.top),
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
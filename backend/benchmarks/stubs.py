@@ -0,0 +1,335 @@
+"""
+Local stub servers for the external services of the backend: the OpenAI chat completions API,
+Elasticsearch and an HTTP TTS service (TTS_ENGINE=http). Responses are deterministic (derived
+from a hash of the request) and latencies are configurable, so benchmark runs are comparable.
+
+    python -m benchmarks.stubs --llm-latency 0.5 --es-latency 0.01 --tts-latency 0.2
+
+prints the environment variables that point a backend at the running stubs.
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "the document section table record vehicle service employee schedule summary report value "
+    "update change version page line paragraph field index query result status owner date"
+).split()
+
+
+def digest(data):
+    return hashlib.sha256(data if isinstance(data, bytes) else data.encode("utf-8")).hexdigest()
+
+
+def fake_text(seed, words):
+    """Deterministic pseudo-text of the given number of words."""
+    key = digest(seed)
+    return " ".join(WORDS[int(key[i % 60:i % 60 + 4], 16) % len(WORDS)] for i in range(words))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def count(self):
+        with self.server.stub.lock:
+            self.server.stub.requests += 1
+
+
+class StubServer:
+    """A ThreadingHTTPServer on a free local port, served from a daemon thread."""
+
+    handler = _Handler
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self.handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        return {"requests": self.requests}
+
+
+class _OpenAIHandler(_Handler):
+    def do_POST(self):
+        self.count()
+        stub = self.server.stub
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self.send_body(404, {"error": {"message": f"Unknown path {self.path}"}})
+        request = json.loads(self.read_body() or b"{}")
+        content = stub.completion(request.get("messages", []))
+        time.sleep(stub.latency)
+
+        base = {"id": f"chatcmpl-{digest(content)[:12]}", "created": 0, "model": request.get("model", "stub")}
+        if not request.get("stream"):
+            return self.send_body(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(content.split()), "total_tokens": 0},
+            })
+
+        # Server-sent events, one word per chunk, as the OpenAI streaming API sends them
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in re.findall(r"\S+\s*", content):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            if stub.token_latency:
+                time.sleep(stub.token_latency)
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class OpenAIStub(StubServer):
+    """
+    POST /v1/chat/completions (plain and stream=True). The reply is derived from a hash of
+    the messages: `words` words of document text followed by an "Explanation:" section.
+    latency is the time to the first token, token_latency the delay between streamed words.
+    """
+
+    handler = _OpenAIHandler
+
+    def __init__(self, latency=0.0, token_latency=0.0, words=200, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.token_latency = token_latency
+        self.words = words
+
+    @property
+    def api_base(self):
+        return f"{self.url}/v1"
+
+    def completion(self, messages):
+        seed = json.dumps(messages, sort_keys=True)
+        return (
+            f"{fake_text(seed, self.words)}.\n\n"
+            f"Explanation: Updated {digest(seed)[:8]}. {fake_text(seed + 'explanation', 40)}."
+        )
+
+
+class _ElasticsearchHandler(_Handler):
+    HEADERS = {"X-Elastic-Product": "Elasticsearch"}
+
+    def reply(self, status, body):
+        time.sleep(self.server.stub.latency)
+        self.send_body(status, body, headers=self.HEADERS)
+
+    def do_HEAD(self):
+        self.send_body(200, b"", headers=self.HEADERS)
+
+    def do_GET(self):
+        self.count()
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if not parts:
+            return self.reply(200, {"name": "stub", "cluster_name": "stub", "version": {"number": "8.11.0"},
+                                    "tagline": "You Know, for Search"})
+        if parts[-1] == "_search":
+            return self.search(parts[0] if len(parts) > 1 else None, self.read_body())
+        return self.reply(404, {"error": "not found", "status": 404})
+
+    def do_POST(self):
+        self.count()
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        body = self.read_body()
+        if parts and parts[-1] == "_bulk":
+            return self.bulk(parts[0] if len(parts) > 1 else None, body)
+        if parts and parts[-1] == "_search":
+            return self.search(parts[0] if len(parts) > 1 else None, body)
+        if len(parts) >= 2 and parts[1] == "_doc":
+            document_id = self.server.stub.add(parts[0], json.loads(body or b"{}"))
+            return self.reply(201, {"_index": parts[0], "_id": document_id, "_version": 1, "result": "created",
+                                    "_shards": {"total": 1, "successful": 1, "failed": 0},
+                                    "_seq_no": 0, "_primary_term": 1})
+        return self.reply(404, {"error": "not found", "status": 404})
+
+    do_PUT = do_POST
+
+    def bulk(self, default_index, body):
+        lines = [line for line in body.decode("utf-8").splitlines() if line.strip()]
+        items = []
+        for action_line, document_line in zip(lines[::2], lines[1::2]):
+            action, meta = next(iter(json.loads(action_line).items()))
+            index = meta.get("_index", default_index)
+            document_id = self.server.stub.add(index, json.loads(document_line))
+            items.append({action: {"_index": index, "_id": document_id, "status": 201, "result": "created"}})
+        self.reply(200, {"took": 0, "errors": False, "items": items})
+
+    def search(self, index, body):
+        request = json.loads(body or b"{}")
+        query = request.get("query", {}).get("multi_match", {}).get("query", "")
+        hits = self.server.stub.search(index, query, request.get("size", 10))
+        self.reply(200, {
+            "took": 0, "timed_out": False,
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": None, "hits": hits},
+        })
+
+
+class ElasticsearchStub(StubServer):
+    """Index, bulk and multi_match search in memory; scores are the number of shared terms."""
+
+    handler = _ElasticsearchHandler
+
+    def __init__(self, latency=0.0, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.indices = {}
+
+    def add(self, index, document):
+        with self.lock:
+            documents = self.indices.setdefault(index, [])
+            document_id = f"{index}-{len(documents)}"
+            documents.append((document_id, document))
+        return document_id
+
+    def search(self, index, query, size):
+        terms = set(re.findall(r"\w+", query.lower()))
+        with self.lock:
+            documents = list(self.indices.get(index, []))
+        scored = []
+        for document_id, document in documents:
+            text = " ".join(str(document.get(field, "")) for field in ("instructions", "document_text", "analysis"))
+            score = len(terms & set(re.findall(r"\w+", text.lower())))
+            if score:
+                scored.append((-score, document_id, document))
+        scored.sort(key=lambda item: item[:2])
+        return [{"_index": index, "_id": document_id, "_score": -score, "_source": document}
+                for score, document_id, document in scored[:size]]
+
+    def stats(self):
+        with self.lock:
+            return {**super().stats(), "documents": sum(len(documents) for documents in self.indices.values())}
+
+
+class _TTSHandler(_Handler):
+    def do_POST(self):
+        self.count()
+        stub = self.server.stub
+        request = json.loads(self.read_body() or b"{}")
+        text = request.get("text", "")
+        time.sleep(stub.latency + stub.char_latency * len(text))
+        self.send_body(200, stub.audio(text, request.get("lang", "en")), content_type="audio/mpeg")
+
+
+class TTSStub(StubServer):
+    """
+    POST /synthesize for TTS_ENGINE=http. Returns deterministic bytes of roughly MP3 size
+    (bytes_per_char per character); latency plus char_latency per character.
+    """
+
+    handler = _TTSHandler
+
+    def __init__(self, latency=0.0, char_latency=0.0, bytes_per_char=80, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.char_latency = char_latency
+        self.bytes_per_char = bytes_per_char
+
+    @property
+    def synthesize_url(self):
+        return f"{self.url}/synthesize"
+
+    def audio(self, text, lang):
+        block = bytes.fromhex(digest(f"{lang}\0{text}"))
+        size = max(1, len(text)) * self.bytes_per_char
+        return b"ID3" + (block * (size // len(block) + 1))[:size]
+
+
+def start_stubs(llm_latency=0.0, llm_token_latency=0.0, llm_words=200, es_latency=0.0, tts_latency=0.0,
+                tts_char_latency=0.0):
+    """Starts the three stubs; returns them and the environment that points the backend at them."""
+    stubs = {
+        "openai": OpenAIStub(llm_latency, llm_token_latency, llm_words).start(),
+        "elasticsearch": ElasticsearchStub(es_latency).start(),
+        "tts": TTSStub(tts_latency, tts_char_latency).start(),
+    }
+    env = {
+        "OPENAI_API_BASE": stubs["openai"].api_base,
+        "OPENAI_API_KEY": "stub",
+        "SEARCH_BACKEND": "elasticsearch",
+        "ES_URL": stubs["elasticsearch"].url,
+        "ES_PASSWORD": "stub",
+        "TTS_ENGINE": "http",
+        "TTS_URL": stubs["tts"].synthesize_url,
+    }
+    return stubs, env
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="OpenAI stub: seconds to the first token.")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="OpenAI stub: seconds per word.")
+    parser.add_argument("--llm-words", type=int, default=200, help="OpenAI stub: words of document text.")
+    parser.add_argument("--es-latency", type=float, default=0.005, help="Elasticsearch stub: seconds per request.")
+    parser.add_argument("--tts-latency", type=float, default=0.1, help="TTS stub: seconds per request.")
+    parser.add_argument("--tts-char-latency", type=float, default=0.0, help="TTS stub: seconds per character.")
+
+
+def start_stubs_from_args(args):
+    return start_stubs(args.llm_latency, args.llm_token_latency, args.llm_words, args.es_latency,
+                       args.tts_latency, args.tts_char_latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stubs, env = start_stubs_from_args(args)
+    for name, value in env.items():
+        print(f"export {name}={value}")
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for stub in stubs.values():
+            stub.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,23 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Text, DateTime
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 from datetime import datetime
 
 # Настройка базы данных
 DATABASE_URL = "sqlite:///requests.db"  # Путь к базе данных SQLite
-engine = create_engine(DATABASE_URL, echo=False)
+# check_same_thread=False: соединения используются из потоков воркеров (очередь задач)
+engine = create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False})
 Base = declarative_base()
 
+# WAL: читатели не блокируют фоновую запись журнала; synchronous=NORMAL — без fsync на каждый commit
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 # Определение модели
 class UserRequest(Base):
     __tablename__ = 'user_requests'
@@ -18,9 +28,34 @@ class UserRequest(Base):
     response_data = Column(Text, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+# Фоновые задачи (/jobs): состояние хранится в БД и переживает перезапуск
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    id = Column(String(36), primary_key=True)
+    kind = Column(String(64), nullable=False)
+    status = Column(String(16), nullable=False, default='queued')  # queued, running, done, failed
+    payload = Column(Text, nullable=False)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    owner = Column(String(64), nullable=True)  # Процесс, который выполняет задачу
+    heartbeat = Column(DateTime, nullable=True)  # Последний признак жизни владельца
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # Создание таблиц
 Base.metadata.create_all(engine)
 
+# Колонки, добавленные после создания таблицы jobs в существующих базах
+_job_columns = {column["name"] for column in inspect(engine).get_columns("jobs")}
+for _name, _type in (("owner", "VARCHAR(64)"), ("heartbeat", "DATETIME")):
+    if _name not in _job_columns:
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE jobs ADD COLUMN {_name} {_type}"))
+        except OperationalError:
+            pass  # Колонку уже добавил другой воркер
+
 # Настройка сессии
 Session = sessionmaker(bind=engine)
-session = Session()
+session = scoped_session(Session)  # Отдельная сессия на каждый поток
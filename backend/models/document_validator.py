@@ -1,13 +1,11 @@
-import pytesseract
-from transformers import pipeline
+from utils.validation import validate_segments
 
 # Пример: Валидация текста из документов
 def validate_document(document_id):
     # Пример извлечения текста (можно заменить на OCR/анализ структуры)
     extracted_text = f"Dummy text for document ID: {document_id}"
 
-    # Использование предобученной модели NLP для анализа
-    nlp_model = pipeline("text-classification", model="distilbert-base-uncased-finetuned-sst-2-english")
-    validation = nlp_model(extracted_text)
+    # Модель загружается один раз на процесс (см. utils.model_registry)
+    validation = validate_segments([extracted_text])
 
     return {"document_id": document_id, "validation": validation}
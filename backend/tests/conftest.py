@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# Modules are imported as in app.py (from utils.X import ...), so tests run against backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Local backends only: no Elasticsearch, speech engine, OCR or model downloads
+APP_ENV = {
+    "SEARCH_BACKEND": "memory",
+    "LLM_CACHE_BACKEND": "memory",
+    "TTS_ENGINE": "stub",
+    "TTS_PREGENERATE": "0",
+    "OCR_ENABLED": "0",
+    "VECTOR_INDEX_ENABLED": "0",
+    "JOB_RECOVER": "0",
+}
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    """
+    The app module on a stub model client. app.py keeps its databases and folders relative
+    to the working directory, so it is imported and used from a scratch directory.
+    """
+    previous = os.getcwd()
+    os.environ.update(APP_ENV)
+    os.chdir(tmp_path_factory.mktemp("backend"))
+    import app
+    from utils.llm import StubLLMClient, set_llm_client
+
+    set_llm_client(StubLLMClient())
+    yield app
+    app.job_queue.shutdown()
+    os.chdir(previous)
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
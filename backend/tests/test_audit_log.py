@@ -0,0 +1,106 @@
+import json
+import threading
+
+import pytest
+
+from utils.audit_log import COMPRESSED_PREFIX, AuditLogger, decode_payload, encode_payload
+
+PAYLOAD = {"instructions": "Fix the dates.", "document_text": "x" * 100}
+
+
+@pytest.mark.parametrize("policy", ["full", "truncate", "compress"])
+def test_payload_round_trip(policy):
+    encoded = encode_payload(PAYLOAD, policy, max_chars=20)
+    decoded = decode_payload(encoded)
+
+    if policy == "truncate":
+        assert decoded["document_text"].startswith("x" * 20 + "...[truncated 80 chars]")
+    else:
+        assert decoded == PAYLOAD
+    assert encoded.startswith(COMPRESSED_PREFIX) == (policy == "compress")
+
+
+def test_short_payload_is_not_compressed():
+    assert json.loads(encode_payload({"a": 1}, "compress", max_chars=20)) == {"a": 1}
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    written = []
+    monkeypatch.setattr(AuditLogger, "_write", lambda self, batch: written.append(list(batch)))
+    return written
+
+
+def test_records_are_written_in_batches(batches):
+    logger = AuditLogger(batch_size=3, flush_interval=0.05)
+    for number in range(7):
+        logger.log(f"/endpoint/{number}", {}, {})
+    logger.flush()
+    logger.close()
+
+    assert all(len(batch) <= 3 for batch in batches)
+    assert [item[0] for batch in batches for item in batch] == [f"/endpoint/{number}" for number in range(7)]
+
+
+def test_full_queue_drops_records(monkeypatch):
+    writing, release = threading.Event(), threading.Event()
+
+    def slow_write(self, batch):
+        writing.set()
+        release.wait(5)
+
+    monkeypatch.setattr(AuditLogger, "_write", slow_write)
+    logger = AuditLogger(queue_size=1, batch_size=1, flush_interval=0.05)
+    logger.log("/first", {}, {})
+    writing.wait(5)
+    logger.log("/queued", {}, {})
+    logger.log("/dropped", {}, {})
+    release.set()
+    logger.flush()
+    logger.close()
+
+    assert logger.stats()["dropped"] == 1
+
+
+@pytest.fixture
+def logger(monkeypatch):
+    logger = AuditLogger(flush_interval=0.05, policy="full")
+    logger.inserted = []
+
+    def insert(batch):
+        if any("bad" in endpoint for endpoint, _, _, _ in batch):
+            raise RuntimeError("constraint failed")
+        logger.inserted.extend(batch)
+
+    monkeypatch.setattr(logger, "_insert", insert)
+    yield logger
+    logger.close()
+
+
+def test_payload_is_serialized_when_logged(logger):
+    request_data = {"instructions": "before"}
+
+    logger.log("/process_prompt", request_data, {"analysis": "ok"})
+    request_data["instructions"] = "after"
+    logger.flush()
+
+    assert json.loads(logger.inserted[0][1]) == {"instructions": "before"}
+
+
+def test_unserializable_record_is_rejected_alone(logger):
+    logger.log("/process_prompt", {"file": object()}, None)
+    logger.log("/process_prompt", {"instructions": "ok"}, None)
+    logger.flush()
+
+    assert len(logger.inserted) == 1
+    assert logger.stats()["failed"] == 1
+
+
+def test_failed_record_does_not_fail_its_batch(logger):
+    for endpoint in ("/one", "/bad", "/two"):
+        logger.log(endpoint, {}, {})
+    logger.flush()
+
+    assert [item[0] for item in logger.inserted] == ["/one", "/two"]
+    assert logger.stats()["written"] == 2
+    assert logger.stats()["failed"] == 1
@@ -0,0 +1,100 @@
+import pytest
+
+from utils.chunking import estimate_tokens, merge_chunks, run_chunked, select_relevant_chunks, split_into_chunks
+
+ELEMENT = {"content": "formal tone", "origin": "Previous Operation 1", "application": "Kept."}
+EXPLANATION = (
+    "Detailed List of Reused Elements:\n"
+    "- Exact content reused: formal tone\n"
+    "- Origin (which previous operation): Previous Operation 1\n"
+    "- How it was applied: Kept.\n"
+)
+DOCUMENT = "\n\n".join(f"Paragraph {number}. " + "Some words here. " * 40 for number in range(6))
+
+
+def test_chunks_rejoin_to_the_document():
+    chunks = split_into_chunks(DOCUMENT, max_tokens=200)
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == DOCUMENT
+
+
+def test_oversized_paragraph_is_split():
+    text = "word " * 2000
+
+    chunks = split_into_chunks(text, max_tokens=100)
+
+    assert "".join(chunks) == text
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+
+
+def test_relevant_chunks_fall_back_to_all():
+    chunks = ["Invoice dates and totals.\n\n", "Shipping address.\n\n", "Signature block."]
+
+    assert select_relevant_chunks(chunks, "Fix the shipping address") == [1]
+    assert select_relevant_chunks(chunks, "Make it formal") == [0, 1, 2]
+
+
+def test_structured_elements_are_carried_through():
+    # The explanation text does not list the elements, so they can only come from the structured field
+    def process_chunk(text):
+        return text.strip().upper(), "Summary of New Changes: upper case.", [ELEMENT]
+
+    content, explanation, elements = run_chunked(["one\n\n", "two"], process_chunk, max_workers=2)
+
+    assert content == "ONE\n\nTWO"
+    assert explanation.startswith("Part 1:")
+    assert elements == [ELEMENT]
+
+
+def test_text_explanations_are_parsed_and_deduplicated():
+    def process_chunk(text):
+        return text, EXPLANATION, None
+
+    _, _, elements = run_chunked(["one\n\n", "two"], process_chunk, selected=[0, 1])
+
+    assert elements == [ELEMENT]
+
+
+def test_unselected_chunks_are_kept():
+    def process_chunk(text):
+        return "changed", "Summary of New Changes: changed.", []
+
+    content, explanation, elements = run_chunked(["one\n\n", "two"], process_chunk, selected=[1])
+
+    assert content == "one\n\nchanged"
+    assert explanation == "Summary of New Changes: changed."
+    assert elements == []
+
+
+def test_streamed_chunk_results_are_merged():
+    # The streaming endpoint processes chunks itself and only stitches the results
+    updated = {2: ("THREE", "Summary of New Changes: three.", None), 0: ("ONE", EXPLANATION, None)}
+
+    content, explanation, elements = merge_chunks(["one\n\n", "two\n\n", "three"], updated)
+
+    assert content == "ONE\n\ntwo\n\nTHREE"
+    assert explanation.startswith("Part 1:") and "Part 3:" in explanation
+    assert elements == [ELEMENT]
+
+
+@pytest.mark.parametrize("targets", [["1"], [None], [True], 1])
+def test_target_chunks_must_be_integers(client, targets):
+    response = client.post(
+        "/process_prompt", json={"instructions": "Make it formal", "document_text": DOCUMENT, "target_chunks": targets}
+    )
+
+    assert response.status_code == 400
+    assert "target_chunks" in response.get_json()["error"]
+
+
+def test_target_chunks_select_the_processed_chunks(client, monkeypatch):
+    monkeypatch.setattr("app.split_into_chunks", lambda text: split_into_chunks(text, max_tokens=200))
+    monkeypatch.setattr("app.CHUNK_THRESHOLD_TOKENS", 300)
+
+    response = client.post(
+        "/process_prompt", json={"instructions": "Make it formal", "document_text": DOCUMENT, "target_chunks": [1, 99]}
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["chunks"]["processed"] == [1]
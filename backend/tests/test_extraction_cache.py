@@ -0,0 +1,16 @@
+from utils.extraction_cache import ExtractionCache
+
+KEY = "a" * 64
+
+
+def test_peek_does_not_count_lookups(tmp_path):
+    cache = ExtractionCache(str(tmp_path))
+    cache.put(KEY, {"source": "static/uploaded_docs/report.pdf"})
+
+    assert cache.peek(KEY) == {"source": "static/uploaded_docs/report.pdf"}
+    assert cache.peek("b" * 64) is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (0, 0)
+
+    cache.get(KEY)
+    cache.get("b" * 64)
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
@@ -0,0 +1,48 @@
+import pytest
+
+from utils import file_processing
+
+
+@pytest.fixture
+def text_pdf(tmp_path):
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.set_font("Helvetica", size=12)
+    for number in range(1, 13):
+        pdf.add_page()
+        pdf.cell(0, 10, f"Content of page {number}")
+    path = tmp_path / "document.pdf"
+    pdf.output(str(path))
+    return str(path)
+
+
+def test_pages_come_back_in_order(text_pdf):
+    pages = file_processing.extract_pages(text_pdf, workers=1, batch_size=5)
+
+    assert [page["page_number"] for page in pages] == list(range(1, 13))
+    assert all(f"Content of page {page['page_number']}" in page["text"] for page in pages)
+    assert {page["method"] for page in pages} == {"pypdf2"}
+
+
+def test_pool_keeps_page_order(text_pdf, monkeypatch):
+    monkeypatch.setattr(file_processing, "EXTRACT_INLINE_PAGES", 4)
+
+    pages = list(file_processing.iter_pages(text_pdf, workers=2, batch_size=3))
+
+    assert [page["page_number"] for page in pages] == list(range(1, 13))
+    assert "Content of page 12" in pages[-1]["text"]
+
+
+def test_pdfplumber_only(text_pdf):
+    pages = file_processing.extract_pages(text_pdf, cheap_first=False, workers=1)
+
+    assert {page["method"] for page in pages} == {"pdfplumber"}
+    assert "Content of page 1" in pages[0]["text"]
+
+
+def test_process_file_joins_pages(text_pdf):
+    result = file_processing.process_file(text_pdf)
+
+    assert "error" not in result
+    assert result["text"].index("page 1") < result["text"].index("page 12")
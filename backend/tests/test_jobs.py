@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.jobs import JobQueue
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(0.02)
+    raise AssertionError("Timed out waiting for the job")
+
+
+@pytest.fixture
+def models(backend):
+    # Imported through the app fixture, so the jobs table lives in its scratch directory
+    import models
+
+    return models
+
+
+@pytest.fixture
+def queue(models):
+    queue = JobQueue(workers=2, heartbeat_interval=0.05, lease_timeout=1)
+    yield queue
+    queue.shutdown()
+
+
+def job_row(models, job_id):
+    db = models.Session()
+    try:
+        job = db.get(models.Job, job_id)
+        return {"status": job.status, "owner": job.owner, "heartbeat": job.heartbeat}
+    finally:
+        db.close()
+
+
+def job_result(client, job_id):
+    response = client.get(f"/jobs/{job_id}/result")
+    return response.get_json() if response.status_code == 200 else None
+
+
+def test_prompt_job_runs_end_to_end(client):
+    response = client.post("/jobs/process_prompt", json={"instructions": "Make it formal", "document_text": "Draft."})
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+
+    result = wait_for(lambda: job_result(client, job_id))
+
+    assert result["analysis"] == "Updated document."
+    assert result["session_id"] == response.get_json()["session_id"]
+    assert client.get(f"/jobs/{job_id}").get_json()["status"] == "done"
+
+
+def test_running_job_is_claimed_and_kept_alive(models, queue):
+    started, release = threading.Event(), threading.Event()
+
+    def handler(payload):
+        started.set()
+        release.wait(10)
+        return {"echo": payload["value"]}
+
+    queue.register("echo", handler)
+    job_id = queue.submit("echo", {"value": 42})
+    assert started.wait(10)
+
+    claimed = job_row(models, job_id)
+    assert claimed["status"] == "running"
+    assert claimed["owner"] == queue.owner
+    assert not queue._claim(job_id)  # Already taken
+    wait_for(lambda: job_row(models, job_id)["heartbeat"] > claimed["heartbeat"])
+
+    release.set()
+    job = wait_for(lambda: queue.get(job_id)["status"] == "done" and queue.get(job_id))
+    assert job["result"] == {"echo": 42}
+
+
+def add_running_job(models, heartbeat):
+    job_id = str(uuid.uuid4())
+    db = models.Session()
+    try:
+        db.add(models.Job(id=job_id, kind="echo", status="running", payload=json.dumps({"value": 7}),
+                          owner="dead-host:1:0", heartbeat=heartbeat))
+        db.commit()
+    finally:
+        db.close()
+    return job_id
+
+
+def test_expired_lease_is_reclaimed(models, queue):
+    queue.register("echo", lambda payload: {"echo": payload["value"]})
+    abandoned = add_running_job(models, datetime.utcnow() - timedelta(seconds=60))
+    alive = add_running_job(models, datetime.utcnow() + timedelta(seconds=60))
+
+    assert queue.recover() == 1
+
+    job = wait_for(lambda: queue.get(abandoned)["status"] == "done" and queue.get(abandoned))
+    assert job["result"] == {"echo": 7}
+    # A job whose owner still renews its heartbeat is left alone
+    row = job_row(models, alive)
+    assert (row["status"], row["owner"]) == ("running", "dead-host:1:0")
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from utils.llm_cache import LLMResponseCache, MemoryCacheBackend, SQLiteCacheBackend, make_cache_key
+
+
+def key(document_text, instructions="Fix the dates."):
+    return make_cache_key("model", 0.7, instructions, document_text, "")
+
+
+def test_cosmetic_whitespace_shares_a_key():
+    assert key("First  line \nSecond\tline") == key("  First line\r\nSecond line  ")
+    assert key("One.\n\n\n\nTwo.") == key("One.\n\nTwo.")
+    assert key("Text.", "  Fix  the dates. ") == key("Text.", "Fix the dates.")
+
+
+def test_instruction_case_changes_the_key():
+    assert key("Acme Inc.", "rename Acme to ACME") != key("Acme Inc.", "rename ACME to Acme")
+
+
+def test_paragraph_breaks_change_the_key():
+    assert key("One.\n\nTwo.") != key("One. Two.")
+    assert key("One.\n\nTwo.") != key("One.\nTwo.")
+
+
+def test_model_settings_and_context_change_the_key():
+    base = make_cache_key("model", 0.7, "Fix.", "Text.", "")
+
+    assert make_cache_key("other", 0.7, "Fix.", "Text.", "") != base
+    assert make_cache_key("model", 0.2, "Fix.", "Text.", "") != base
+    assert make_cache_key("model", 0.7, "Fix.", "Text.", "Previous operation") != base
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2, ttl=60)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    backend.get("a")
+    backend.set("c", 3)
+
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == (1, None, 3)
+
+
+def test_expired_entries_are_misses(tmp_path):
+    for backend in (MemoryCacheBackend(ttl=-1), SQLiteCacheBackend(str(tmp_path / "cache.db"), ttl=-1)):
+        backend.set("a", {"response": "cached"})
+        assert backend.get("a") is None
+
+
+def test_sqlite_backend_round_trip(tmp_path):
+    path = str(tmp_path / "cache.db")
+    SQLiteCacheBackend(path).set("a", {"response": "cached", "latency": 1.5})
+
+    assert SQLiteCacheBackend(path).get("a") == {"response": "cached", "latency": 1.5}
+
+
+def test_identical_in_flight_requests_are_coalesced():
+    cache = LLMResponseCache(MemoryCacheBackend())
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    first = threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+    second.start()
+    while cache.stats()["coalesced"] < 1:
+        time.sleep(0.001)
+    release.set()
+    first.join()
+    second.join()
+
+    assert results == ["answer", "answer"] and len(calls) == 1
+    assert cache.get_or_compute("k", compute) == "answer" and len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_failed_compute_is_not_cached():
+    cache = LLMResponseCache(MemoryCacheBackend())
+
+    def fail():
+        raise RuntimeError("model unavailable")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("k", fail)
+
+    assert cache.get_or_compute("k", lambda: "answer") == "answer"
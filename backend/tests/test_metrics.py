@@ -0,0 +1,19 @@
+from utils.metrics import Registry
+
+
+def test_collector_registered_again_is_replaced():
+    registry = Registry()
+    registry.collector("uploads", lambda: {"stored": 1})
+    registry.collector("uploads", lambda: {"stored": 2})
+
+    lines = registry.render().splitlines()
+
+    assert [line for line in lines if line.startswith("backend_uploads_stored")] == ["backend_uploads_stored 2"]
+
+
+def test_new_app_does_not_duplicate_upload_series(backend, tmp_path):
+    second = backend.create_app({"UPLOAD_FOLDER": str(tmp_path / "uploads")})
+
+    body = second.test_client().get("/metrics").get_data(as_text=True)
+
+    assert body.count("# TYPE backend_uploads_stored gauge") == 1
@@ -0,0 +1,78 @@
+import pytest
+
+from utils import file_processing
+
+
+def fake_ocr(file_path, page_numbers, dpi, lang):
+    return {page_number: f"recognized {page_number}" for page_number in page_numbers}
+
+
+@pytest.fixture
+def serial_ocr(monkeypatch):
+    monkeypatch.setattr(file_processing, "OCR_WORKERS", 1)
+    monkeypatch.setattr(file_processing, "OCR_BATCH_SIZE", 1)
+    monkeypatch.setattr(file_processing, "_ocr_page_batch", fake_ocr)
+
+
+@pytest.fixture
+def blank_page_pdf(tmp_path, monkeypatch):
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", size=12)
+    pdf.cell(0, 10, "Text on the first page")
+    pdf.add_page()  # Blank page: goes to OCR
+    path = tmp_path / "document.pdf"
+    pdf.output(str(path))
+    monkeypatch.setattr(file_processing, "OCR_ENABLED", True)
+    return str(path)
+
+
+def test_serial_ocr_fills_text_less_pages(serial_ocr):
+    pages = [
+        {"page_number": 1, "text": "", "method": "pdfplumber"},
+        {"page_number": 2, "text": " \n", "method": "pdfplumber"},
+        {"page_number": 3, "text": "Text layer", "method": "pypdf2"},
+    ]
+    result = file_processing._apply_ocr("document.pdf", pages, 300, "eng")
+
+    assert result[0] == {"page_number": 1, "text": "recognized 1", "method": "ocr"}
+    assert result[1] == {"page_number": 2, "text": "recognized 2", "method": "ocr"}
+    assert result[2] == {"page_number": 3, "text": "Text layer", "method": "pypdf2"}
+
+
+def test_process_file_ocrs_blank_pages(serial_ocr, blank_page_pdf):
+    result = file_processing.process_file(blank_page_pdf)
+
+    assert "Text on the first page" in result["text"]
+    assert "recognized 2" in result["text"]
+
+
+def failing_ocr(file_path, page_numbers, dpi, lang):
+    if 2 in page_numbers:
+        raise RuntimeError("tesseract is not installed or it's not in your PATH")
+    return fake_ocr(file_path, page_numbers, dpi, lang)
+
+
+def test_serial_ocr_failure_keeps_other_pages(serial_ocr, monkeypatch):
+    monkeypatch.setattr(file_processing, "_ocr_page_batch", failing_ocr)
+    pages = [
+        {"page_number": 1, "text": "", "method": "pdfplumber"},
+        {"page_number": 2, "text": "", "method": "pdfplumber"},
+        {"page_number": 3, "text": "Text layer", "method": "pypdf2"},
+    ]
+    result = file_processing._apply_ocr("document.pdf", pages, 300, "eng")
+
+    assert result[0] == {"page_number": 1, "text": "recognized 1", "method": "ocr"}
+    assert result[1] == {"page_number": 2, "text": "", "method": "pdfplumber"}
+    assert result[2] == {"page_number": 3, "text": "Text layer", "method": "pypdf2"}
+
+
+def test_process_file_without_tesseract_returns_text_pages(serial_ocr, blank_page_pdf, monkeypatch):
+    monkeypatch.setattr(file_processing, "_ocr_page_batch", failing_ocr)
+
+    result = file_processing.process_file(blank_page_pdf)
+
+    assert "error" not in result
+    assert "Text on the first page" in result["text"]
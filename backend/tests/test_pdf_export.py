@@ -0,0 +1,53 @@
+import io
+
+from PyPDF2 import PdfReader
+
+from utils import pdf_export
+
+PAGES = [{"page_number": number, "text": f"Привет, page {number}"} for number in range(1, 11)]
+
+
+def test_parallel_export_keeps_page_order(monkeypatch):
+    monkeypatch.setattr(pdf_export, "EXPORT_INLINE_PAGES", 4)
+
+    data = pdf_export.render_pdf(PAGES, workers=2, batch_size=4)
+
+    # Text extraction is slow for these fonts, so only the batch boundaries are checked
+    pages = PdfReader(io.BytesIO(data)).pages
+    assert len(pages) == len(PAGES)
+    for index in (3, 4, 9):
+        assert f"Привет, page {index + 1}" in pages[index].extract_text()
+    assert pdf_export.stats()["parallel_renders"] >= 1
+
+
+def test_pdf_chunks_yield_the_whole_document():
+    chunks = list(pdf_export.pdf_chunks(PAGES[:2], workers=1, chunk_size=1024))
+
+    assert len(chunks) > 1
+    assert b"".join(chunks).startswith(b"%PDF")
+    assert len(PdfReader(io.BytesIO(b"".join(chunks))).pages) == 2
+
+
+def test_text_to_pages_splits_on_form_feed():
+    assert pdf_export.text_to_pages("First\n\fSecond") == [
+        {"page_number": 1, "text": "First"},
+        {"page_number": 2, "text": "Second"},
+    ]
+
+
+def test_subset_cache_does_not_patch_fpdf():
+    import fpdf.fpdf
+    from fpdf.ttfonts import TTFontFile
+
+    pdf_export.render_pdf(PAGES[:2], workers=1)
+
+    assert fpdf.fpdf.TTFontFile is TTFontFile
+
+
+def test_repeated_export_reuses_font_subsets():
+    pdf_export.render_pdf(PAGES[:1], workers=1)
+    hits = pdf_export.stats()["subset_hits"]
+
+    pdf_export.render_pdf(PAGES[:1], workers=1)
+
+    assert pdf_export.stats()["subset_hits"] > hits
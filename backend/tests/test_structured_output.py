@@ -0,0 +1,146 @@
+import json
+
+import pytest
+
+from utils import structured_output
+from utils.prompt_processing import parse_reused_elements, split_analysis
+from utils.structured_output import StructuredOutputParser, parse_structured_output
+
+ELEMENTS = [
+    {"content": "formal tone", "origin": "Previous Operation 1", "application": "Kept in the summary."},
+    {"content": "dates as YYYY-MM-DD", "origin": "Previous Operation 2", "application": "Applied to all dates."},
+]
+RESPONSE = json.dumps({
+    "content": 'Line one\nLine "two" \\ three — ünïcode 😀',
+    "summary": "Fixed the dates.",
+    "reused_elements": ELEMENTS,
+    "notes": {"ignored": [1, -2.5e3, True, False, None]},
+}, ensure_ascii=False)
+CONTENT = 'Line one\nLine "two" \\ three — ünïcode 😀'
+
+LEGACY = (
+    "Improved text.\n\nExplanation: Summary of New Changes: Shortened.\n"
+    "Detailed List of Reused Elements:\n"
+    "- Exact content reused: formal tone\n"
+    "- Origin (which previous operation): Previous Operation 1\n"
+    "- How it was applied: Kept.\n"
+)
+
+# Responses the parser accepts: (response, content, reused_elements)
+VALID = {
+    "fenced": ("```json\n" + RESPONSE + "\n```", CONTENT, ELEMENTS),
+    "preamble": ("Here is the result:\n" + RESPONSE, CONTENT, ELEMENTS),
+    "ascii escapes": (json.dumps(json.loads(RESPONSE)), CONTENT, ELEMENTS),
+    "nulls": ('{"content": "Text.", "summary": null, "reused_elements": null}', "Text.", []),
+    "null field": ('{"content": "Text.", "reused_elements": [{"content": "a", "origin": null}]}', "Text.",
+                   [{"content": "a", "origin": "", "application": ""}]),
+    "empty element": ('{"content": "Text.", "reused_elements": [{"content": ""}]}', "Text.", []),
+    "trailing text": (RESPONSE + "\nLet me know if you need more changes.", CONTENT, ELEMENTS),
+    "surrogate pair": ('{"content": "\\ud83d\\ude00 smile"}', "😀 smile", []),
+}
+
+# Responses that fall back to the text parser
+MALFORMED = {
+    "text format": LEGACY,
+    "truncated": RESPONSE[:len(RESPONSE) // 2],
+    "unterminated string": '{"content": "Text.',
+    "wrong content type": '{"content": ["Text."], "summary": "s"}',
+    "wrong elements type": '{"content": "Text.", "reused_elements": "none"}',
+    "missing content": '{"summary": "s", "reused_elements": []}',
+    "invalid escape": '{"content": "a\\qb"}',
+    "invalid unicode escape": '{"content": "\\u12G4"}',
+    "bad literal": '{"content": "Text.", "extra": nul}',
+    "missing colon": '{"content" "Text."}',
+    "missing comma": '{"content": "Text." "summary": "s"}',
+    "mismatched bracket": '{"content": "Text.", "reused_elements": [}',
+    "long preamble": "x" * 300 + RESPONSE,
+}
+
+
+def chunks(text, size):
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+
+def stream(text, size):
+    parser = StructuredOutputParser()
+    pieces = []
+    for chunk in chunks(text, size):
+        pieces.extend(parser.feed(chunk))
+    content, explanation = parser.finish()
+    return parser, pieces, content, explanation
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    monkeypatch.setattr(structured_output, "_counters", {"parsed": 0, "fallbacks": 0})
+    return structured_output.stats
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 100000])
+@pytest.mark.parametrize("name", sorted(VALID))
+def test_valid_responses(name, size, counters):
+    response, content, elements = VALID[name]
+
+    parser, pieces, parsed_content, explanation = stream(response, size)
+
+    assert not parser.failed
+    assert parsed_content == content
+    assert parser.reused_elements == elements
+    assert "".join(text for section, text in pieces if section == "content") == content
+    # The explanation keeps the text layout, so the legacy parser reads the same elements back
+    assert parse_reused_elements(explanation) == elements
+    assert counters() == {"parsed": 1, "fallbacks": 0}
+
+
+def test_summary_streams_as_explanation():
+    _, pieces, _, explanation = stream(RESPONSE, 5)
+
+    assert "".join(text for section, text in pieces if section == "explanation") == "Fixed the dates."
+    assert explanation.startswith("Summary of New Changes: Fixed the dates.")
+
+
+@pytest.mark.parametrize("size", [1, 3, 100000])
+@pytest.mark.parametrize("name", sorted(MALFORMED))
+def test_malformed_responses_fall_back(name, size, counters):
+    response = MALFORMED[name]
+
+    parser, _, content, explanation = stream(response, size)
+
+    assert parser.failed and parser.error
+    assert (content, explanation) == split_analysis(response)
+    assert parser.reused_elements == parse_reused_elements(explanation)
+    assert counters() == {"parsed": 0, "fallbacks": 1}
+
+
+def test_text_format_streams_through_legacy_splitter():
+    text = LEGACY + "x" * 300  # Longer than the allowed preamble, so the parser gives up while streaming
+
+    parser, pieces, content, _ = stream(text, 4)
+
+    assert parser.failed
+    assert content == "Improved text."
+    assert "".join(text for section, text in pieces if section == "content").strip() == "Improved text."
+    assert parser.reused_elements == [
+        {"content": "formal tone", "origin": "Previous Operation 1", "application": "Kept."}
+    ]
+
+
+def test_failure_after_streamed_content_stops_emitting():
+    response = '{"content": "Partial text", "summary": 12}'
+
+    parser = StructuredOutputParser()
+    pieces = [piece for chunk in chunks(response, 4) for piece in parser.feed(chunk)]
+    content, _ = parser.finish()
+
+    assert parser.failed
+    assert "".join(text for _, text in pieces) == "Partial text"
+    assert content == split_analysis(response)[0]
+
+
+def test_parse_structured_output(counters):
+    content, explanation, elements = parse_structured_output(RESPONSE)
+
+    assert content == CONTENT
+    assert elements == ELEMENTS
+    assert "Detailed List of Reused Elements:" in explanation
+    assert counters() == {"parsed": 1, "fallbacks": 0}
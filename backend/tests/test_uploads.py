@@ -0,0 +1,155 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from utils.uploads import UploadError, UploadOffsetMismatch, UploadStore, UploadTooLarge
+
+DATA = b"%PDF-1.4 test document" * 100
+
+
+class SlowStream:
+    """Request body that yields in small pieces, so two PATCHes overlap."""
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size):
+        time.sleep(0.01)
+        return self._stream.read(min(size, 4))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(str(tmp_path), max_bytes=4096, janitor_interval=0)
+
+
+def test_save_names_the_file_by_its_hash(store):
+    path, digest = store.save(io.BytesIO(DATA), "../report.pdf")
+
+    assert digest == hashlib.sha256(DATA).hexdigest()
+    assert os.path.basename(path) == f"{digest[:16]}_report.pdf"
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_oversized_upload_leaves_no_file(store):
+    with pytest.raises(UploadTooLarge):
+        store.save(io.BytesIO(b"x" * 5000), "big.pdf")
+
+    assert os.listdir(store.folder) == []
+    assert store.stats()["rejected"] == 1
+
+
+def test_resumed_upload_is_completed(store):
+    upload_id = store.create_session("report.pdf", size=len(DATA))["upload_id"]
+    store.append(upload_id, 0, io.BytesIO(DATA[:1000]))
+
+    assert store.get_session(upload_id)["offset"] == 1000
+    with pytest.raises(UploadOffsetMismatch):
+        store.complete(upload_id)
+
+    store.append(upload_id, 1000, io.BytesIO(DATA[1000:]))
+    path, digest = store.complete(upload_id, sha256=hashlib.sha256(DATA).hexdigest())
+
+    assert digest == hashlib.sha256(DATA).hexdigest()
+    assert store.get_session(upload_id) is None
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_checksum_mismatch_is_rejected(store):
+    upload_id = store.create_session("report.pdf")["upload_id"]
+    store.append(upload_id, 0, io.BytesIO(DATA))
+
+    with pytest.raises(UploadError):
+        store.complete(upload_id, sha256="0" * 64)
+
+
+def test_retried_append_gets_current_offset(store):
+    upload_id = store.create_session("document.txt")["upload_id"]
+    store.append(upload_id, 0, io.BytesIO(b"part"))
+
+    with pytest.raises(UploadOffsetMismatch) as excinfo:
+        store.append(upload_id, 0, io.BytesIO(b"part"))
+
+    assert excinfo.value.offset == 4
+
+
+def test_sweep_removes_abandoned_sessions(store):
+    upload_id = store.create_session("report.pdf")["upload_id"]
+
+    assert store.sweep(now=time.time() + store.session_ttl + 1) == 2
+    assert store.get_session(upload_id) is None
+
+
+def test_concurrent_appends_at_same_offset(store):
+    upload_id = store.create_session("document.txt", size=32)["upload_id"]
+    results, errors = [], []
+
+    def patch(data):
+        try:
+            results.append(store.append(upload_id, 0, SlowStream(data)))
+        except UploadOffsetMismatch as e:
+            errors.append(e.offset)
+
+    threads = [threading.Thread(target=patch, args=(data,)) for data in (b"a" * 16, b"b" * 16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [16] and errors == [16]
+    assert store.get_session(upload_id)["offset"] == 16
+
+    # Whichever PATCH won, the part file holds it whole, not a mix of both
+    with open(store._session_paths(upload_id)[1], "rb") as f:
+        data = f.read()
+    assert data in (b"a" * 16, b"b" * 16)
+
+    store.append(upload_id, 16, io.BytesIO(b"c" * 16))
+    path, digest = store.complete(upload_id)
+
+    with open(path, "rb") as f:
+        assert f.read() == data + b"c" * 16
+    assert digest == hashlib.sha256(data + b"c" * 16).hexdigest()
+
+
+def parse_multipart(store, data):
+    """Parses a multipart body the way /upload does, with file parts written into the store."""
+    from werkzeug.formparser import FormDataParser
+    from werkzeug.test import EnvironBuilder
+
+    def stream_factory(total_content_length, content_type, filename=None, content_length=None):
+        return store.open(filename)
+
+    environ = EnvironBuilder(method="POST", data={"file": (io.BytesIO(data), "report.pdf")}).get_environ()
+    return FormDataParser(stream_factory).parse_from_environ(environ)[2]
+
+
+def test_multipart_part_is_hashed_as_it_arrives(store):
+    file = parse_multipart(store, DATA)["file"]
+    path, digest = file.stream.finish()
+
+    assert digest == hashlib.sha256(DATA).hexdigest()
+    assert os.listdir(store.folder) == [os.path.basename(path)]
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_oversized_multipart_part_is_rejected_while_parsing(store):
+    with pytest.raises(UploadTooLarge):
+        parse_multipart(store, b"x" * 5000)
+
+    assert os.listdir(store.folder) == []
+
+
+def test_discarded_writer_leaves_no_file(store):
+    writer = store.open("report.pdf")
+    writer.write(DATA)
+    writer.discard()
+
+    assert os.listdir(store.folder) == []
@@ -0,0 +1,197 @@
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from utils.metrics import timer
+
+# Настройки журнала запросов
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))  # Секунды
+AUDIT_PAYLOAD_POLICY = os.getenv("AUDIT_PAYLOAD_POLICY", "full")  # full, truncate или compress
+AUDIT_MAX_CHARS = int(os.getenv("AUDIT_MAX_CHARS", "20000"))  # Порог для truncate/compress
+
+COMPRESSED_PREFIX = "zlib:"
+
+
+def _truncate(value, max_chars):
+    """Обрезает длинные строки внутри структуры, сохраняя валидный JSON."""
+    if isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}...[truncated {len(value) - max_chars} chars]"
+    if isinstance(value, dict):
+        return {key: _truncate(item, max_chars) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_truncate(item, max_chars) for item in value]
+    return value
+
+
+def encode_payload(data, policy=AUDIT_PAYLOAD_POLICY, max_chars=AUDIT_MAX_CHARS):
+    """Сериализует данные запроса/ответа согласно политике хранения."""
+    if policy == "truncate":
+        return json.dumps(_truncate(data, max_chars))
+    serialized = json.dumps(data)
+    if policy == "compress" and len(serialized) > max_chars:
+        return COMPRESSED_PREFIX + base64.b64encode(zlib.compress(serialized.encode("utf-8"))).decode("ascii")
+    return serialized
+
+
+def decode_payload(text):
+    """Обратная операция к encode_payload (для чтения таблицы user_requests)."""
+    if text is None:
+        return None
+    if text.startswith(COMPRESSED_PREFIX):
+        text = zlib.decompress(base64.b64decode(text[len(COMPRESSED_PREFIX):])).decode("utf-8")
+    return json.loads(text)
+
+
+class AuditLogger:
+    """
+    Журнал запросов с отложенной записью: запросы кладут записи в ограниченную очередь,
+    фоновый поток пишет их в user_requests пачками одной транзакцией.
+    Данные сериализуются сразу в log(), поэтому последующие изменения словарей вызывающим
+    кодом не попадают в журнал, а несериализуемая запись не портит пачку.
+    Если пачка не записалась, ее записи повторяются по одной: теряются только ошибочные.
+    При переполнении очереди записи отбрасываются (учитываются в dropped), а не блокируют запрос.
+    """
+
+    def __init__(self, queue_size=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL, policy=AUDIT_PAYLOAD_POLICY, max_chars=AUDIT_MAX_CHARS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.max_chars = max_chars
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Поток запускается лениво и заново после fork (в воркерах пула процессов)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is not None:
+                    # Очередь, унаследованная от родителя, принадлежит его потоку записи
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def log(self, endpoint, request_data, response_data):
+        """Сериализует данные в потоке запроса и ставит запись в очередь; в БД ее пишет фоновый поток."""
+        self._ensure_started()
+        try:
+            request_data = encode_payload(request_data, self.policy, self.max_chars)
+            response_data = encode_payload(response_data, self.policy, self.max_chars)
+        except (TypeError, ValueError) as e:
+            with self._lock:
+                self.failed += 1
+            logging.error(f"Failed to serialize request record for {endpoint}: {e}")
+            return
+        try:
+            self._queue.put_nowait((endpoint, request_data, response_data, time.time()))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logging.warning("Audit log queue is full, dropping request record.")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _insert(self, batch):
+        # Импорт в фоновом потоке: SQLAlchemy не загружается при старте приложения
+        from models import Session, UserRequest
+
+        db = Session()
+        try:
+            db.add_all([
+                UserRequest(
+                    endpoint=endpoint,
+                    request_data=request_data,
+                    response_data=response_data,
+                    timestamp=datetime.utcfromtimestamp(created_at),
+                )
+                for endpoint, request_data, response_data, created_at in batch
+            ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write(self, batch):
+        try:
+            with timer("db_write"):
+                self._insert(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                with self._lock:
+                    self.failed += 1
+                logging.error(f"Failed to save a {batch[0][0]} request to the database: {e}")
+                return
+            logging.warning(f"Failed to save {len(batch)} requests in one transaction, retrying one by one: {e}")
+            for item in batch:
+                self._write([item])
+            return
+        with self._lock:
+            self.written += len(batch)
+        logging.debug(f"Saved {len(batch)} requests to the database.")
+
+    def flush(self):
+        """Блокирует, пока все поставленные в очередь записи не будут записаны."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        """Дописывает очередь и останавливает поток (вызывается при завершении процесса)."""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=30)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "policy": self.policy,
+            }
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Настройки пакетной обработки: параллельность каждой стадии и число документов в работе
+BATCH_EXTRACT_WORKERS = int(os.getenv("BATCH_EXTRACT_WORKERS", "2"))
+BATCH_RETRIEVE_WORKERS = int(os.getenv("BATCH_RETRIEVE_WORKERS", "2"))
+BATCH_LLM_WORKERS = int(os.getenv("BATCH_LLM_WORKERS", "4"))
+BATCH_IN_FLIGHT = int(os.getenv("BATCH_IN_FLIGHT", "16"))  # Документов между первой и последней стадией
+BATCH_FOLDER = os.getenv("BATCH_FOLDER", "static/batches")
+
+SUPPORTED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"}
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def instructions_key(instructions):
+    """Ключ набора инструкций: результаты другой инструкции при возобновлении не засчитываются."""
+    return hashlib.sha256(instructions.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def _supported(name):
+    return os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def collect_inputs(paths, store):
+    """
+    Раскрывает пути в список документов {"file", "path", "file_hash"}: каталоги обходятся
+    рекурсивно, архивы .zip распаковываются в store (UploadStore, с его лимитом размера).
+    Неподдерживаемые файлы пропускаются.
+    """
+    items = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if _supported(name):
+                        file_path = os.path.join(root, name)
+                        items.append({"file": os.path.relpath(file_path, path), "path": file_path})
+        elif zipfile.is_zipfile(path):
+            items.extend(extract_zip(path, store))
+        elif _supported(path):
+            items.append({"file": os.path.basename(path), "path": path})
+        else:
+            logging.warning(f"Skipping unsupported batch input {path}.")
+    for item in items:
+        if "file_hash" not in item:
+            item["file_hash"] = hash_file(item["path"])
+    return items
+
+
+def extract_zip(path, store):
+    """Сохраняет поддерживаемые файлы архива в store; имена членов архива не используются как пути."""
+    items = []
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.infolist():
+            if member.is_dir() or not _supported(member.filename):
+                continue
+            with archive.open(member) as stream:
+                file_path, file_hash = store.save(stream, os.path.basename(member.filename), member.file_size)
+            items.append({"file": member.filename, "path": file_path, "file_hash": file_hash})
+    return items
+
+
+def load_state(output_path):
+    """Последняя запись по каждому документу (file_hash, инструкции) из JSONL-результатов."""
+    state = {}
+    if not os.path.exists(output_path):
+        return state
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Недописанная строка после прерывания
+            state[(record.get("file_hash"), record.get("instructions_key"))] = record
+    return state
+
+
+class BatchRunner:
+    """
+    Конвейер пакетной обработки: стадии (например, извлечение -> поиск -> LLM) выполняются
+    в отдельных пулах потоков со своей параллельностью, документ переходит на следующую
+    стадию, как только закончил предыдущую. В работе одновременно не больше in_flight
+    документов, поэтому быстрое извлечение не накапливает тексты перед медленной моделью.
+    Каждый результат сразу дописывается строкой в JSONL; при повторном запуске с тем же
+    файлом документы со статусом done пропускаются.
+    stages — список (имя, функция(record), число потоков); функция дополняет record.
+    """
+
+    def __init__(self, stages, output_path, in_flight=BATCH_IN_FLIGHT):
+        self.stages = stages
+        self.output_path = output_path
+        self.in_flight = in_flight
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self._write_lock = threading.Lock()
+        self._slots = threading.Semaphore(in_flight)
+
+    def _write(self, record):
+        try:
+            with self._write_lock:
+                with open(self.output_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if record["status"] == "done":
+                    self.done += 1
+                else:
+                    self.failed += 1
+        except Exception as e:
+            logging.error(f"Failed to write the batch result for {record['file']}: {e}")
+
+    def _run_stage(self, executors, index, record):
+        name, function, _ = self.stages[index]
+        handed_over = False
+        try:
+            started = time.perf_counter()
+            try:
+                function(record)
+            except Exception as e:
+                logging.error(f"Batch {name} failed for {record['file']}: {e}")
+                record.update(status="failed", stage=name, error=str(e))
+            record["timings"][name] = round(time.perf_counter() - started, 3)
+            if record.get("status") != "failed" and index + 1 < len(self.stages):
+                executors[index + 1].submit(self._run_stage, executors, index + 1, record)
+                handed_over = True
+            else:
+                record.setdefault("status", "done")
+                self._write(self._result(record))
+        except Exception as e:
+            logging.error(f"Batch pipeline failed for {record['file']} after {name}: {e}")
+            with self._write_lock:
+                self.failed += 1
+        finally:
+            # Слот документа освобождается, когда он записан или выпал из конвейера, иначе run() не завершится
+            if not handed_over:
+                self._slots.release()
+
+    @staticmethod
+    def _result(record):
+        # Промежуточные данные стадий (текст документа, контекст поиска) и пути на сервере в результат не попадают
+        return {key: value for key, value in record.items() if not key.startswith("_") and key != "path"}
+
+    def run(self, items, instructions):
+        """Обрабатывает документы {"file", "path", "file_hash"}; возвращает сводку."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        key = instructions_key(instructions)
+        state = load_state(self.output_path)
+        executors = [
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"batch-{name}")
+            for name, _, workers in self.stages
+        ]
+        started = time.perf_counter()
+        try:
+            for item in items:
+                previous = state.get((item["file_hash"], key))
+                if previous is not None and previous.get("status") == "done":
+                    self.skipped += 1
+                    continue
+                self._slots.acquire()
+                record = {**item, "instructions_key": key, "timings": {}}
+                executors[0].submit(self._run_stage, executors, 0, record)
+            # Все слоты свободны — значит, все документы записаны
+            for _ in range(self.in_flight):
+                self._slots.acquire()
+            for _ in range(self.in_flight):
+                self._slots.release()
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+        summary = self.stats()
+        logging.info(f"Batch finished in {time.perf_counter() - started:.1f}s: {summary}")
+        return summary
+
+    def stats(self):
+        with self._write_lock:
+            return {"done": self.done, "failed": self.failed, "skipped": self.skipped, "output": self.output_path}
+
+
+def batch_progress(output_path, total, instructions):
+    """Сколько документов пакета уже обработано (по JSONL-результатам)."""
+    key = instructions_key(instructions)
+    records = [record for (_, record_key), record in load_state(output_path).items() if record_key == key]
+    done = sum(1 for record in records if record.get("status") == "done")
+    return {"total": total, "done": done, "failed": len(records) - done, "pending": max(0, total - len(records))}
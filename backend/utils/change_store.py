@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Настройки хранилища изменений по сессиям
+CHANGE_STORE_BACKEND = os.getenv("CHANGE_STORE", "sqlite")  # sqlite (общий для воркеров) или memory
+CHANGE_STORE_TTL = float(os.getenv("CHANGE_STORE_TTL", str(6 * 3600)))  # Секунды
+CHANGE_STORE_MAX_ENTRIES = int(os.getenv("CHANGE_STORE_MAX_ENTRIES", "5000"))
+CHANGE_STORE_DB = os.getenv("CHANGE_STORE_DB", "changes.db")
+
+FIELDS = ("instructions", "document_text", "analysis", "explanation")
+
+
+def _pack(text):
+    return zlib.compress((text or "").encode("utf-8"), 3)
+
+
+def _unpack(data):
+    return zlib.decompress(data).decode("utf-8")
+
+
+class _ChangeRecord:
+    """Компактная запись: длинные тексты хранятся сжатыми, без словаря на каждый объект."""
+
+    __slots__ = ("expires_at", "instructions", "document_text", "analysis", "explanation")
+
+    def __init__(self, changes, expires_at):
+        self.expires_at = expires_at
+        for field in FIELDS:
+            setattr(self, field, _pack(changes.get(field)))
+
+    def to_dict(self):
+        return {field: _unpack(getattr(self, field)) for field in FIELDS}
+
+
+class MemoryChangeStore:
+    """Изменения по session_id в памяти процесса; вытеснение по TTL и LRU."""
+
+    def __init__(self, ttl=CHANGE_STORE_TTL, max_entries=CHANGE_STORE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, session_id, changes):
+        record = _ChangeRecord(changes, time.time() + self.ttl)
+        with self._lock:
+            self._records[session_id] = record
+            self._records.move_to_end(session_id)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+
+    def get(self, session_id):
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is None:
+                return None
+            if record.expires_at < time.time():
+                del self._records[session_id]
+                return None
+            self._records.move_to_end(session_id)
+        return record.to_dict()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._records.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class SQLiteChangeStore:
+    """Изменения в SQLite: одно хранилище на несколько процессов gunicorn."""
+
+    def __init__(self, path=CHANGE_STORE_DB, ttl=CHANGE_STORE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS changes ("
+                "session_id TEXT PRIMARY KEY, instructions BLOB, document_text BLOB, "
+                "analysis BLOB, explanation BLOB, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def put(self, session_id, changes):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO changes (session_id, instructions, document_text, analysis, explanation, "
+                "expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, *(_pack(changes.get(field)) for field in FIELDS), now + self.ttl),
+            )
+            connection.execute("DELETE FROM changes WHERE expires_at < ?", (now,))
+
+    def get(self, session_id):
+        row = self._connect().execute(
+            "SELECT instructions, document_text, analysis, explanation FROM changes "
+            "WHERE session_id = ? AND expires_at >= ?",
+            (session_id, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return {field: _unpack(value) for field, value in zip(FIELDS, row)}
+
+    def delete(self, session_id):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM changes WHERE session_id = ?", (session_id,))
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM changes").fetchone()[0]
+
+
+def create_change_store(name=CHANGE_STORE_BACKEND):
+    if name == "memory":
+        return MemoryChangeStore()
+    if name == "sqlite":
+        return SQLiteChangeStore()
+    raise ValueError(f"Unknown change store backend: {name}")
@@ -0,0 +1,149 @@
+import logging
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.prompt_processing import parse_reused_elements
+
+# Настройки разбиения документа на части
+CHUNK_THRESHOLD_TOKENS = int(os.getenv("CHUNK_THRESHOLD_TOKENS", "3000"))  # Больше — обрабатываем по частям
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "1500"))
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "4"))
+
+# Границы в порядке убывания силы: страница, абзац, строка, предложение
+_BOUNDARIES = [r"\f", r"\n[ \t]*\n", r"\n", r"(?<=[.!?])\s+"]
+_WORD = re.compile(r"\w{4,}", re.UNICODE)
+_STOPWORDS = {
+    "this", "that", "with", "from", "into", "about", "please", "make", "document",
+    "text", "more", "less", "should", "would", "could", "each", "every", "only",
+}
+
+_encoding = None
+
+
+def estimate_tokens(text):
+    """Число токенов по tiktoken, если он установлен, иначе грубая оценка (4 символа на токен)."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:  # Необязательная зависимость: без нее используется оценка по длине
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def _split_units(text, max_tokens, level=0):
+    """Делит текст на единицы не больше max_tokens; разделители остаются в конце единиц."""
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    if level >= len(_BOUNDARIES):
+        # Граница не найдена — режем по длине
+        size = max_tokens * 4
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    units = []
+    position = 0
+    for match in re.finditer(_BOUNDARIES[level], text):
+        units.append(text[position:match.end()])
+        position = match.end()
+    units.append(text[position:])
+
+    result = []
+    for unit in units:
+        if unit:
+            result.extend(_split_units(unit, max_tokens, level + 1))
+    return result
+
+
+def split_into_chunks(text, max_tokens=CHUNK_MAX_TOKENS):
+    """
+    Разбивает документ на части по границам страниц/абзацев в пределах бюджета токенов.
+    "".join(chunks) == text, поэтому неизмененные части склеиваются без потерь.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for unit in _split_units(text, max_tokens):
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _keywords(text):
+    return {word.lower() for word in _WORD.findall(text)} - _STOPWORDS
+
+
+def find_relevant_chunks(chunks, instructions):
+    """Возвращает индексы частей, к которым относятся инструкции (по пересечению ключевых слов); может быть пустым."""
+    keywords = _keywords(instructions)
+    return [index for index, chunk in enumerate(chunks) if keywords & _keywords(chunk)]
+
+
+def select_relevant_chunks(chunks, instructions):
+    """
+    Возвращает индексы частей, к которым относятся инструкции.
+    Если ни одна часть не упоминается, инструкции считаются общими и выбираются все части.
+    """
+    return find_relevant_chunks(chunks, instructions) or list(range(len(chunks)))
+
+
+def _merge_explanations(explanations):
+    if len(explanations) == 1:
+        return explanations[0][1]
+    return "\n\n".join(f"Part {index + 1}:\n{explanation}" for index, explanation in explanations)
+
+
+def run_chunked(chunks, process_chunk, selected=None, max_workers=CHUNK_WORKERS):
+    """
+    Обрабатывает выбранные части параллельно (не больше max_workers одновременно)
+    и склеивает результат. process_chunk(text) -> (content, explanation, reused_elements);
+    reused_elements = None — элементы разбираются из текста пояснения.
+    Возвращает (content, explanation, reused_elements).
+    """
+    selected = list(range(len(chunks))) if selected is None else sorted(set(selected))
+    logging.info(f"Processing {len(selected)} of {len(chunks)} document chunks.")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = list(executor.map(lambda index: process_chunk(chunks[index]), selected))
+
+    return merge_chunks(chunks, dict(zip(selected, results)))
+
+
+def merge_chunks(chunks, updated):
+    """
+    Склеивает документ из частей: updated — {индекс: (content, explanation, reused_elements)}
+    для обработанных частей, остальные остаются как есть.
+    Возвращает (content, explanation, reused_elements).
+    """
+    selected = sorted(updated)
+    parts = []
+    for index, chunk in enumerate(chunks):
+        if index not in updated:
+            parts.append(chunk)
+            continue
+        # Модель возвращает текст без внешних пробелов — восстанавливаем исходный разделитель
+        trailing = chunk[len(chunk.rstrip()):]
+        parts.append(updated[index][0] + trailing)
+
+    explanations = [(index, updated[index][1]) for index in selected]
+    reused_elements, seen = [], set()
+    for index in selected:
+        _, explanation, elements = updated[index]
+        # Структурированные элементы (формат json) берутся как есть, без повторного разбора текста
+        for element in parse_reused_elements(explanation) if elements is None else elements:
+            key = (element.get("content"), element.get("origin"))
+            if key not in seen:
+                seen.add(key)
+                reused_elements.append(element)
+
+    return "".join(parts).strip(), _merge_explanations(explanations), reused_elements
@@ -0,0 +1,288 @@
+import os
+import statistics
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from collections import Counter
+
+# Настройки структурной модели документа
+LINE_TOLERANCE = float(os.getenv("LAYOUT_LINE_TOLERANCE", "3"))  # Слова с разницей top меньше — одна строка
+BLOCK_GAP = float(os.getenv("LAYOUT_BLOCK_GAP", "1.5"))  # Зазор больше BLOCK_GAP * обычный межстрочный — новый блок
+PACK_COMPRESSION = int(os.getenv("PACK_COMPRESSION", "6"))  # Уровень zlib для страниц (0 — без сжатия)
+
+METHODS = ("pypdf2", "pdfplumber", "ocr")
+
+# Формат .dpk: заголовок, записи страниц (каждая сжата отдельно), в конце — индекс смещений.
+# Индекс позволяет прочитать одну страницу, не загружая остальные.
+_MAGIC = b"DPK1"
+_HEADER = struct.Struct("<4sHHIQ")  # magic, версия формата, флаги, число страниц, смещение индекса
+_INDEX_ENTRY = struct.Struct("<QI")  # смещение и длина записи страницы
+_PAGE_HEADER = struct.Struct("<IffBIIH")  # номер, ширина, высота, способ, блоков, строк, шрифтов
+_FLAG_ZLIB = 1
+_NAN = float("nan")
+
+
+def _words_to_lines(words):
+    """Группирует слова pdfplumber в строки по близости координаты top."""
+    lines = []
+    for word in sorted(words, key=lambda item: (round(item["top"]), item["x0"])):
+        if lines and abs(word["top"] - lines[-1][0]["top"]) <= LINE_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+
+    result = []
+    for line_words in lines:
+        line_words.sort(key=lambda item: item["x0"])
+        fonts = Counter()
+        sizes = Counter()
+        for word in line_words:
+            fonts[word.get("fontname")] += len(word["text"])
+            sizes[round(float(word.get("size") or 0), 2)] += len(word["text"])
+        result.append({
+            "text": " ".join(word["text"] for word in line_words),
+            "bbox": [
+                min(word["x0"] for word in line_words),
+                min(word["top"] for word in line_words),
+                max(word["x1"] for word in line_words),
+                max(word["bottom"] for word in line_words),
+            ],
+            "font": fonts.most_common(1)[0][0],
+            "size": sizes.most_common(1)[0][0],
+        })
+    result.sort(key=lambda line: (line["bbox"][1], line["bbox"][0]))
+    return result
+
+
+def _font_family(name):
+    # Префикс подмножества шрифта ("BCDEEE+Aptos") различается у частей одного шрифта
+    return (name or "").split("+", 1)[-1]
+
+
+def _lines_to_blocks(lines):
+    """
+    Объединяет строки в блоки (абзацы). Новый блок начинается, если зазор между строками
+    заметно больше обычного межстрочного на странице или меняется шрифт/размер.
+    """
+    gaps = [line["bbox"][1] - previous["bbox"][3] for previous, line in zip(lines, lines[1:])]
+    positive = [gap for gap in gaps if gap > 0]
+    typical_gap = statistics.median(positive) if positive else 0.0
+
+    blocks = []
+    for line in lines:
+        if blocks:
+            previous = blocks[-1]["lines"][-1]
+            gap = line["bbox"][1] - previous["bbox"][3]
+            same_font = (
+                _font_family(line["font"]) == _font_family(previous["font"])
+                and abs(line["size"] - previous["size"]) <= 1
+            )
+            if same_font and gap <= max(BLOCK_GAP * typical_gap, 0.5 * (line["size"] or 10)):
+                blocks[-1]["lines"].append(line)
+                continue
+        blocks.append({"lines": [line]})
+    for block in blocks:
+        boxes = [line["bbox"] for line in block["lines"]]
+        block["bbox"] = [
+            min(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), max(box[3] for box in boxes),
+        ]
+    return blocks
+
+
+def page_text(blocks):
+    """Текст страницы из блоков: строки через перевод строки, блоки через пустую строку."""
+    return "\n\n".join("\n".join(line["text"] for line in block["lines"]) for block in blocks)
+
+
+def extract_page_layout(page, page_number):
+    """Структура страницы pdfplumber: блоки, строки с bbox (x0, top, x1, bottom), шрифтом и размером."""
+    words = page.extract_words(extra_attrs=["fontname", "size"])
+    blocks = _lines_to_blocks(_words_to_lines(words))
+    return {
+        "page_number": page_number,
+        "width": float(page.width),
+        "height": float(page.height),
+        "method": "pdfplumber",
+        "text": page_text(blocks),
+        "blocks": blocks,
+    }
+
+
+def text_page_layout(page_number, text, method, width=0.0, height=0.0):
+    """Структура для страниц без координат (OCR, изображения): один блок, строки без bbox."""
+    lines = [{"text": line, "bbox": None, "font": None, "size": 0.0} for line in text.splitlines() if line.strip()]
+    blocks = [{"bbox": None, "lines": lines}] if lines else []
+    return {
+        "page_number": page_number,
+        "width": width,
+        "height": height,
+        "method": method,
+        "text": page_text(blocks),
+        "blocks": blocks,
+    }
+
+
+def _to_bytes(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data, offset, count):
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(data[offset:end])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, end
+
+
+def _bbox_values(bbox):
+    return bbox if bbox is not None else (_NAN, _NAN, _NAN, _NAN)
+
+
+def _encode_page(page):
+    """Колоночная запись страницы: массивы координат, шрифтов и смещений текста, затем текст одним блоком."""
+    fonts = {}
+    block_first_line, block_boxes = array("I"), array("f")
+    line_boxes, line_fonts, line_sizes, text_ends = array("f"), array("H"), array("f"), array("I")
+    text = bytearray()
+    for block in page["blocks"]:
+        block_first_line.append(len(line_fonts))
+        block_boxes.extend(_bbox_values(block["bbox"]))
+        for line in block["lines"]:
+            line_boxes.extend(_bbox_values(line["bbox"]))
+            line_fonts.append(fonts.setdefault(line["font"] or "", len(fonts)))
+            line_sizes.append(line["size"] or 0.0)
+            text.extend(line["text"].encode("utf-8"))
+            text_ends.append(len(text))
+
+    parts = [_PAGE_HEADER.pack(
+        page["page_number"], page["width"], page["height"], METHODS.index(page["method"]),
+        len(block_first_line), len(line_fonts), len(fonts),
+    )]
+    for name in fonts:
+        encoded = name.encode("utf-8")
+        parts.append(struct.pack("<H", len(encoded)) + encoded)
+    for values in (block_first_line, block_boxes, line_boxes, line_fonts, line_sizes, text_ends):
+        parts.append(_to_bytes(values))
+    parts.append(bytes(text))
+    return b"".join(parts)
+
+
+def _box(values, index):
+    box = [round(value, 2) for value in values[index * 4:index * 4 + 4]]
+    return None if box[0] != box[0] else box  # NaN — координат нет
+
+
+def _decode_page(data):
+    page_number, width, height, method, n_blocks, n_lines, n_fonts = _PAGE_HEADER.unpack_from(data)
+    offset = _PAGE_HEADER.size
+    fonts = []
+    for _ in range(n_fonts):
+        (length,) = struct.unpack_from("<H", data, offset)
+        fonts.append(data[offset + 2:offset + 2 + length].decode("utf-8") or None)
+        offset += 2 + length
+    block_first_line, offset = _from_bytes("I", data, offset, n_blocks)
+    block_boxes, offset = _from_bytes("f", data, offset, n_blocks * 4)
+    line_boxes, offset = _from_bytes("f", data, offset, n_lines * 4)
+    line_fonts, offset = _from_bytes("H", data, offset, n_lines)
+    line_sizes, offset = _from_bytes("f", data, offset, n_lines)
+    text_ends, offset = _from_bytes("I", data, offset, n_lines)
+    text = data[offset:]
+
+    blocks = []
+    for block_index in range(n_blocks):
+        first = block_first_line[block_index]
+        last = block_first_line[block_index + 1] if block_index + 1 < n_blocks else n_lines
+        lines = []
+        for line_index in range(first, last):
+            start = text_ends[line_index - 1] if line_index else 0
+            lines.append({
+                "text": text[start:text_ends[line_index]].decode("utf-8"),
+                "bbox": _box(line_boxes, line_index),
+                "font": fonts[line_fonts[line_index]],
+                "size": round(line_sizes[line_index], 2),
+            })
+        blocks.append({"bbox": _box(block_boxes, block_index), "lines": lines})
+    return {
+        "page_number": page_number,
+        "width": round(width, 2),
+        "height": round(height, 2),
+        "method": METHODS[method],
+        "text": page_text(blocks),
+        "blocks": blocks,
+    }
+
+
+def write_document_pack(path, pages, compression=PACK_COMPRESSION):
+    """
+    Записывает страницы (итератор структур страниц) в файл .dpk по мере поступления,
+    поэтому весь документ не держится в памяти. Запись атомарная. Возвращает число страниц.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    index = []
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, 1, _FLAG_ZLIB if compression else 0, 0, 0))
+            for page in pages:
+                record = _encode_page(page)
+                if compression:
+                    record = zlib.compress(record, compression)
+                index.append((f.tell(), len(record)))
+                f.write(record)
+            index_offset = f.tell()
+            for offset, length in index:
+                f.write(_INDEX_ENTRY.pack(offset, length))
+            f.seek(0)
+            f.write(_HEADER.pack(_MAGIC, 1, _FLAG_ZLIB if compression else 0, len(index), index_offset))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(index)
+
+
+class DocumentPack:
+    """
+    Чтение файла .dpk: при открытии читаются только заголовок и индекс,
+    страница читается и распаковывается по запросу (произвольный доступ).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, _, flags, count, index_offset = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a document pack")
+            f.seek(index_offset)
+            raw_index = f.read(count * _INDEX_ENTRY.size)
+        self.compressed = bool(flags & _FLAG_ZLIB)
+        self._index = [_INDEX_ENTRY.unpack_from(raw_index, i * _INDEX_ENTRY.size) for i in range(count)]
+
+    def __len__(self):
+        return len(self._index)
+
+    def page(self, page_number):
+        """Возвращает структуру страницы (нумерация с 1)."""
+        if not 1 <= page_number <= len(self._index):
+            raise IndexError(f"Page {page_number} is out of range (1-{len(self._index)})")
+        offset, length = self._index[page_number - 1]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        return _decode_page(zlib.decompress(data) if self.compressed else data)
+
+    def iter_pages(self):
+        for page_number in range(1, len(self) + 1):
+            yield self.page(page_number)
+
+    def page_texts(self):
+        """Страницы в виде {"page_number", "text"} — формат, который ожидает save_styled_pdf."""
+        for page in self.iter_pages():
+            yield {"page_number": page["page_number"], "text": page["text"]}
@@ -0,0 +1,236 @@
+import difflib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Настройки хранилища версий документов
+DOCUMENT_STORE_BACKEND = os.getenv("DOCUMENT_STORE", "sqlite")  # sqlite (общий для воркеров) или memory
+DOCUMENT_STORE_DB = os.getenv("DOCUMENT_STORE_DB", "documents.db")
+DOCUMENT_MAX_VERSIONS = int(os.getenv("DOCUMENT_MAX_VERSIONS", "50"))  # Старые версии удаляются
+DOCUMENT_MAX_DOCUMENTS = int(os.getenv("DOCUMENT_MAX_DOCUMENTS", "5000"))  # Только для memory (LRU)
+
+# Абзацы разделяются пустой строкой, предложения — концом предложения; разделитель остается в конце единицы
+_PARAGRAPH_END = re.compile(r"\n[ \t]*\n\s*")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_SPACES = re.compile(r"\s+")
+
+METADATA_FIELDS = ("document_id", "version", "parent", "source", "instructions", "explanation", "created_at")
+
+
+def _split(text, pattern):
+    units, position = [], 0
+    for match in pattern.finditer(text):
+        units.append(text[position:match.end()])
+        position = match.end()
+    if position < len(text):
+        units.append(text[position:])
+    return units
+
+
+def split_paragraphs(text):
+    """Делит текст на абзацы без потерь: "".join(split_paragraphs(text)) == text."""
+    return _split(text, _PARAGRAPH_END)
+
+
+def split_sentences(text):
+    return _split(text, _SENTENCE_END)
+
+
+def _normalize(unit):
+    return _SPACES.sub(" ", unit).strip()
+
+
+def _opcodes(old_units, new_units):
+    matcher = difflib.SequenceMatcher(
+        None, [_normalize(unit) for unit in old_units], [_normalize(unit) for unit in new_units], autojunk=False
+    )
+    return matcher.get_opcodes()
+
+
+def _sentence_diff(old_text, new_text, paragraph):
+    old_units, new_units = split_sentences(old_text), split_sentences(new_text)
+    ops = []
+    for tag, i1, i2, j1, j2 in _opcodes(old_units, new_units):
+        old_part, new_part = "".join(old_units[i1:i2]), "".join(new_units[j1:j2])
+        if tag == "equal":
+            ops.append({"type": "equal", "text": new_part, "paragraph": paragraph})
+        elif tag == "insert":
+            ops.append({"type": "added", "text": new_part, "paragraph": paragraph})
+        elif tag == "delete":
+            ops.append({"type": "removed", "text": old_part, "paragraph": paragraph})
+        else:
+            ops.append({"type": "substitution", "original_text": old_part, "new_text": new_part, "paragraph": paragraph})
+    return ops
+
+
+def structural_diff(old_text, new_text):
+    """
+    Структурный дифф: сначала по абзацам, затем внутри измененных абзацев — по предложениям.
+    Операции совпадают с типами компонента Diff.jsx: equal, added, removed, substitution.
+    paragraph — номер абзаца в новой версии.
+    """
+    old_paragraphs, new_paragraphs = split_paragraphs(old_text), split_paragraphs(new_text)
+    ops = []
+    for tag, i1, i2, j1, j2 in _opcodes(old_paragraphs, new_paragraphs):
+        if tag == "equal":
+            ops.append({"type": "equal", "text": "".join(new_paragraphs[j1:j2]), "paragraph": j1})
+        elif tag == "insert":
+            ops.append({"type": "added", "text": "".join(new_paragraphs[j1:j2]), "paragraph": j1})
+        elif tag == "delete":
+            ops.append({"type": "removed", "text": "".join(old_paragraphs[i1:i2]), "paragraph": j1})
+        elif i2 - i1 == j2 - j1:
+            # Абзацы изменены на месте — сравниваем попарно по предложениям
+            for offset in range(i2 - i1):
+                ops.extend(_sentence_diff(old_paragraphs[i1 + offset], new_paragraphs[j1 + offset], j1 + offset))
+        else:
+            ops.extend(_sentence_diff("".join(old_paragraphs[i1:i2]), "".join(new_paragraphs[j1:j2]), j1))
+    return ops
+
+
+def changed_paragraphs(old_text, new_text):
+    """Номера абзацев новой версии, которые добавлены или изменены относительно старой."""
+    changed = []
+    for tag, _, _, j1, j2 in _opcodes(split_paragraphs(old_text), split_paragraphs(new_text)):
+        if tag in ("insert", "replace"):
+            changed.extend(range(j1, j2))
+    return changed
+
+
+def _pack(text):
+    return zlib.compress((text or "").encode("utf-8"), 3)
+
+
+def _unpack(data):
+    return zlib.decompress(data).decode("utf-8")
+
+
+class _Version:
+    """Версия в памяти: текст хранится сжатым."""
+
+    __slots__ = ("version", "parent", "source", "instructions", "explanation", "created_at", "text")
+
+    def __init__(self, version, parent, source, instructions, explanation, text):
+        self.version = version
+        self.parent = parent
+        self.source = source
+        self.instructions = instructions
+        self.explanation = explanation
+        self.created_at = time.time()
+        self.text = _pack(text)
+
+    def to_dict(self, document_id, with_text=True):
+        result = {"document_id": document_id, **{field: getattr(self, field) for field in METADATA_FIELDS[1:]}}
+        if with_text:
+            result["text"] = _unpack(self.text)
+        return result
+
+
+class MemoryVersionStore:
+    """Версии документов в памяти процесса; вытесняются давно не использованные документы."""
+
+    def __init__(self, max_versions=DOCUMENT_MAX_VERSIONS, max_documents=DOCUMENT_MAX_DOCUMENTS):
+        self.max_versions = max_versions
+        self.max_documents = max_documents
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_version(self, document_id, text, parent=None, source="client", instructions=None, explanation=None):
+        """Сохраняет новую версию документа и возвращает ее номер."""
+        with self._lock:
+            versions = self._documents.setdefault(document_id, [])
+            number = versions[-1].version + 1 if versions else 1
+            versions.append(_Version(number, parent, source, instructions, explanation, text))
+            del versions[:-self.max_versions]
+            self._documents.move_to_end(document_id)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        return number
+
+    def get_version(self, document_id, version=None):
+        """Возвращает версию (по умолчанию последнюю) с текстом или None."""
+        with self._lock:
+            versions = self._documents.get(document_id)
+            if not versions:
+                return None
+            self._documents.move_to_end(document_id)
+            if version is None:
+                record = versions[-1]
+            else:
+                record = next((item for item in versions if item.version == version), None)
+        return record.to_dict(document_id) if record is not None else None
+
+    def list_versions(self, document_id):
+        with self._lock:
+            versions = list(self._documents.get(document_id, []))
+        return [record.to_dict(document_id, with_text=False) for record in versions]
+
+
+class SQLiteVersionStore:
+    """Версии документов в SQLite: одно хранилище на несколько процессов gunicorn."""
+
+    def __init__(self, path=DOCUMENT_STORE_DB, max_versions=DOCUMENT_MAX_VERSIONS):
+        self.path = path
+        self.max_versions = max_versions
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS versions ("
+                "document_id TEXT NOT NULL, version INTEGER NOT NULL, parent INTEGER, source TEXT, "
+                "instructions TEXT, explanation TEXT, created_at REAL NOT NULL, text BLOB NOT NULL, "
+                "PRIMARY KEY (document_id, version))"
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def add_version(self, document_id, text, parent=None, source="client", instructions=None, explanation=None):
+        connection = self._connect()
+        with connection:
+            # BEGIN IMMEDIATE: номер версии выбирается и вставляется под одной блокировкой записи
+            connection.execute("BEGIN IMMEDIATE")
+            number = connection.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM versions WHERE document_id = ?", (document_id,)
+            ).fetchone()[0]
+            connection.execute(
+                "INSERT INTO versions (document_id, version, parent, source, instructions, explanation, created_at, "
+                "text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (document_id, number, parent, source, instructions, explanation, time.time(), _pack(text)),
+            )
+            connection.execute(
+                "DELETE FROM versions WHERE document_id = ? AND version <= ?", (document_id, number - self.max_versions)
+            )
+        return number
+
+    def get_version(self, document_id, version=None):
+        query = f"SELECT {', '.join(METADATA_FIELDS)}, text FROM versions WHERE document_id = ?"
+        if version is None:
+            row = self._connect().execute(query + " ORDER BY version DESC LIMIT 1", (document_id,)).fetchone()
+        else:
+            row = self._connect().execute(query + " AND version = ?", (document_id, version)).fetchone()
+        if row is None:
+            return None
+        return {**dict(zip(METADATA_FIELDS, row[:-1])), "text": _unpack(row[-1])}
+
+    def list_versions(self, document_id):
+        rows = self._connect().execute(
+            f"SELECT {', '.join(METADATA_FIELDS)} FROM versions WHERE document_id = ? ORDER BY version",
+            (document_id,),
+        ).fetchall()
+        return [dict(zip(METADATA_FIELDS, row)) for row in rows]
+
+
+def create_version_store(name=DOCUMENT_STORE_BACKEND):
+    if name == "memory":
+        return MemoryVersionStore()
+    if name == "sqlite":
+        return SQLiteVersionStore()
+    raise ValueError(f"Unknown document store backend: {name}")
@@ -1,35 +1,65 @@
-from elasticsearch import Elasticsearch
-from datetime import datetime
+import os
+import threading
+
+# Параметры подключения к Elasticsearch: только из переменных окружения, без значений по умолчанию
+ES_CLOUD_ID = os.getenv("ES_CLOUD_ID")
+ES_URL = os.getenv("ES_URL")  # Если задан, используется вместо Cloud ID (например, локальный кластер)
+ES_USERNAME = os.getenv("ES_USERNAME", "elastic")
+ES_PASSWORD = os.getenv("ES_PASSWORD")
+ES_TIMEOUT = float(os.getenv("ES_TIMEOUT", "10"))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def is_configured():
+    """Заданы ли адрес кластера (ES_URL или ES_CLOUD_ID) и пароль."""
+    return bool((ES_URL or ES_CLOUD_ID) and ES_PASSWORD)
+
+
+def get_client():
+    """Возвращает общий клиент Elasticsearch; подключение создается при первом обращении."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            if not is_configured():
+                raise RuntimeError("Elasticsearch is not configured: set ES_URL or ES_CLOUD_ID and ES_PASSWORD.")
+            from elasticsearch import Elasticsearch
+
+            connection = {"hosts": [ES_URL]} if ES_URL else {"cloud_id": ES_CLOUD_ID}
+            _client = Elasticsearch(
+                **connection,
+                basic_auth=(ES_USERNAME, ES_PASSWORD),
+                request_timeout=ES_TIMEOUT,
+            )
+        return _client
 
-# Подключение к Elasticsearch
-es = Elasticsearch(
-    cloud_id="08b3dd79313b4064b845f7f3bb950f55:dXMtY2VudHJhbDEuZ2NwLmNsb3VkLmVzLmlvOjQ0MyRjNjhiNTI5MjhlZDk0ZjQyYjRjYTRkM2UwNWY1NzIwZCQ1MTM0YzJmOGRhMWY0Mzg3YTZmZTNiYzczYTE5MGVmMQ==",  # Ваш Cloud ID
-    basic_auth=("elastic", "EDLUByRRMXi3R4Zu5vGtO0za")  # Учетные данные
-)
 
 def save_to_elasticsearch(index, data):
     """
     Сохраняет данные в указанный индекс Elasticsearch.
     """
     try:
-        response = es.index(index=index, document=data)
+        response = get_client().index(index=index, document=data)
         return response["_id"]  # Возвращает ID документа
     except Exception as e:
         raise RuntimeError(f"Failed to index data in Elasticsearch: {e}")
-def search_in_elasticsearch(index, query):
+
+def search_in_elasticsearch(index, query, size=10):
     """
     Ищет данные в указанном индексе Elasticsearch.
     """
     try:
-        body = {
-            "query": {
+        response = get_client().search(
+            index=index,
+            query={
                 "multi_match": {
                     "query": query,
                     "fields": ["instructions", "document_text", "analysis"]
                 }
-            }
-        }
-        response = es.search(index=index, body=body)
+            },
+            size=size,
+        )
         return [hit["_source"] for hit in response["hits"]["hits"]]
     except Exception as e:
         raise RuntimeError(f"Failed to search data in Elasticsearch: {e}")
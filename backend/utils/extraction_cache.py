@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import threading
+
+# Настройки кэша результатов извлечения
+CACHE_FOLDER = os.getenv("EXTRACTION_CACHE_FOLDER", "static/extraction_cache")
+CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class ExtractionCache:
+    """
+    Контентно-адресуемый кэш результатов process_file на диске.
+    Каждая запись — JSON-файл <sha256>.json, рядом может лежать структура документа <sha256>.dpk
+    (см. utils.document_model); время модификации служит меткой LRU,
+    при превышении max_bytes удаляются самые давно использованные файлы.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith((".json", ".dpk")):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        return entries
+
+    def get(self, key):
+        """Возвращает сохраненный результат или None. При попадании PDF не разбирается."""
+        result = self.peek(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def peek(self, key):
+        """
+        Как get, но без учета в hits/misses: для служебных чтений (например, пути
+        к исходному файлу), которые не заменяют извлечение.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            os.utime(path)  # Обновляем метку LRU
+        except (FileNotFoundError, ValueError):
+            return None
+        return result
+
+    def put(self, key, result):
+        """Сохраняет результат атомарно (через временный файл) и вытесняет старые записи."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._total_bytes += os.path.getsize(path) - previous_size
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+        except OSError as e:
+            logging.error(f"Failed to write extraction cache entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def pack_path(self, key):
+        return os.path.join(self.folder, f"{key}.dpk")
+
+    def get_pack(self, key):
+        """Возвращает DocumentPack структуры документа или None, если она еще не построена."""
+        from utils.document_model import DocumentPack
+
+        path = self.pack_path(key)
+        try:
+            pack = DocumentPack(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return pack
+
+    def put_pack(self, key, pages):
+        """Записывает структуру документа из итератора страниц и учитывает ее размер в лимите кэша."""
+        from utils.document_model import DocumentPack, write_document_pack
+
+        path = self.pack_path(key)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        write_document_pack(path, pages)
+        with self._lock:
+            self._total_bytes += os.path.getsize(path) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return DocumentPack(path)
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self._total_bytes = sum(size for _, _, size in entries)
+        for _, name, size in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+                self._total_bytes -= size
+                logging.info(f"Evicted extraction cache entry {name}.")
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
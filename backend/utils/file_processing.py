@@ -1,87 +1,380 @@
-import pytesseract
-from PIL import Image
-from PyPDF2 import PdfReader
-import pdfplumber
-from fpdf import FPDF
+# PyPDF2, pdfplumber, pytesseract и PIL импортируются внутри функций:
+# они нужны только при обработке файлов, а не при старте приложения
+import atexit
+import io
 import logging
+import mmap
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
+from utils.metrics import log_payload
 
-def process_file(file_path):
+# Настройки постраничного движка извлечения текста
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+EXTRACT_BATCH_SIZE = int(os.getenv("EXTRACT_BATCH_SIZE", "16"))  # Страниц на одну задачу пула
+EXTRACT_INLINE_PAGES = int(os.getenv("EXTRACT_INLINE_PAGES", "32"))  # Небольшие файлы — без пула
+EXTRACT_CHEAP_FIRST = os.getenv("EXTRACT_CHEAP_FIRST", "1") == "1"  # Сначала PyPDF2, потом pdfplumber
+EXTRACT_LAYOUT = os.getenv("EXTRACT_LAYOUT", "0") == "1"  # Layout-режим pdfplumber
+
+# Настройки OCR для страниц без текстового слоя
+OCR_ENABLED = os.getenv("OCR_ENABLED", "1") == "1"
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "4"))  # Страниц на одну задачу OCR
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"}
+
+_executor = None
+_ocr_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Возвращает общий для процесса пул воркеров извлечения (создается лениво)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+            atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+        return _executor
+
+
+def _get_ocr_executor():
+    """Отдельный ограниченный пул для Tesseract, чтобы OCR не вытеснял извлечение текста."""
+    global _ocr_executor
+    with _executor_lock:
+        if _ocr_executor is None:
+            _ocr_executor = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+            atexit.register(_ocr_executor.shutdown, wait=False, cancel_futures=True)
+        return _ocr_executor
+
+
+class _MappedStream(io.RawIOBase):
+    """Поток чтения поверх отображения файла в память; у каждого читателя своя позиция."""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        data = self._buffer[self._position:self._position + len(target)]
+        target[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._buffer)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class MappedFile:
+    """
+    Загруженный файл, отображенный в память (см. map_file). Извлечение в этом процессе
+    читает страницы прямо из отображения, без повторного открытия файла;
+    в процессы пула передается путь (os.fspath).
+    """
+
+    def __init__(self, path, buffer):
+        self.path = path
+        self._buffer = buffer
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
+
+    def stream(self):
+        return _MappedStream(self._buffer)
+
+
+@contextmanager
+def map_file(file_path):
+    """Отображает файл в память на время обработки; пустые файлы передаются путем."""
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield file_path
+            return
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
     try:
-        with pdfplumber.open(file_path) as pdf:
-            extracted_text = ""
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    extracted_text += page_text + "\n"  # Сохраняем переносы строк
+        yield MappedFile(os.fspath(file_path), buffer)
+    finally:
+        buffer.close()
 
-        if not extracted_text.strip():
-            raise ValueError("No text could be extracted from the PDF. It might be an image-based PDF.")
 
-        logging.info(f"Extracted text (first 500 chars): {extracted_text[:500]}...")
-        return {"text": extracted_text, "message": "File processed successfully"}
+def _open_source(file_path):
+    """Аргумент для PdfReader/pdfplumber.open: поток по отображению или путь."""
+    return file_path.stream() if isinstance(file_path, MappedFile) else file_path
+
 
+def _pypdf_page_text(page):
+    """Дешевое извлечение текста одной страницы через PyPDF2."""
+    try:
+        return page.extract_text() or ""
     except Exception as e:
-        logging.error(f"Failed to process file: {e}")
-        return {"error": str(e)}
+        logging.warning(f"PyPDF2 failed to extract page text: {e}")
+        return ""
+
+
+def _count_pages(file_path):
+    import pdfplumber
+    from PyPDF2 import PdfReader
 
     try:
-        with pdfplumber.open(file_path) as pdf:
-            extracted_text = ""
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    extracted_text += page_text + "\n"
+        return len(PdfReader(_open_source(file_path)).pages)
+    except Exception:
+        with pdfplumber.open(_open_source(file_path)) as pdf:
+            return len(pdf.pages)
+
+
+def _extract_page_batch(file_path, page_numbers, cheap_first, layout):
+    """Извлекает текст из набора страниц. Выполняется в процессе пула, поэтому файл открывается здесь."""
+    import pdfplumber
+    from PyPDF2 import PdfReader
+
+    reader = None
+    if cheap_first:
+        try:
+            reader = PdfReader(_open_source(file_path))
+        except Exception as e:
+            logging.warning(f"PyPDF2 could not open {file_path}, using pdfplumber only: {e}")
+
+    pages = []
+    pdf = None
+    try:
+        for page_number in page_numbers:
+            text, method = "", None
+            if reader is not None:
+                text, method = _pypdf_page_text(reader.pages[page_number - 1]), "pypdf2"
+            if not text.strip():
+                if pdf is None:
+                    pdf = pdfplumber.open(_open_source(file_path))
+                text, method = pdf.pages[page_number - 1].extract_text(layout=layout) or "", "pdfplumber"
+            pages.append({"page_number": page_number, "text": text, "method": method})
+    finally:
+        if pdf is not None:
+            pdf.close()
+    return pages
+
+
+def _ocr_page_batch(file_path, page_numbers, dpi, lang):
+    """Растеризует только переданные страницы и распознает их Tesseract'ом (в процессе пула)."""
+    import pdfplumber
+    import pytesseract
+
+    texts = {}
+    with pdfplumber.open(_open_source(file_path)) as pdf:
+        for page_number in page_numbers:
+            image = pdf.pages[page_number - 1].to_image(resolution=dpi).original
+            texts[page_number] = pytesseract.image_to_string(image, lang=lang)
+    return texts
+
+
+def _apply_ocr(file_path, pages, dpi, lang):
+    """Распознает страницы без текста пачками в пуле OCR и возвращает их на свои места."""
+    empty = [page["page_number"] for page in pages if not page["text"].strip()]
+    if not empty:
+        return pages
+
+    batches = [empty[i:i + OCR_BATCH_SIZE] for i in range(0, len(empty), OCR_BATCH_SIZE)]
+    texts = {}
+    if OCR_WORKERS <= 1:
+        for batch in batches:
+            try:
+                texts.update(_ocr_page_batch(file_path, batch, dpi, lang))
+            except Exception as e:
+                logging.error(f"OCR failed for pages of {file_path}: {e}")
+    else:
+        executor = _get_ocr_executor()
+        futures = [executor.submit(_ocr_page_batch, os.fspath(file_path), batch, dpi, lang) for batch in batches]
+        for future in futures:
+            try:
+                texts.update(future.result())
+            except Exception as e:
+                logging.error(f"OCR failed for pages of {file_path}: {e}")
+
+    for page in pages:
+        if texts.get(page["page_number"], "").strip():
+            page["text"], page["method"] = texts[page["page_number"]], "ocr"
+    logging.info(f"OCR recognized {sum(1 for t in texts.values() if t.strip())} of {len(empty)} text-less pages.")
+    return pages
+
+
+def iter_pages(file_path, cheap_first=None, layout=None, workers=None, batch_size=None, ocr=None, ocr_dpi=None):
+    """
+    Генератор постраничных результатов: {"page_number", "text", "method"} в порядке страниц.
+    Большие документы разбиваются на пачки страниц и обрабатываются в пуле процессов;
+    одновременно в работе не больше 2 * workers пачек, поэтому память ограничена.
+    Страницы без текстового слоя (по отдельности) отправляются на OCR, если он включен.
+    """
+    ocr = OCR_ENABLED if ocr is None else ocr
+    ocr_dpi = ocr_dpi or OCR_DPI
+    if os.path.splitext(os.fspath(file_path))[1].lower() in IMAGE_EXTENSIONS:
+        yield _ocr_image(os.fspath(file_path))
+        return
+
+    cheap_first = EXTRACT_CHEAP_FIRST if cheap_first is None else cheap_first
+    layout = EXTRACT_LAYOUT if layout is None else layout
+    for pages in _iter_page_batches(file_path, _extract_page_batch, (cheap_first, layout), workers, batch_size):
+        if ocr:
+            pages = _apply_ocr(file_path, pages, ocr_dpi, OCR_LANG)
+        yield from pages
+
+
+def _structure_page_batch(file_path, page_numbers):
+    """Извлекает структуру набора страниц через pdfplumber (в процессе пула)."""
+    import pdfplumber
+
+    from utils.document_model import extract_page_layout
+
+    with pdfplumber.open(_open_source(file_path)) as pdf:
+        return [extract_page_layout(pdf.pages[page_number - 1], page_number) for page_number in page_numbers]
+
+
+def iter_page_structures(file_path, workers=None, batch_size=None, ocr=None, ocr_dpi=None):
+    """
+    Генератор структур страниц (блоки, строки с bbox и шрифтами; см. utils.document_model)
+    в порядке страниц, с тем же ограниченным окном пачек, что и iter_pages.
+    Страницы без текстового слоя распознаются OCR и получают структуру без координат.
+    """
+    from utils.document_model import text_page_layout
+
+    ocr = OCR_ENABLED if ocr is None else ocr
+    ocr_dpi = ocr_dpi or OCR_DPI
+    if os.path.splitext(os.fspath(file_path))[1].lower() in IMAGE_EXTENSIONS:
+        page = _ocr_image(os.fspath(file_path))
+        yield text_page_layout(page["page_number"], page["text"], page["method"])
+        return
+
+    for pages in _iter_page_batches(file_path, _structure_page_batch, (), workers, batch_size):
+        if ocr:
+            recognized = _apply_ocr(file_path, [dict(page, blocks=None) for page in pages], ocr_dpi, OCR_LANG)
+            pages = [
+                text_page_layout(page["page_number"], ocr_page["text"], "ocr", page["width"], page["height"])
+                if ocr_page["method"] == "ocr" else page
+                for page, ocr_page in zip(pages, recognized)
+            ]
+        yield from pages
+
+
+def _ocr_image(file_path):
+    """Распознает загруженное изображение как одну страницу (в пуле OCR)."""
+    if OCR_WORKERS <= 1:
+        result = extract_text_from_image(file_path)
+    else:
+        result = _get_ocr_executor().submit(extract_text_from_image, file_path).result()
+    if "error" in result:
+        raise ValueError(result["error"])
+    return {"page_number": 1, "text": result["text"], "method": "ocr"}
+
+
+def _iter_page_batches(file_path, task, task_args, workers, batch_size):
+    """Выдает результаты task(file_path, page_numbers, *task_args) для пачек страниц по порядку."""
+    workers = EXTRACT_WORKERS if workers is None else workers
+    batch_size = batch_size or EXTRACT_BATCH_SIZE
+
+    total = _count_pages(file_path)
+    batches = [
+        list(range(start, min(start + batch_size, total + 1)))
+        for start in range(1, total + 1, batch_size)
+    ]
+
+    if workers <= 1 or total <= EXTRACT_INLINE_PAGES:
+        for batch in batches:
+            yield task(file_path, batch, *task_args)
+        return
+
+    executor = _get_executor()
+    pending = deque()
+    remaining = iter(batches)
+    try:
+        for batch in remaining:
+            pending.append(executor.submit(task, os.fspath(file_path), batch, *task_args))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            pages = pending.popleft().result()
+            next_batch = next(remaining, None)
+            if next_batch is not None:
+                pending.append(executor.submit(task, os.fspath(file_path), next_batch, *task_args))
+            yield pages
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def extract_pages(file_path, **options):
+    """Возвращает список всех страниц документа (см. iter_pages)."""
+    return list(iter_pages(file_path, **options))
+
+
+def process_file(file_path, with_pages=False):
+    """
+    Извлекает текст всего документа. С with_pages=True добавляет постраничные
+    метаданные (номер страницы, способ извлечения, число символов) для кэша.
+    """
+    try:
+        pages = extract_pages(file_path)
+        # Собираем текст одним join вместо конкатенации в цикле, сохраняя переносы строк
+        extracted_text = "".join(page["text"] + "\n" for page in pages if page["text"])
 
         if not extracted_text.strip():
             raise ValueError("No text could be extracted from the PDF. It might be an image-based PDF.")
 
-        logging.info(f"Extracted text (first 500 chars): {extracted_text[:500]}...")
-        return {"text": extracted_text, "message": "File processed successfully"}
+        log_payload("Extracted text", extracted_text)
+        result = {"text": extracted_text, "message": "File processed successfully"}
+        if with_pages:
+            result["pages"] = [
+                {"page_number": page["page_number"], "method": page["method"], "chars": len(page["text"])}
+                for page in pages
+            ]
+        return result
 
     except Exception as e:
         logging.error(f"Failed to process file: {e}")
         return {"error": str(e)}
 
-    
+
 def save_styled_pdf(output_path, extracted_data):
     """Создает новый PDF с сохранением структуры текста."""
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-
-    # Загрузка шрифтов с поддержкой Unicode
-    pdf.add_font('DejaVu', '', 'DejaVuSans.ttf', uni=True)
-    pdf.add_font('DejaVu', 'B', 'DejaVuSans-Bold.ttf', uni=True)
-    pdf.add_font('DejaVu', 'I', 'DejaVuSans-Oblique.ttf', uni=True)
-    pdf.add_font('DejaVu', 'BI', 'DejaVuSans-BoldOblique.ttf', uni=True)
+    from utils.pdf_export import render_pdf
 
-    for page in extracted_data:
-        pdf.add_page()
-        pdf.set_font('DejaVu', style="B", size=14)
-        pdf.cell(200, 10, f"Page {page['page_number']}", ln=True, align='C')  # Номер страницы
-        pdf.set_font('DejaVu', size=12)
-
-        # Добавление текста
-        if page["text"]:
-            pdf.multi_cell(0, 10, page["text"])
-
-    # Сохранение PDF
-    pdf.output(output_path)
+    # Шрифты разбираются один раз на процесс (см. utils.pdf_export)
+    with open(output_path, "wb") as f:
+        f.write(render_pdf(extracted_data))
 
 def extract_text_from_pdf(file_path):
+    from PyPDF2 import PdfReader
+
     try:
         reader = PdfReader(file_path)
-        extracted_text = ""
-        for page in reader.pages:
-            extracted_text += page.extract_text() + "\n"
+        extracted_text = "".join(_pypdf_page_text(page) + "\n" for page in reader.pages)
         return {"text": extracted_text}
     except Exception as e:
         return {"error": f"Failed to process PDF: {str(e)}"}
 
-def extract_text_from_image(file_path):
+def extract_text_from_image(file_path, lang=OCR_LANG):
+    import pytesseract
+    from PIL import Image
+
     try:
         image = Image.open(file_path)
-        text = pytesseract.image_to_string(image)
+        text = pytesseract.image_to_string(image, lang=lang)
         return {"text": text}
     except Exception as e:
         return {"error": f"Failed to process image: {str(e)}"}
@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Настройки очереди задач
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_EXECUTOR = os.getenv("JOB_EXECUTOR", "thread")  # thread или process
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "15"))  # Секунды между отметками владельца
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", "120"))  # Без отметки дольше — владелец считается мертвым
+
+
+class JobError(Exception):
+    """Ошибка обработчика, которая сохраняется как результат задачи со статусом failed."""
+
+
+@contextmanager
+def _db_session():
+    # SQLAlchemy и создание таблиц откладываются до первого обращения к задачам
+    from models import Session
+
+    db = Session()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class JobQueue:
+    """
+    Локальная очередь задач с пулом воркеров (потоки или процессы).
+    Состояние задач хранится в таблице jobs SQLite, поэтому незавершенные задачи
+    можно перезапустить после рестарта через recover().
+    Перед запуском задача атомарно захватывается (queued -> running с владельцем), поэтому
+    при нескольких воркерах gunicorn и повторной постановке она выполняется один раз.
+    Владелец периодически обновляет heartbeat; recover() забирает только задачи,
+    владелец которых перестал его обновлять.
+    Обработчик — функция payload -> result (JSON-сериализуемые); в режиме process
+    она должна быть функцией верхнего уровня модуля.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, mode=JOB_EXECUTOR, heartbeat_interval=JOB_HEARTBEAT_INTERVAL,
+                 lease_timeout=JOB_LEASE_TIMEOUT):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown job executor mode: {mode}")
+        self.workers = workers
+        self.mode = mode
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_timeout = lease_timeout
+        self.handlers = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._running = set()  # Задачи, захваченные этим процессом
+        self._owner = None
+        self._pid = None
+        self._heartbeat_thread = None
+        self._recovery_thread = None
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    @property
+    def owner(self):
+        """Идентификатор процесса-владельца; после fork у дочернего процесса он новый."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+                    self._running = set()
+                    self._heartbeat_thread = None
+                    self._recovery_thread = None
+                    self._pid = os.getpid()
+        return self._owner
+
+    def _ensure_heartbeat(self):
+        owner = self.owner
+        if self._heartbeat_thread is not None or self.heartbeat_interval <= 0:
+            return
+        with self._lock:
+            if self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(
+                    target=self._run_heartbeat, args=(owner,), name="job-heartbeat", daemon=True
+                )
+                self._heartbeat_thread.start()
+
+    def _run_heartbeat(self, owner):
+        from models import Job
+
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                running = list(self._running)
+            if not running:
+                continue
+            try:
+                with _db_session() as db:
+                    db.query(Job).filter(Job.id.in_(running), Job.owner == owner).update(
+                        {"heartbeat": datetime.utcnow()}, synchronize_session=False
+                    )
+            except Exception as e:
+                logging.error(f"Job heartbeat failed: {e}")
+
+    def _claim(self, job_id):
+        """Атомарно переводит задачу queued -> running за этим процессом. False, если ее уже забрали."""
+        from models import Job
+
+        owner = self.owner
+        with _db_session() as db:
+            claimed = db.query(Job).filter(Job.id == job_id, Job.status == "queued").update(
+                {"status": "running", "owner": owner, "heartbeat": datetime.utcnow()}, synchronize_session=False
+            )
+        if not claimed:
+            logging.info(f"Job {job_id} is already taken by another worker.")
+            return False
+        with self._lock:
+            self._running.add(job_id)
+        self._ensure_heartbeat()
+        return True
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                executor_class = ProcessPoolExecutor if self.mode == "process" else ThreadPoolExecutor
+                self._executor = executor_class(max_workers=self.workers)
+            return self._executor
+
+    def submit(self, kind, payload):
+        """Сохраняет задачу в БД, ставит ее в пул и сразу возвращает ее id."""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        job_id = str(uuid.uuid4())
+        from models import Job
+
+        with _db_session() as db:
+            db.add(Job(id=job_id, kind=kind, status="queued", payload=json.dumps(payload)))
+        self._dispatch(job_id, kind, payload)
+        logging.info(f"Job {job_id} ({kind}) queued.")
+        return job_id
+
+    def _dispatch(self, job_id, kind, payload):
+        handler = self.handlers[kind]
+        executor = self._get_executor()
+        if self.mode == "process":
+            # Статусы и heartbeat пишет родительский процесс, в дочернем выполняется только обработчик
+            if not self._claim(job_id):
+                return
+            future = executor.submit(handler, payload)
+            future.add_done_callback(lambda f: self._finish(job_id, f))
+        else:
+            executor.submit(self._run, job_id, handler, payload)
+
+    def _run(self, job_id, handler, payload):
+        if not self._claim(job_id):
+            return
+        try:
+            result = handler(payload)
+        except Exception as e:
+            self._complete(job_id, error=e)
+        else:
+            self._complete(job_id, result=result)
+
+    def _finish(self, job_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            self._complete(job_id, error=e)
+        else:
+            self._complete(job_id, result=result)
+
+    def _complete(self, job_id, result=None, error=None):
+        if error is not None and not isinstance(error, JobError):
+            logging.error(f"Job {job_id} failed: {error}")
+        with self._lock:
+            self._running.discard(job_id)
+        from models import Job
+
+        with _db_session() as db:
+            job = db.get(Job, job_id)
+            if job is None:
+                return
+            if error is not None:
+                job.status = "failed"
+                job.error = str(error)
+            else:
+                job.status = "done"
+                job.result = json.dumps(result)
+
+    def get(self, job_id):
+        """Возвращает состояние задачи в виде словаря или None."""
+        from models import Job
+
+        with _db_session() as db:
+            job = db.get(Job, job_id)
+            if job is None:
+                return None
+            return {
+                "job_id": job.id,
+                "kind": job.kind,
+                "status": job.status,
+                "result": json.loads(job.result) if job.result else None,
+                "error": job.error,
+                "created_at": job.created_at.isoformat() if job.created_at else None,
+                "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+            }
+
+    def recover(self):
+        """
+        Заново ставит в пул задачи, брошенные своими владельцами: running без heartbeat дольше
+        lease_timeout и queued старше lease_timeout (процесс упал до запуска). Задачи живых
+        воркеров не трогаются, а захват в _claim не дает выполнить задачу дважды.
+        """
+        from models import Job
+
+        stale = datetime.utcnow() - timedelta(seconds=self.lease_timeout)
+        expired = (Job.heartbeat == None) | (Job.heartbeat < stale)  # noqa: E711
+        with _db_session() as db:
+            abandoned = [job_id for (job_id,) in db.query(Job.id).filter(Job.status == "running", expired)]
+            if abandoned:
+                # Условие повторяется в UPDATE: владелец мог успеть обновить heartbeat
+                db.query(Job).filter(Job.id.in_(abandoned), Job.status == "running", expired).update(
+                    {"status": "queued", "owner": None}, synchronize_session=False
+                )
+            pending = [
+                (job.id, job.kind, json.loads(job.payload))
+                for job in db.query(Job).filter(
+                    Job.status == "queued", (Job.updated_at < stale) | Job.id.in_(abandoned)
+                )
+                if job.kind in self.handlers
+            ]
+        for job_id, kind, payload in pending:
+            self._dispatch(job_id, kind, payload)
+        if pending:
+            logging.info(f"Recovered {len(pending)} unfinished jobs.")
+        return len(pending)
+
+    def start_recovery(self):
+        """
+        Фоновый поток: recover() сразу и затем каждые lease_timeout секунд, чтобы задачи
+        воркера, упавшего незадолго до старта, подхватились, когда истечет их lease.
+        В процессе запускается один раз.
+        """
+        self.owner  # Сбрасывает состояние, унаследованное через fork
+        with self._lock:
+            if self._recovery_thread is not None:
+                return
+            self._recovery_thread = threading.Thread(target=self._run_recovery, name="job-recovery", daemon=True)
+            self._recovery_thread.start()
+
+    def _run_recovery(self):
+        while True:
+            try:
+                self.recover()
+            except Exception as e:
+                logging.error(f"Job recovery failed: {e}")
+            time.sleep(self.lease_timeout)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+import time
+
+from utils.metrics import count_tokens
+
+# Параметры модели по умолчанию (как в исходном вызове в app.py)
+DEFAULT_MODEL = "gpt-4"
+DEFAULT_MAX_TOKENS = 2000
+DEFAULT_TEMPERATURE = 0.5
+
+# Ограничение частоты запросов к модели (общее для всех потоков процесса) и повторы после 429
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "0"))  # Запросов в минуту; 0 — без ограничения
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "1.0"))  # Начальная пауза, если нет Retry-After
+
+
+def _openai():
+    """Импортирует openai при первом запросе к модели (ключ API берется из OPENAI_API_KEY)."""
+    import openai
+
+    if openai.api_key is None:
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+
+class RateLimiter:
+    """
+    Равномерно распределяет запросы: не чаще per_minute в минуту на процесс.
+    pause() откладывает все следующие запросы (после ответа 429), чтобы потоки
+    не продолжали упираться в лимит по очереди.
+    """
+
+    def __init__(self, per_minute=LLM_RATE_LIMIT_RPM):
+        self.set_rate(per_minute)
+        self.waited = 0.0
+        self.throttled = 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def set_rate(self, per_minute):
+        self.per_minute = per_minute
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+            wait = start - now
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.throttled += 1
+            self._next = max(self._next, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._lock:
+            return {"per_minute": self.per_minute, "waited_seconds": round(self.waited, 3), "throttled": self.throttled}
+
+
+rate_limiter = RateLimiter()
+
+
+def _retry_delay(error, attempt):
+    """Пауза перед повтором после ошибки лимита (None — ошибка не про лимит)."""
+    openai = _openai()
+    if not isinstance(error, openai.error.RateLimitError) and getattr(error, "http_status", None) != 429:
+        return None
+    retry_after = (getattr(error, "headers", None) or {}).get("retry-after")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return LLM_RETRY_BACKOFF * 2 ** attempt
+
+
+def _create(**options):
+    """ChatCompletion.create с учетом лимита частоты и повторами после 429."""
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        rate_limiter.acquire()
+        try:
+            return _openai().ChatCompletion.create(**options)
+        except Exception as e:
+            delay = _retry_delay(e, attempt) if attempt < LLM_MAX_RETRIES else None
+            if delay is None:
+                raise
+            logging.warning(f"LLM rate limit hit, retrying in {delay:.1f}s (attempt {attempt + 1}): {e}")
+            rate_limiter.pause(delay)
+
+
+class OpenAIChatClient:
+    """Клиент OpenAI ChatCompletion."""
+
+    def complete(self, messages, model=DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE):
+        response = _create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        usage = response.get("usage") or {}
+        count_tokens(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+        return response.choices[0].message["content"]
+
+    def stream(self, messages, model=DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE):
+        """Генератор фрагментов текста по мере их генерации моделью."""
+        response = _create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+        )
+        # Потоковый ответ не содержит usage: фрагмент считается одним токеном ответа
+        for chunk in response:
+            content = chunk.choices[0].delta.get("content")
+            if content:
+                count_tokens(completion=1)
+                yield content
+
+
+class StubLLMClient:
+    """
+    Детерминированная заглушка для тестов и бенчмарков.
+    response — строка или функция от messages; latency — искусственная задержка в секундах.
+    """
+
+    def __init__(self, response="Updated document.\n\nExplanation: No changes were required.", latency=0.0, chunk_size=16):
+        self.response = response
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.calls = []
+
+    def complete(self, messages, **options):
+        self.calls.append({"messages": messages, **options})
+        if self.latency:
+            time.sleep(self.latency)
+        return self.response(messages) if callable(self.response) else self.response
+
+    def stream(self, messages, **options):
+        text = self.complete(messages, **options)
+        for start in range(0, len(text), self.chunk_size):
+            yield text[start:start + self.chunk_size]
+
+
+_client = None
+
+
+def get_llm_client():
+    """Возвращает текущий клиент LLM (по умолчанию — OpenAI)."""
+    global _client
+    if _client is None:
+        _client = OpenAIChatClient()
+    return _client
+
+
+def set_llm_client(client):
+    """Подменяет клиент LLM, например на StubLLMClient в тестах."""
+    global _client
+    _client = client
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Настройки кэша ответов модели
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "tiered")  # memory, sqlite, tiered или off
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))  # Секунды
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "llm_cache.db")
+
+_SPACES = re.compile(r"[^\S\n]+")  # Пробельные символы внутри строки
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def _normalize(text):
+    """Схлопывает пробелы внутри строк и обрезает их края; переводы строк и абзацы сохраняются."""
+    lines = (text or "").replace("\r\n", "\n").split("\n")
+    text = "\n".join(_SPACES.sub(" ", line).strip() for line in lines)
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def make_cache_key(model, temperature, instructions, document_text, context, output_format="text"):
+    """
+    Нормализованный ключ запроса: пробелы внутри строк схлопываются, поэтому повторные
+    отправки с косметическими отличиями попадают в одну запись. Регистр значим:
+    "rename Acme to ACME" и "rename ACME to Acme" — разные запросы.
+    Разбивка на строки и абзацы входит в ключ: модель ее воспроизводит.
+    Ответы в разных форматах (см. LLM_OUTPUT_FORMAT) хранятся под разными ключами.
+    """
+    payload = {
+        "model": model,
+        "temperature": round(float(temperature), 3),
+        "instructions": _normalize(instructions),
+        "document": _normalize(document_text),
+        "context": _normalize(context),
+    }
+    if output_format != "text":
+        payload["output_format"] = output_format  # Ключи прежних текстовых ответов не меняются
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """LRU-кэш в памяти процесса с TTL."""
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCacheBackend:
+    """Кэш на диске в SQLite (общий для нескольких процессов); вытеснение по TTL и LRU."""
+
+    def __init__(self, path=LLM_CACHE_DB, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND expires_at >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            connection.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            connection.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class TieredCacheBackend:
+    """Быстрый LRU в памяти перед общим кэшем на диске."""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def get(self, key):
+        value = self.first.get(key)
+        if value is None:
+            value = self.second.get(key)
+            if value is not None:
+                self.first.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.first.set(key, value)
+        self.second.set(key, value)
+
+
+def create_backend(name=LLM_CACHE_BACKEND):
+    if name == "off":
+        return None
+    if name == "memory":
+        return MemoryCacheBackend()
+    if name == "sqlite":
+        return SQLiteCacheBackend()
+    if name == "tiered":
+        return TieredCacheBackend(MemoryCacheBackend(), SQLiteCacheBackend())
+    raise ValueError(f"Unknown LLM cache backend: {name}")
+
+
+class LLMResponseCache:
+    """
+    Кэш ответов модели с объединением одновременных одинаковых запросов:
+    пока первый запрос ждет ответа, остальные ждут его Future вместо своего вызова.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.saved_seconds = 0.0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает закэшированный ответ или None (и учитывает попадание)."""
+        if self.backend is None:
+            return None
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            logging.error(f"LLM cache lookup failed: {e}")
+            entry = None
+        if entry is None:
+            return None
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += entry.get("latency", 0.0)
+        self._log_hit()
+        return entry["response"]
+
+    def put(self, key, response, latency):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, {"response": response, "latency": latency})
+        except Exception as e:
+            logging.error(f"LLM cache write failed: {e}")
+
+    def get_or_compute(self, key, compute):
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            logging.info("LLM request coalesced with an identical in-flight request.")
+            return future.result()
+
+        started = time.perf_counter()
+        try:
+            response = compute()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            self.put(key, response, time.perf_counter() - started)
+            return response
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _log_hit(self):
+        stats = self.stats()
+        logging.info(
+            f"LLM cache hit (hit rate {stats['hit_rate']:.1%}, saved {stats['saved_seconds']:.1f}s so far)."
+        )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "backend": type(self.backend).__name__ if self.backend else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
@@ -0,0 +1,224 @@
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Настройки метрик и трассировки
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+TRACE_HEADERS = os.getenv("TRACE_HEADERS", "0") == "1"  # Server-Timing во всех ответах (иначе по X-Trace: 1)
+LOG_PAYLOAD_SAMPLE = float(os.getenv("LOG_PAYLOAD_SAMPLE", "0"))  # Доля запросов с логом текстов (0..1)
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", "500"))
+
+# Границы корзин гистограмм (секунды): от быстрых стадий до вызовов модели
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Трасса текущего запроса: список (стадия, секунды) и решение о логировании текстов
+_trace = contextvars.ContextVar("trace", default=None)
+_payload_sampled = contextvars.ContextVar("payload_sampled", default=None)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Монотонный счетчик с метками."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами (формат Prometheus: _bucket, _sum, _count)."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счетчики корзин..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {round(state[-2], 6)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}"
+
+
+class Registry:
+    """Метрики процесса и источники значений (stats() компонентов), которые читаются при выгрузке."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}  # Имя -> stats, в порядке регистрации
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name, stats):
+        """
+        Добавляет числовые поля stats() (словарь) как gauge с префиксом backend_<name>_.
+        Повторная регистрация того же имени заменяет источник, а не дублирует серии.
+        """
+        self._collectors[name] = stats
+
+    def render(self):
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        for name, stats in list(self._collectors.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                logging.warning(f"Metrics collector {name} failed: {e}")
+                continue
+            for key, value in (values or {}).items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                metric_name = f"backend_{name}_{key}"
+                lines.append(f"# TYPE {metric_name} gauge")
+                lines.append(f"{metric_name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр процесса и метрики конвейера
+registry = Registry()
+stage_seconds = registry.histogram(
+    "backend_stage_seconds", "Time spent in a pipeline stage.", ("stage",)
+)
+stage_errors = registry.counter(
+    "backend_stage_errors_total", "Pipeline stages that raised an exception.", ("stage",)
+)
+request_seconds = registry.histogram(
+    "backend_http_request_seconds", "Time to produce an HTTP response (headers).", ("endpoint", "method", "status")
+)
+llm_tokens = registry.counter(
+    "backend_llm_tokens_total", "Language model tokens (prompt and completion).", ("type",)
+)
+
+
+@contextmanager
+def timer(stage):
+    """Замеряет стадию: гистограмма backend_stage_seconds, ошибки и трасса текущего запроса."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:  # GeneratorExit (клиент закрыл поток) ошибкой не считается
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+def count_tokens(prompt=0, completion=0):
+    if prompt:
+        llm_tokens.inc(prompt, type="prompt")
+    if completion:
+        llm_tokens.inc(completion, type="completion")
+
+
+def start_trace(sample_rate=None):
+    """Начинает трассу запроса и решает, логировать ли в нем тексты документов."""
+    sample_rate = LOG_PAYLOAD_SAMPLE if sample_rate is None else sample_rate
+    _trace.set([])
+    _payload_sampled.set(sample_rate > 0 and random.random() < sample_rate)
+
+
+def end_trace():
+    """Возвращает стадии текущего запроса [(стадия, секунды)] и сбрасывает трассу."""
+    trace = _trace.get() or []
+    _trace.set(None)
+    _payload_sampled.set(None)
+    return trace
+
+
+def server_timing(trace):
+    """Заголовок Server-Timing: суммарное время каждой стадии в миллисекундах."""
+    totals = {}
+    for stage, seconds in trace:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+def payload_logging():
+    """True, если текущий запрос попал в выборку подробного логирования текстов."""
+    sampled = _payload_sampled.get()
+    if sampled is None:  # Вне запроса (фоновые задачи) — отдельное решение на каждый вызов
+        return LOG_PAYLOAD_SAMPLE > 0 and random.random() < LOG_PAYLOAD_SAMPLE
+    return sampled
+
+
+def log_payload(label, text):
+    """Логирует начало текста только для запросов из выборки: строка не форматируется на горячем пути."""
+    if payload_logging():
+        logging.info(f"{label} (first {LOG_PAYLOAD_CHARS} chars): {text[:LOG_PAYLOAD_CHARS]}...")
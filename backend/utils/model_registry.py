@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+import time
+
+# Настройки загрузки моделей transformers
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "0") == "1"  # Загружать модели при старте, а не при первом запросе
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", "2"))  # Потоков torch на процесс (0 — не ограничивать)
+MODEL_DEVICE = int(os.getenv("MODEL_DEVICE", "-1"))  # -1 — CPU, иначе номер GPU
+
+
+class ModelRegistry:
+    """
+    Пайплайны transformers, загруженные один раз на процесс.
+    transformers и torch импортируются только при первой загрузке модели,
+    поэтому остальные эндпоинты их не подтягивают.
+    """
+
+    def __init__(self, threads=MODEL_THREADS, device=MODEL_DEVICE):
+        self.threads = threads
+        self.device = device
+        self._pipelines = {}
+        self._load_times = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._threads_configured = False
+
+    def _configure_threads(self):
+        """Ограничивает число потоков torch, чтобы воркеры gunicorn не делили ядра между собой."""
+        if self._threads_configured or self.threads <= 0:
+            return
+        # Переменные читаются библиотеками BLAS/OpenMP при их первой загрузке
+        os.environ.setdefault("OMP_NUM_THREADS", str(self.threads))
+        os.environ.setdefault("MKL_NUM_THREADS", str(self.threads))
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        import torch
+
+        torch.set_num_threads(self.threads)
+        self._threads_configured = True
+
+    def get(self, task, model):
+        """Возвращает пайплайн (task, model), загружая его при первом обращении."""
+        key = (task, model)
+        pipeline = self._pipelines.get(key)
+        if pipeline is not None:
+            return pipeline
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        # Отдельная блокировка на модель: загрузка одной модели не ждет другую
+        with lock:
+            pipeline = self._pipelines.get(key)
+            if pipeline is None:
+                started = time.monotonic()
+                with self._lock:
+                    self._configure_threads()
+                from transformers import pipeline as create_pipeline
+
+                pipeline = create_pipeline(task, model=model, device=self.device)
+                self._load_times[key] = round(time.monotonic() - started, 3)
+                self._pipelines[key] = pipeline
+                logging.info(f"Loaded {task} model {model} in {self._load_times[key]}s.")
+        return pipeline
+
+    def preload(self, models):
+        """Загружает список пар (task, model) заранее, например при старте приложения."""
+        for task, model in models:
+            self.get(task, model)
+
+    def stats(self):
+        return {
+            "threads": self.threads,
+            "loaded": [
+                {"task": task, "model": model, "load_seconds": seconds}
+                for (task, model), seconds in self._load_times.items()
+            ],
+        }
+
+
+# Общий реестр процесса
+registry = ModelRegistry()
@@ -0,0 +1,258 @@
+# fpdf и PyPDF2 импортируются внутри функций: они нужны только при экспорте, а не при старте приложения
+import atexit
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Настройки экспорта в PDF
+EXPORT_FONT_DIR = os.getenv("EXPORT_FONT_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "16"))  # Страниц на одну задачу пула
+EXPORT_INLINE_PAGES = int(os.getenv("EXPORT_INLINE_PAGES", "32"))  # Небольшие документы — без пула
+EXPORT_SUBSET_CACHE_SIZE = int(os.getenv("EXPORT_SUBSET_CACHE_SIZE", "64"))  # Подмножеств шрифтов в памяти
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Порядок шрифтов одинаков во всех процессах: страницы ссылаются на шрифты по номеру (/F1, /F2, ...)
+FONT_FAMILY = "DejaVu"
+FONT_FILES = (
+    ("", "DejaVuSans.ttf"),
+    ("B", "DejaVuSans-Bold.ttf"),
+    ("I", "DejaVuSans-Oblique.ttf"),
+    ("BI", "DejaVuSans-BoldOblique.ttf"),
+)
+_FIRST_CODES = 32  # fpdf всегда включает в подмножество коды 0-31
+
+_fonts = None
+_pdf_class = None
+_fonts_lock = threading.Lock()
+_putfonts_lock = threading.Lock()
+_subsets = OrderedDict()
+_subsets_lock = threading.Lock()
+_counters = {"renders": 0, "pages": 0, "parallel_renders": 0, "subset_hits": 0, "subset_misses": 0}
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class _Subset(list):
+    """
+    Список кодов символов шрифта с быстрой проверкой вхождения.
+    fpdf проверяет `cid in subset` для каждого кода шрифта (десятки тысяч раз на шрифт),
+    а в обычном списке это линейный поиск.
+    """
+
+    def __init__(self, codes=()):
+        super().__init__(codes)
+        self._members = set(self)
+
+    def __contains__(self, code):
+        return code in self._members
+
+    def append(self, code):
+        super().append(code)
+        self._members.add(code)
+
+    def extend(self, codes):
+        for code in codes:
+            self.append(code)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._members = set(self)
+
+
+def _caching_ttf_class():
+    """Подкласс TTFontFile, который запоминает результат makeSubset (разбор TTF и сборку подмножества)."""
+    from fpdf.ttfonts import TTFontFile
+
+    class CachingTTFontFile(TTFontFile):
+        def makeSubset(self, file, subset):
+            # Результат не зависит от порядка кодов: глифы подмножества сортируются
+            key = (file, tuple(sorted(set(subset))))
+            with _subsets_lock:
+                cached = _subsets.get(key)
+                if cached is not None:
+                    _subsets.move_to_end(key)
+                    _counters["subset_hits"] += 1
+            if cached is None:
+                stream = super().makeSubset(file, subset)
+                cached = (stream, self.maxUni, dict(self.codeToGlyph))
+                with _subsets_lock:
+                    _counters["subset_misses"] += 1
+                    _subsets[key] = cached
+                    while len(_subsets) > EXPORT_SUBSET_CACHE_SIZE:
+                        _subsets.popitem(last=False)
+            stream, self.maxUni, self.codeToGlyph = cached
+            return stream
+
+    return CachingTTFontFile
+
+
+def _export_pdf_class():
+    """
+    Подкласс FPDF для экспорта с кешем подмножеств шрифтов. Точки расширения для создания
+    TTFontFile у fpdf нет: _putfonts берет класс по имени из модуля fpdf.fpdf. Поэтому
+    только пока документ экспорта записывает шрифты, имя под блокировкой указывает
+    на кеширующий подкласс, а затем возвращается. Если сборка fpdf создает шрифты иначе,
+    экспорт работает без кеша (с предупреждением в логе).
+    """
+    import fpdf.fpdf
+    from fpdf import FPDF
+    from fpdf.ttfonts import TTFontFile
+
+    if getattr(fpdf.fpdf, "TTFontFile", None) is not TTFontFile:
+        logging.warning("fpdf does not create fonts through fpdf.fpdf.TTFontFile, font subsets will not be cached.")
+        return FPDF
+    caching_class = _caching_ttf_class()
+
+    class ExportFPDF(FPDF):
+        def _putfonts(self):
+            with _putfonts_lock:
+                fpdf.fpdf.TTFontFile = caching_class
+                try:
+                    super()._putfonts()
+                finally:
+                    fpdf.fpdf.TTFontFile = TTFontFile
+
+    return ExportFPDF
+
+
+def _load_fonts():
+    """Разбирает шрифты DejaVu один раз на процесс (метрики из .pkl рядом с .ttf)."""
+    global _fonts, _pdf_class
+    with _fonts_lock:
+        if _fonts is None:
+            from fpdf import FPDF
+
+            _pdf_class = _export_pdf_class()
+            pdf = FPDF()
+            for style, file_name in FONT_FILES:
+                path = os.path.join(EXPORT_FONT_DIR, file_name)
+                pdf.add_font(FONT_FAMILY, style, path, uni=True)
+                # Метрики из .pkl хранят путь к .ttf на момент их создания (относительный)
+                pdf.fonts[FONT_FAMILY.lower() + style]["ttffile"] = path
+            _fonts = [(key, pdf.fonts[key], pdf.font_files[key]) for key in pdf.fonts]
+        return _fonts
+
+
+def _new_pdf():
+    """Новый FPDF с уже разобранными шрифтами: таблицы ширин общие, подмножества — свои у документа."""
+    fonts = _load_fonts()
+    pdf = _pdf_class()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    for number, (key, font, font_file) in enumerate(fonts, start=1):
+        pdf.fonts[key] = dict(font, i=number, subset=_Subset(range(_FIRST_CODES)))
+        pdf.font_files[key] = dict(font_file)
+    return pdf
+
+
+def _render_pages(pdf, pages):
+    for page in pages:
+        pdf.add_page()
+        pdf.set_font(FONT_FAMILY, style="B", size=14)
+        pdf.cell(200, 10, f"Page {page['page_number']}", ln=True, align='C')  # Номер страницы
+        pdf.set_font(FONT_FAMILY, size=12)
+
+        # Добавление текста
+        if page["text"]:
+            pdf.multi_cell(0, 10, page["text"])
+
+
+def _output(pdf):
+    # Неиспользованные шрифты не встраиваются в документ
+    for key in [key for key, font in pdf.fonts.items() if len(font["subset"]) <= _FIRST_CODES]:
+        del pdf.fonts[key]
+    return pdf.output(dest='S').encode("latin-1")
+
+
+def _render_batch(pages):
+    """Рендерит пачку страниц в отдельный PDF (в процессе пула)."""
+    pdf = _new_pdf()
+    _render_pages(pdf, pages)
+    return _output(pdf)
+
+
+def _get_executor():
+    """Возвращает пул процессов рендеринга (создается лениво)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=EXPORT_WORKERS)
+            atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+        return _executor
+
+
+def _render_parallel(pages, workers, batch_size):
+    """
+    Рендерит пачки страниц в пуле и склеивает их PDF через PyPDF2 в исходном порядке.
+    Каждая пачка встраивает свое подмножество шрифтов.
+    """
+    from PyPDF2 import PdfReader, PdfWriter
+
+    batches = [pages[start:start + batch_size] for start in range(0, len(pages), batch_size)]
+    executor = _get_executor() if workers == EXPORT_WORKERS else ProcessPoolExecutor(max_workers=workers)
+    try:
+        results = list(executor.map(_render_batch, batches))
+    finally:
+        if executor is not _executor:
+            executor.shutdown()
+
+    writer = PdfWriter()
+    for data in results:
+        for page in PdfReader(io.BytesIO(data)).pages:
+            writer.add_page(page)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def render_pdf(pages, workers=None, batch_size=None):
+    """
+    Рендерит страницы ({"page_number", "text"}) в PDF и возвращает байты.
+    Большие документы рендерятся пачками страниц в пуле процессов.
+    """
+    pages = list(pages)
+    workers = EXPORT_WORKERS if workers is None else workers
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    _load_fonts()
+
+    if workers <= 1 or len(pages) <= max(EXPORT_INLINE_PAGES, batch_size):
+        pdf = _new_pdf()
+        _render_pages(pdf, pages)
+        data = _output(pdf)
+        parallel = False
+    else:
+        data = _render_parallel(pages, workers, batch_size)
+        parallel = True
+
+    with _subsets_lock:
+        _counters["renders"] += 1
+        _counters["pages"] += len(pages)
+        _counters["parallel_renders"] += parallel
+    return data
+
+
+def pdf_chunks(pages, workers=None, batch_size=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Рендерит PDF целиком в памяти (без временного файла) и возвращает генератор его частей
+    по chunk_size байт для ответа. Это не потоковый рендеринг: первая часть готова, только
+    когда собран весь документ.
+    """
+    data = render_pdf(pages, workers, batch_size)
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def text_to_pages(text):
+    """Текст документа в страницы для экспорта; разрыв страницы — символ \\f."""
+    return [
+        {"page_number": number, "text": page_text.strip("\n")}
+        for number, page_text in enumerate(text.split("\f"), start=1)
+    ]
+
+
+def stats():
+    with _subsets_lock:
+        return {**_counters, "fonts_loaded": _fonts is not None, "subsets_cached": len(_subsets)}
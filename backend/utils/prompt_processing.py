@@ -0,0 +1,191 @@
+SYSTEM_PROMPT = "You are a text improvement assistant."
+
+
+def build_previous_info(past_responses):
+    """
+    Builds the context block describing related past operations.
+    """
+    parts = []
+    for i, response in enumerate(past_responses, 1):
+        parts.append(f"Previous Operation {i}:\n")
+        parts.append(f"Instructions: {response.get('instructions', 'N/A')}\n")
+        parts.append(f"Analysis: {response.get('analysis', 'N/A')}\n\n")
+    return "".join(parts)
+
+
+def build_prompt(instructions, document_text, previous_info):
+    """
+    Builds the user prompt for the text improvement model.
+    """
+    return (
+        f"Using the following instructions:\n\n{instructions}\n\n"
+        "Please analyze the document below and make improvements specifically "
+        "based on the instructions provided. This includes:\n"
+        "1. Adding any missing or necessary information.\n"
+        "2. Removing redundant or unnecessary information.\n"
+        "3. Rephrasing unclear or overly complex sentences to improve readability.\n"
+        "4. Keeping unchanged parts of the document intact if they do not require any updates.\n\n"
+        "Consider the following previous operations if relevant:\n\n"
+        f"{previous_info}\n\n"
+        "**Important:** If any information from past operations is reused, you must specify clearly:\n"
+        "1. **Exact elements reused**: List the specific phrases, sentences, or ideas taken from previous operations.\n"
+        "2. **Origin of elements**: Indicate from which specific operation each element was taken.\n"
+        "3. **Application in current analysis**: Explain how each element was applied in the current document.\n\n"
+        "At the end of the modified document, provide a detailed explanation of the changes made, structured as follows:\n"
+        "1. **Summary of new changes**: Briefly summarize the improvements made.\n"
+        "2. **Detailed List of Reused Elements**: For each reused element, provide its exact content, origin, and how it was used.\n"
+        "   - If no information was reused from previous operations, state explicitly: 'No information was reused from previous operations.'\n\n"
+        "Ensure that you include the section 'Detailed List of Reused Elements' in your explanation, even if it states that no information was reused.\n\n"
+        f"Document:\n{document_text}\n\n"
+        "**Output format:**\n"
+        "1. **Updated Document Content**\n"
+        "2. **Explanation of Changes** (prefixed with 'Explanation:')\n"
+        "   - **Summary of New Changes**\n"
+        "   - **Detailed List of Reused Elements**\n"
+        "     - For each element:\n"
+        "       - Exact content reused\n"
+        "       - Origin (which previous operation)\n"
+        "       - How it was applied\n"
+    )
+
+
+def build_structured_prompt(instructions, document_text, previous_info):
+    """
+    Builds the user prompt for the structured (JSON) output mode.
+    """
+    return (
+        f"Using the following instructions:\n\n{instructions}\n\n"
+        "Please analyze the document below and make improvements specifically "
+        "based on the instructions provided. This includes:\n"
+        "1. Adding any missing or necessary information.\n"
+        "2. Removing redundant or unnecessary information.\n"
+        "3. Rephrasing unclear or overly complex sentences to improve readability.\n"
+        "4. Keeping unchanged parts of the document intact if they do not require any updates.\n\n"
+        "Consider the following previous operations if relevant:\n\n"
+        f"{previous_info}\n\n"
+        f"Document:\n{document_text}\n\n"
+        "**Output format:** respond with a single JSON object and nothing else, with these keys in this order:\n"
+        '- "content": the full updated document content.\n'
+        '- "summary": a brief summary of the improvements made.\n'
+        '- "reused_elements": a list of the information reused from previous operations, one object per element with\n'
+        '  "content" (the exact phrase, sentence or idea reused), "origin" (which previous operation, e.g. '
+        '"Previous Operation 1") and "application" (how it was applied in the current document).\n'
+        '  Use an empty list if no information was reused from previous operations.\n'
+    )
+
+
+def build_messages(prompt_instructions):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt_instructions},
+    ]
+
+
+def split_analysis(analysis):
+    """
+    Splits the model output into document content and explanation.
+    """
+    if "Explanation:" in analysis:
+        content, explanation = analysis.split("Explanation:", 1)
+        return content.strip(), explanation.strip()
+    return analysis.strip(), "No explanation provided by the model."
+
+
+class ExplanationSplitter:
+    """
+    Incrementally splits streamed model output at the first 'Explanation:' marker.
+    feed() returns a list of (section, text) pieces where section is 'content' or
+    'explanation'; finish() returns the same (content, explanation) pair as split_analysis.
+    """
+
+    MARKER = "Explanation:"
+    reused_elements = None  # Parsed from the explanation by the caller
+
+    def __init__(self):
+        self.section = "content"
+        self._pending = ""  # Tail that may be the beginning of the marker
+        self._content = []
+        self._explanation = []
+
+    def feed(self, token):
+        if self.section == "explanation":
+            self._explanation.append(token)
+            return [("explanation", token)]
+
+        buffer = self._pending + token
+        index = buffer.find(self.MARKER)
+        if index != -1:
+            before, after = buffer[:index], buffer[index + len(self.MARKER):]
+            self.section = "explanation"
+            self._pending = ""
+            pieces = []
+            if before:
+                self._content.append(before)
+                pieces.append(("content", before))
+            if after:
+                self._explanation.append(after)
+                pieces.append(("explanation", after))
+            return pieces
+
+        # Hold back the longest suffix that could still grow into the marker
+        keep = 0
+        for size in range(min(len(self.MARKER) - 1, len(buffer)), 0, -1):
+            if self.MARKER.startswith(buffer[-size:]):
+                keep = size
+                break
+        emit = buffer[:len(buffer) - keep]
+        self._pending = buffer[len(buffer) - keep:]
+        if not emit:
+            return []
+        self._content.append(emit)
+        return [("content", emit)]
+
+    def finish(self):
+        if self._pending:
+            self._content.append(self._pending)
+            self._pending = ""
+        content = "".join(self._content).strip()
+        if self.section != "explanation":
+            return content, "No explanation provided by the model."
+        return content, "".join(self._explanation).strip()
+
+
+# Function to parse the 'Explanation' section and extract reused elements
+def parse_reused_elements(explanation):
+    """
+    Parses the 'Explanation' section and extracts details about reused elements.
+    Returns a list of dictionaries with keys 'content', 'origin', and 'application'.
+    """
+    reused_elements = []
+    lines = explanation.splitlines()
+    in_reused_section = False
+    current_element = {}
+    for line in lines:
+        line = line.strip()
+        if line.lower().startswith("detailed list of reused elements"):
+            in_reused_section = True
+            continue
+        elif in_reused_section and line == '':
+            # Empty line may indicate the end of the section
+            if current_element:
+                reused_elements.append(current_element)
+                current_element = {}
+            in_reused_section = False
+            continue
+        if in_reused_section:
+            if line.lower().startswith("no information was reused from previous operations"):
+                # Explicit indication that no information was reused
+                in_reused_section = False
+                break
+            elif line.startswith("- Exact content reused:"):
+                if current_element:
+                    reused_elements.append(current_element)
+                    current_element = {}
+                current_element['content'] = line.replace("- Exact content reused:", "").strip()
+            elif line.startswith("- Origin (which previous operation):"):
+                current_element['origin'] = line.replace("- Origin (which previous operation):", "").strip()
+            elif line.startswith("- How it was applied:"):
+                current_element['application'] = line.replace("- How it was applied:", "").strip()
+    if current_element:
+        reused_elements.append(current_element)
+    return reused_elements
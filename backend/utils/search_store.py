@@ -0,0 +1,295 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils.metrics import timer
+
+# Настройки хранилища поиска и фоновой индексации
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "elasticsearch")  # elasticsearch, sqlite или memory
+SEARCH_SQLITE_PATH = os.getenv("SEARCH_SQLITE_PATH", "search_index.db")
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "200"))  # Документов в одном bulk-запросе
+INDEX_FLUSH_INTERVAL = float(os.getenv("INDEX_FLUSH_INTERVAL", "2.0"))  # Секунды
+INDEX_MAX_RETRIES = int(os.getenv("INDEX_MAX_RETRIES", "5"))
+INDEX_BACKOFF = float(os.getenv("INDEX_BACKOFF", "0.5"))  # Начальная пауза между попытками
+INDEX_QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", "10000"))
+INDEX_DEAD_LETTER_PATH = os.getenv("INDEX_DEAD_LETTER_PATH", "static/index_dead_letter.jsonl")
+
+SEARCH_FIELDS = ("instructions", "document_text", "analysis")
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def _terms(text):
+    return [term.lower() for term in _TERM.findall(text or "")]
+
+
+class ElasticsearchStore:
+    """Хранилище поверх Elasticsearch (клиент создается лениво в utils.elasticsearch)."""
+
+    def index(self, index, document):
+        from utils.elasticsearch import save_to_elasticsearch
+
+        return save_to_elasticsearch(index, document)
+
+    def bulk_index(self, index, documents):
+        """Индексирует пачку документов одним bulk-запросом. Возвращает документы, которые не удалось сохранить."""
+        from elasticsearch import helpers
+        from utils.elasticsearch import get_client
+
+        actions = ({"_index": index, "_source": document} for document in documents)
+        results = helpers.streaming_bulk(
+            get_client(), actions, raise_on_error=False, raise_on_exception=False, yield_ok=True
+        )
+        return [document for document, (ok, _) in zip(documents, results) if not ok]
+
+    def search(self, index, query, size=10):
+        from utils.elasticsearch import search_in_elasticsearch
+
+        return search_in_elasticsearch(index, query, size=size)
+
+
+class SQLiteFTSStore:
+    """Локальное хранилище на SQLite FTS5: работает без сети, ранжирование по BM25."""
+
+    def __init__(self, path=SEARCH_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._tables = set()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _table(self, connection, index):
+        table = "fts_" + re.sub(r"\W", "_", index)
+        if table not in self._tables:
+            with self._lock:
+                connection.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                    f"doc_id UNINDEXED, {', '.join(SEARCH_FIELDS)}, source UNINDEXED)"
+                )
+                self._tables.add(table)
+        return table
+
+    def index(self, index, document):
+        return self.bulk_index_ids(index, [document])[0]
+
+    def bulk_index_ids(self, index, documents):
+        connection = self._connect()
+        table = self._table(connection, index)
+        ids = [uuid.uuid4().hex for _ in documents]
+        with connection:
+            connection.executemany(
+                f"INSERT INTO {table} (doc_id, {', '.join(SEARCH_FIELDS)}, source) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (doc_id, *(str(document.get(field, "")) for field in SEARCH_FIELDS), json.dumps(document))
+                    for doc_id, document in zip(ids, documents)
+                ],
+            )
+        return ids
+
+    def bulk_index(self, index, documents):
+        self.bulk_index_ids(index, documents)
+        return []
+
+    def search(self, index, query, size=10):
+        terms = _terms(query)
+        if not terms:
+            return []
+        connection = self._connect()
+        table = self._table(connection, index)
+        # Как multi_match по умолчанию: совпадение по любому из слов запроса
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        rows = connection.execute(
+            f"SELECT source FROM {table} WHERE {table} MATCH ? ORDER BY bm25({table}) LIMIT ?",
+            (match, size),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class MemoryStore:
+    """Хранилище в памяти процесса для тестов и бенчмарков."""
+
+    def __init__(self):
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def index(self, index, document):
+        doc_id = uuid.uuid4().hex
+        with self._lock:
+            self._documents.setdefault(index, []).append((doc_id, document))
+        return doc_id
+
+    def bulk_index(self, index, documents):
+        for document in documents:
+            self.index(index, document)
+        return []
+
+    def search(self, index, query, size=10):
+        terms = set(_terms(query))
+        with self._lock:
+            documents = list(self._documents.get(index, []))
+        scored = []
+        for position, (_, document) in enumerate(documents):
+            text_terms = _terms(" ".join(str(document.get(field, "")) for field in SEARCH_FIELDS))
+            score = sum(1 for term in text_terms if term in terms)
+            if score:
+                scored.append((-score, position, document))
+        scored.sort(key=lambda item: item[:2])
+        return [document for _, _, document in scored[:size]]
+
+
+def create_store(name=SEARCH_BACKEND):
+    if name == "elasticsearch":
+        from utils.elasticsearch import is_configured
+
+        if is_configured():
+            return ElasticsearchStore()
+        logging.warning("Elasticsearch is not configured (set ES_URL or ES_CLOUD_ID and ES_PASSWORD); "
+                        f"using the local SQLite FTS search index {SEARCH_SQLITE_PATH}.")
+        return SQLiteFTSStore()
+    if name == "sqlite":
+        return SQLiteFTSStore()
+    if name == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown search backend: {name}")
+
+
+class BulkIndexer:
+    """
+    Фоновая индексация: документы копятся в очереди и отправляются bulk-запросом,
+    когда набирается batch_size документов или проходит flush_interval секунд.
+    Неудачные документы повторяются с экспоненциальной паузой, затем пишутся в dead-letter файл.
+    """
+
+    def __init__(self, store, index, batch_size=INDEX_BATCH_SIZE, flush_interval=INDEX_FLUSH_INTERVAL,
+                 max_retries=INDEX_MAX_RETRIES, backoff=INDEX_BACKOFF, dead_letter_path=INDEX_DEAD_LETTER_PATH,
+                 queue_size=INDEX_QUEUE_SIZE, stage="index"):
+        self.store = store
+        self.index = index
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dead_letter_path = dead_letter_path
+        self.stage = stage  # Имя стадии в метриках (backend_stage_seconds)
+        self.indexed = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is not None:
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="bulk-indexer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def add(self, document):
+        """Ставит документ в очередь индексации, не блокируя запрос."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(document)
+        except queue.Full:
+            logging.warning("Index queue is full, writing document to the dead-letter file.")
+            self._dead_letter([document], "queue full")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._send(batch)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _send(self, batch):
+        pending = batch
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                with timer(self.stage):
+                    failed = self.store.bulk_index(self.index, pending)
+            except Exception as e:
+                error = e
+                logging.warning(f"Bulk indexing of {len(pending)} documents failed (attempt {attempt + 1}): {e}")
+                continue
+            with self._lock:
+                self.indexed += len(pending) - len(failed)
+            if not failed:
+                return
+            pending, error = failed, f"{len(failed)} documents rejected"
+        logging.error(f"Giving up on {len(pending)} documents after {self.max_retries} retries: {error}")
+        self._dead_letter(pending, str(error))
+
+    def _dead_letter(self, documents, reason):
+        try:
+            with self._lock:
+                with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                    for document in documents:
+                        f.write(json.dumps({"index": self.index, "reason": reason, "document": document}) + "\n")
+                self.dead_lettered += len(documents)
+        except OSError as e:
+            logging.error(f"Failed to write to the dead-letter file: {e}")
+
+    def flush(self):
+        """Блокирует, пока очередь не будет отправлена в хранилище."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=60)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.store).__name__,
+                "queue_depth": self._queue.qsize(),
+                "indexed": self.indexed,
+                "retries": self.retries,
+                "dead_lettered": self.dead_lettered,
+            }
@@ -0,0 +1,346 @@
+import logging
+import os
+import re
+import threading
+
+from utils.prompt_processing import ExplanationSplitter, parse_reused_elements, split_analysis
+
+# Формат ответа модели: text — прежний свободный текст с "Explanation:", json — объект по схеме ниже
+OUTPUT_FORMAT = os.getenv("LLM_OUTPUT_FORMAT", "text")
+OUTPUT_FORMATS = ("text", "json")
+if OUTPUT_FORMAT not in OUTPUT_FORMATS:
+    raise ValueError(f"Unknown LLM output format: {OUTPUT_FORMAT}")
+
+# Схема: {"content": str, "summary": str, "reused_elements": [{"content", "origin", "application"}]}
+ELEMENT_FIELDS = ("content", "origin", "application")
+_ROOT_FIELDS = {"content": "content", "summary": "summary", "reused_elements": "elements"}
+_PREAMBLE_CHARS = 200  # Сколько текста допускается перед "{" (```json, короткая фраза)
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+_SCALAR_CHARS = re.compile(r"[-+.0-9a-zA-Z]*")
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_WHITESPACE = " \t\r\n"
+
+_counters = {"parsed": 0, "fallbacks": 0}
+_counters_lock = threading.Lock()
+
+
+class StructuredOutputError(ValueError):
+    """Ответ модели не соответствует схеме структурированного вывода."""
+
+
+def format_explanation(summary, reused_elements):
+    """
+    Текст пояснения в прежнем формате: его показывает клиент, озвучивает TTS,
+    и из него parse_reused_elements восстанавливает элементы (например, при склейке частей).
+    """
+    lines = [f"Summary of New Changes: {summary}" if summary else "Summary of New Changes: -", "",
+             "Detailed List of Reused Elements:"]
+    if not reused_elements:
+        lines.append("No information was reused from previous operations.")
+    for element in reused_elements:
+        lines.append(f"- Exact content reused: {_one_line(element.get('content', ''))}")
+        lines.append(f"- Origin (which previous operation): {_one_line(element.get('origin', ''))}")
+        lines.append(f"- How it was applied: {_one_line(element.get('application', ''))}")
+    return "\n".join(lines)
+
+
+def _one_line(text):
+    return " ".join(text.split())
+
+
+class StructuredOutputParser:
+    """
+    Инкрементальный разбор ответа в режиме json. feed(token) проверяет ответ по схеме
+    по мере поступления и возвращает фрагменты ("content" | "explanation", текст), как
+    ExplanationSplitter: текст content и summary отдается клиенту сразу после декодирования.
+    Каждый символ просматривается один раз (внутри строк — поиском до кавычки или "\\"),
+    поэтому время разбора линейно по длине ответа.
+    Если ответ не соответствует схеме, разбор прекращается: finish() возвращает результат
+    прежнего текстового парсера. Если к этому моменту клиенту еще ничего не отдано,
+    дальнейшие фрагменты выдает ExplanationSplitter.
+    """
+
+    def __init__(self):
+        self.failed = False
+        self.error = None
+        self.reused_elements = None  # Заполняется в finish()
+        self._raw = []
+        self._buffer = ""
+        self._skipped = 0  # Символов перед "{"
+        self._emitted = False
+        self._legacy = None
+        self._expect = "start"
+        self._stack = []  # [скобка, контекст (root/elements/element/skip), текущий ключ]
+        self._string = None  # Куда идет текущая строка: key, content, summary, field, skip
+        self._key = []
+        self._field = []
+        self._element = None
+        self._elements = []
+        self._content = []
+        self._summary = []
+        self._seen = set()
+
+    def feed(self, token):
+        self._raw.append(token)
+        if self._legacy is not None:
+            return self._legacy.feed(token)
+        if self.failed:
+            return []
+        self._buffer += token
+        pieces = []
+        try:
+            self._parse(pieces, final=False)
+        except StructuredOutputError as e:
+            return self._fail(e, pieces)
+        if pieces:
+            self._emitted = True
+        return pieces
+
+    def _fail(self, error, pieces):
+        self.failed, self.error = True, str(error)
+        self._buffer = ""
+        if self._emitted or pieces:
+            return pieces
+        # Клиенту еще ничего не отдано — продолжаем поток в текстовом формате
+        self._legacy = ExplanationSplitter()
+        return self._legacy.feed("".join(self._raw))
+
+    def _parse(self, pieces, final):
+        buffer, position, size = self._buffer, 0, len(self._buffer)
+        while position < size:
+            if self._string is not None:
+                match = _STRING_SPECIAL.search(buffer, position)
+                end = match.start() if match else size
+                if end > position:
+                    self._string_text(buffer[position:end], pieces)
+                if match is None:
+                    position = size
+                    break
+                if buffer[end] == '"':
+                    position = end + 1
+                    self._end_string()
+                    continue
+                decoded, position = self._escape(buffer, end, final)
+                if decoded is None:
+                    break  # Escape-последовательность разорвана между токенами
+                self._string_text(decoded, pieces)
+                continue
+
+            char = buffer[position]
+            if char in _WHITESPACE:
+                position += 1
+                continue
+            expect = self._expect
+            if expect == "start":
+                index = buffer.find("{", position)
+                if index == -1:
+                    self._skipped += size - position
+                    position = size
+                    if self._skipped > _PREAMBLE_CHARS:
+                        raise StructuredOutputError("Response does not start with a JSON object.")
+                    break
+                self._skipped += index - position
+                if self._skipped > _PREAMBLE_CHARS:
+                    raise StructuredOutputError("Response does not start with a JSON object.")
+                position = index
+                self._expect = "value"
+                continue
+            if expect == "done":
+                position = size  # Текст после объекта (закрывающий ```) не разбирается
+                break
+            if expect in ("value", "value_or_end"):
+                if char == "]" and expect == "value_or_end":
+                    position += 1
+                    self._close("[")
+                elif char in "{[":
+                    position += 1
+                    self._open(char)
+                elif char == '"':
+                    position += 1
+                    self._begin_string(self._value_target(), "string")
+                else:
+                    run = _SCALAR_CHARS.match(buffer, position).end()
+                    if run == size and not final:
+                        break  # Число или литерал может продолжиться в следующем токене
+                    match = _SCALAR.match(buffer, position)
+                    if match is None or match.end() != run:
+                        raise StructuredOutputError(f"Unexpected value {buffer[position:run + 1]!r}.")
+                    position = match.end()
+                    target = self._value_target()
+                    # null допускается вместо необязательных полей
+                    if not (match.group() == "null" and target in ("summary", "elements", "field")):
+                        self._check_type(target, "scalar")
+                    self._end_value()
+            elif expect in ("key", "key_or_end"):
+                if char == "}" and expect == "key_or_end":
+                    position += 1
+                    self._close("{")
+                elif char == '"':
+                    position += 1
+                    self._string = "key"
+                else:
+                    raise StructuredOutputError(f"Expected an object key, got {char!r}.")
+            elif expect == "colon":
+                if char != ":":
+                    raise StructuredOutputError(f"Expected ':', got {char!r}.")
+                position += 1
+                self._expect = "value"
+            elif expect == "comma_or_end":
+                position += 1
+                if char == ",":
+                    self._expect = "key" if self._stack[-1][0] == "{" else "value"
+                elif char in "}]":
+                    self._close(char.replace("}", "{").replace("]", "["))
+                else:
+                    raise StructuredOutputError(f"Expected ',' or a closing bracket, got {char!r}.")
+        self._buffer = buffer[position:]
+
+    def _escape(self, buffer, index, final):
+        """Декодирует escape-последовательность с позиции index; (None, index), если она не пришла целиком."""
+        if index + 1 >= len(buffer):
+            if final:
+                raise StructuredOutputError("Unterminated escape sequence.")
+            return None, index
+        code = buffer[index + 1]
+        if code in _ESCAPES:
+            return _ESCAPES[code], index + 2
+        if code != "u":
+            raise StructuredOutputError(f"Invalid escape sequence \\{code}.")
+        if index + 6 > len(buffer):
+            if final:
+                raise StructuredOutputError("Unterminated escape sequence.")
+            return None, index
+        value = self._hex(buffer[index + 2:index + 6])
+        if 0xD800 <= value < 0xDC00:
+            # Суррогатная пара: вторая половина должна идти сразу следом
+            if index + 12 > len(buffer) and not final:
+                return None, index
+            if buffer[index + 6:index + 8] == "\\u":
+                low = self._hex(buffer[index + 8:index + 12])
+                if 0xDC00 <= low < 0xE000:
+                    return chr(0x10000 + ((value - 0xD800) << 10) + (low - 0xDC00)), index + 12
+        return chr(value), index + 6
+
+    @staticmethod
+    def _hex(digits):
+        if len(digits) != 4 or any(char not in "0123456789abcdefABCDEF" for char in digits):
+            raise StructuredOutputError(f"Invalid unicode escape \\u{digits}.")
+        return int(digits, 16)
+
+    def _value_target(self):
+        """Назначение значения по месту в схеме: root, content, summary, elements, element, field или skip."""
+        if not self._stack:
+            return "root"
+        _, context, key = self._stack[-1]
+        if context == "root":
+            return _ROOT_FIELDS.get(key, "skip")
+        if context == "elements":
+            return "element"
+        if context == "element" and key in ELEMENT_FIELDS:
+            return "field"
+        return "skip"
+
+    @staticmethod
+    def _check_type(target, kind):
+        expected = {"root": "object", "element": "object", "elements": "array",
+                    "content": "string", "summary": "string", "field": "string"}.get(target)
+        if expected is not None and expected != kind:
+            raise StructuredOutputError(f"Expected {expected} for '{target}', got {kind}.")
+
+    def _open(self, bracket):
+        target = self._value_target()
+        self._check_type(target, "object" if bracket == "{" else "array")
+        if target in ("content", "summary", "elements"):
+            self._seen.add(target)
+        if target == "element":
+            self._element = dict.fromkeys(ELEMENT_FIELDS, "")  # У каждого элемента есть все поля схемы
+        context = target if target in ("root", "elements", "element") else "skip"
+        self._stack.append([bracket, context, None])
+        self._expect = "key_or_end" if bracket == "{" else "value_or_end"
+
+    def _close(self, bracket):
+        if not self._stack or self._stack[-1][0] != bracket:
+            raise StructuredOutputError("Mismatched closing bracket.")
+        _, context, _ = self._stack.pop()
+        if context == "element":
+            if any(self._element.values()):
+                self._elements.append(self._element)
+            self._element = None
+        self._end_value()
+
+    def _begin_string(self, target, kind):
+        self._check_type(target, kind)
+        if target in ("content", "summary"):
+            self._seen.add(target)
+        self._string = target
+
+    def _string_text(self, text, pieces):
+        target = self._string
+        if target == "key":
+            self._key.append(text)
+        elif target == "content":
+            self._content.append(text)
+            pieces.append(("content", text))
+        elif target == "summary":
+            self._summary.append(text)
+            pieces.append(("explanation", text))
+        elif target == "field":
+            self._field.append(text)
+
+    def _end_string(self):
+        target, self._string = self._string, None
+        if target == "key":
+            self._stack[-1][2] = "".join(self._key)
+            self._key = []
+            self._expect = "colon"
+            return
+        if target == "field":
+            self._element[self._stack[-1][2]] = "".join(self._field).strip()
+            self._field = []
+        self._end_value()
+
+    def _end_value(self):
+        self._expect = "comma_or_end" if self._stack else "done"
+
+    def finish(self):
+        """Возвращает (content, explanation); reused_elements заполняется здесь же."""
+        if self._legacy is None and not self.failed:
+            try:
+                self._parse([], final=True)
+                if self._expect != "done" or self._string is not None:
+                    raise StructuredOutputError("Incomplete JSON object.")
+                if "content" not in self._seen:
+                    raise StructuredOutputError("Missing 'content'.")
+            except StructuredOutputError as e:
+                self.failed, self.error = True, str(e)
+
+        if not self.failed:
+            with _counters_lock:
+                _counters["parsed"] += 1
+            self.reused_elements = self._elements
+            return "".join(self._content).strip(), format_explanation("".join(self._summary).strip(), self._elements)
+
+        with _counters_lock:
+            _counters["fallbacks"] += 1
+        logging.warning(f"Structured model output could not be parsed ({self.error}); using the text parser.")
+        if self._legacy is not None:
+            content, explanation = self._legacy.finish()
+        else:
+            content, explanation = split_analysis("".join(self._raw))
+        self.reused_elements = parse_reused_elements(explanation)
+        return content, explanation
+
+
+def parse_structured_output(text):
+    """Разбирает полный ответ в режиме json. Возвращает (content, explanation, reused_elements)."""
+    parser = StructuredOutputParser()
+    parser.feed(text)
+    content, explanation = parser.finish()
+    return content, explanation, parser.reused_elements
+
+
+def stats():
+    with _counters_lock:
+        return dict(_counters)
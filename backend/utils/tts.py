@@ -0,0 +1,265 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Настройки синтеза речи
+TTS_ENGINE = os.getenv("TTS_ENGINE", "gtts")  # gtts, pyttsx3 (офлайн), http или stub
+TTS_URL = os.getenv("TTS_URL", "http://127.0.0.1:5002/synthesize")  # Сервис синтеза для TTS_ENGINE=http
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "30"))  # Секунды
+TTS_CACHE_FOLDER = os.getenv("TTS_CACHE_FOLDER", "static/temp/tts")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "400"))  # Максимальная длина фрагмента
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+class GTTSSynthesizer:
+    """Google TTS (нужна сеть). MP3-фрагменты можно склеивать подряд."""
+
+    name = "gtts"
+    mimetype = "audio/mpeg"
+    extension = "mp3"
+    joinable = True
+
+    def synthesize(self, text, lang):
+        from gtts import gTTS
+
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class Pyttsx3Synthesizer:
+    """Офлайн-синтез через pyttsx3. WAV-файлы нельзя склеивать, поэтому текст синтезируется целиком."""
+
+    name = "pyttsx3"
+    mimetype = "audio/wav"
+    extension = "wav"
+    joinable = False
+
+    def __init__(self):
+        self._lock = threading.Lock()  # Движок pyttsx3 не потокобезопасен
+
+    def synthesize(self, text, lang):
+        import pyttsx3
+
+        with self._lock:
+            handle, path = tempfile.mkstemp(suffix=".wav")
+            os.close(handle)
+            try:
+                engine = pyttsx3.init()
+                engine.save_to_file(text, path)
+                engine.runAndWait()
+                with open(path, "rb") as f:
+                    return f.read()
+            finally:
+                os.remove(path)
+
+
+class HTTPSynthesizer:
+    """Внешний сервис синтеза: POST {"text", "lang"} в JSON, в ответ — MP3 (свой TTS-сервер или заглушка бенчмарков)."""
+
+    name = "http"
+    mimetype = "audio/mpeg"
+    extension = "mp3"
+    joinable = True
+
+    def __init__(self, url=TTS_URL, timeout=TTS_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def synthesize(self, text, lang):
+        from urllib.request import Request, urlopen
+
+        body = json.dumps({"text": text, "lang": lang}).encode("utf-8")
+        request = Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+
+class StubSynthesizer:
+    """Детерминированная заглушка для тестов и бенчмарков."""
+
+    name = "stub"
+    mimetype = "audio/mpeg"
+    extension = "mp3"
+    joinable = True
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def synthesize(self, text, lang):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return f"[{lang}] {text}\n".encode("utf-8")
+
+
+def create_synthesizer(name=TTS_ENGINE):
+    if name == "gtts":
+        return GTTSSynthesizer()
+    if name == "pyttsx3":
+        return Pyttsx3Synthesizer()
+    if name == "http":
+        return HTTPSynthesizer()
+    if name == "stub":
+        return StubSynthesizer()
+    raise ValueError(f"Unknown TTS engine: {name}")
+
+
+def split_sentences(text, max_chars=TTS_CHUNK_CHARS):
+    """Делит текст на фрагменты по границам предложений, не длиннее max_chars (если возможно)."""
+    chunks, current = [], ""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _log_pregeneration_error(future):
+    """Ошибки фонового синтеза только логируются: при запросе фрагмент синтезируется заново."""
+    if future.exception() is not None:
+        logging.error(f"Background speech synthesis failed: {future.exception()}")
+
+
+class TTSService:
+    """
+    Синтез речи с кэшем на диске: аудио каждого фрагмента хранится под хэшем
+    (движок, язык, текст), вытеснение самых старых файлов по суммарному размеру.
+    Фрагменты синтезируются параллельно; одновременные запросы одного фрагмента
+    (например, фоновая предгенерация и запрос пользователя) делят одну задачу.
+    """
+
+    def __init__(self, synthesizer=None, folder=TTS_CACHE_FOLDER, max_bytes=TTS_CACHE_MAX_BYTES,
+                 workers=TTS_WORKERS, chunk_chars=TTS_CHUNK_CHARS):
+        self.synthesizer = synthesizer or create_synthesizer()
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.chunk_chars = chunk_chars
+        self.hits = 0
+        self.misses = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    @property
+    def mimetype(self):
+        return self.synthesizer.mimetype
+
+    def _chunks(self, text):
+        if not self.synthesizer.joinable:
+            return [text]
+        return split_sentences(text, self.chunk_chars) or [text]
+
+    def _path(self, text, lang):
+        key = hashlib.sha256(f"{self.synthesizer.name}\0{lang}\0{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, f"{key}.{self.synthesizer.extension}")
+
+    def _synthesize_to_cache(self, text, lang, path):
+        audio = self.synthesizer.synthesize(text, lang)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total_bytes += len(audio) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return audio
+
+    def _submit(self, text, lang):
+        """Возвращает Future с аудио фрагмента: из кэша, уже идущей задачи или новой задачи."""
+        path = self._path(text, lang)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path)  # Обновляем метку LRU
+            with self._lock:
+                self.hits += 1
+            future = Future()
+            future.set_result(audio)
+            return future
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            future = self._in_flight.get(path)
+            if future is not None:
+                return future
+            self.misses += 1
+            future = self._executor.submit(self._synthesize_to_cache, text, lang, path)
+            self._in_flight[path] = future
+        # Колбэк вне блокировки: для уже завершенной задачи он вызывается сразу
+        future.add_done_callback(lambda _: self._forget(path))
+        return future
+
+    def _forget(self, path):
+        with self._lock:
+            self._in_flight.pop(path, None)
+
+    def pregenerate(self, text, lang="en"):
+        """Ставит синтез всех фрагментов в фон, не дожидаясь результата."""
+        for chunk in self._chunks(text):
+            self._submit(chunk, lang).add_done_callback(_log_pregeneration_error)
+
+    def stream(self, text, lang="en"):
+        """Генератор аудио по фрагментам в исходном порядке; все фрагменты синтезируются параллельно."""
+        futures = [self._submit(chunk, lang) for chunk in self._chunks(text)]
+        for future in futures:
+            yield future.result()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        return entries
+
+    def _evict(self):
+        # Папку читаем только при превышении лимита; сумма пересчитывается, так как кэш делят процессы
+        entries = sorted(self._entries())
+        self._total_bytes = sum(size for _, _, size in entries)
+        for _, name, size in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "engine": self.synthesizer.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "in_flight": len(self._in_flight),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
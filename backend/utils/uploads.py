@@ -0,0 +1,379 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+# Настройки приема загрузок
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))  # Предельный размер файла
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # Размер части при записи потока
+UPLOAD_RETENTION = float(os.getenv("UPLOAD_RETENTION", str(7 * 24 * 3600)))  # Секунды хранения; 0 — без удаления
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))  # Незавершенные докачки
+UPLOAD_JANITOR_INTERVAL = float(os.getenv("UPLOAD_JANITOR_INTERVAL", "3600"))  # Секунды между проходами
+
+PARTS_FOLDER = ".parts"
+# Сохраненные загрузки: <первые 16 символов sha256>_<безопасное имя>. Уборщик удаляет только их
+_STORED_NAME = re.compile(r"[0-9a-f]{16}_")
+_SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadError(Exception):
+    """Загрузка отклонена; status — HTTP-код ответа."""
+
+    status = 400
+
+
+class UploadTooLarge(UploadError):
+    status = 413
+
+
+class UploadOffsetMismatch(UploadError):
+    """Часть докачки пришла не с того смещения; offset — сколько байт уже принято."""
+
+    status = 409
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def safe_name(filename):
+    """Имя файла клиента без каталогов и небезопасных символов."""
+    from werkzeug.utils import secure_filename
+
+    return secure_filename(filename or "") or "upload"
+
+
+class UploadWriter:
+    """
+    Загрузка, которая пишется во временный файл по мере поступления данных: SHA-256
+    и предельный размер проверяются на каждой записи. finish() переносит файл в хранилище
+    и возвращает (путь, sha256), discard() удаляет его. Подходит как файл stream_factory
+    парсера multipart, поэтому части формы не буферизуются отдельно.
+    """
+
+    def __init__(self, store, filename):
+        self.store = store
+        self.filename = filename
+        self.size = 0
+        self._digest = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(dir=store.folder, prefix=".upload-", suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self.size += len(data)
+        try:
+            self.store._check_size(self.size)
+        except UploadTooLarge:
+            # Остаток тела уже не нужен: файл удаляется сразу, не дожидаясь вызывающего
+            self.discard()
+            raise
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def seek(self, offset, whence=0):
+        # Парсер multipart перематывает файл части после записи
+        return self._file.seek(offset, whence)
+
+    def finish(self):
+        self._file.close()
+        digest = self._digest.hexdigest()
+        return self.store._publish(self.path, digest, self.filename, self.size), digest
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UploadStore:
+    """
+    Хранилище загруженных файлов. Поток запроса пишется частями во временный файл
+    с уникальным именем, одновременно считается SHA-256 и проверяется предельный размер;
+    затем файл атомарно переименовывается в <хэш>_<имя>, поэтому одноименные загрузки
+    не перезаписывают друг друга, а повторная загрузка того же файла занимает одно место.
+    Большие файлы можно докачивать частями (сессии в подкаталоге .parts).
+    Фоновый уборщик удаляет загрузки старше retention и брошенные сессии.
+    """
+
+    def __init__(self, folder, max_bytes=UPLOAD_MAX_BYTES, retention=UPLOAD_RETENTION,
+                 session_ttl=UPLOAD_SESSION_TTL, janitor_interval=UPLOAD_JANITOR_INTERVAL):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self.session_ttl = session_ttl
+        self.janitor_interval = janitor_interval
+        self.stored = 0
+        self.stored_bytes = 0
+        self.rejected = 0
+        self.removed = 0
+        self._hashers = {}  # id сессии -> (принятые байты, sha256) в этом процессе
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def parts_folder(self):
+        return os.path.join(self.folder, PARTS_FOLDER)
+
+    def _ensure_janitor(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._hashers = {}
+                if self.janitor_interval > 0:
+                    self._thread = threading.Thread(target=self._run_janitor, name="upload-janitor", daemon=True)
+                    self._thread.start()
+
+    def _run_janitor(self):
+        while True:
+            time.sleep(self.janitor_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Upload janitor failed: {e}")
+
+    def _check_size(self, size):
+        if size > self.max_bytes:
+            with self._lock:
+                self.rejected += 1
+            raise UploadTooLarge(f"Upload exceeds the limit of {self.max_bytes} bytes.")
+
+    def _publish(self, tmp_path, digest, filename, size):
+        """Переносит принятый файл под окончательное имя; возвращает путь."""
+        file_path = os.path.join(self.folder, f"{digest[:16]}_{safe_name(filename)}")
+        os.replace(tmp_path, file_path)
+        with self._lock:
+            self.stored += 1
+            self.stored_bytes += size
+        return file_path
+
+    def open(self, filename, content_length=None):
+        """
+        Начинает загрузку, данные которой приходят частями (например, из парсера multipart).
+        Возвращает UploadWriter. UploadTooLarge — если заявленный размер больше max_bytes.
+        """
+        self._ensure_janitor()
+        if content_length is not None:
+            self._check_size(content_length)
+        os.makedirs(self.folder, exist_ok=True)
+        return UploadWriter(self, filename)
+
+    def save(self, stream, filename, content_length=None):
+        """
+        Записывает поток в хранилище. Возвращает (путь, sha256).
+        UploadTooLarge — если заявленный или фактический размер больше max_bytes.
+        """
+        writer = self.open(filename, content_length)
+        try:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            return writer.finish()
+        except BaseException:
+            writer.discard()
+            raise
+
+    # Докачка частями: create_session -> append (с любого смещения, на котором оборвалось) -> complete
+
+    def _session_paths(self, upload_id):
+        if not _SESSION_ID.fullmatch(upload_id or ""):
+            return None
+        base = os.path.join(self.parts_folder, upload_id)
+        return f"{base}.json", f"{base}.part"
+
+    def create_session(self, filename, size=None):
+        """Начинает докачку; size — заявленный размер файла (если известен). Возвращает описание сессии."""
+        self._ensure_janitor()
+        if size is not None:
+            self._check_size(size)
+        os.makedirs(self.parts_folder, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._session_paths(upload_id)
+        open(part_path, "wb").close()
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"filename": filename, "size": size, "created_at": time.time()}, f)
+        return self.get_session(upload_id)
+
+    def get_session(self, upload_id):
+        """Описание сессии ({"upload_id", "filename", "size", "offset"}) или None."""
+        paths = self._session_paths(upload_id)
+        if paths is None:
+            return None
+        try:
+            with open(paths[0], "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            offset = os.path.getsize(paths[1])
+        except (FileNotFoundError, ValueError):
+            return None
+        return {"upload_id": upload_id, "filename": meta["filename"], "size": meta["size"], "offset": offset}
+
+    @contextmanager
+    def _locked_part(self, upload_id):
+        """
+        Открывает файл частей сессии под исключительной блокировкой (flock): параллельные
+        или повторенные PATCH одной сессии, в том числе из разных воркеров, идут по очереди.
+        """
+        paths = self._session_paths(upload_id)
+        if paths is None:
+            raise KeyError(upload_id)
+        try:
+            target = open(paths[1], "r+b")
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+        try:
+            if fcntl is not None:
+                fcntl.flock(target, fcntl.LOCK_EX)
+            if not os.path.exists(paths[0]):
+                raise KeyError(upload_id)  # Сессию завершили или отменили, пока ждали блокировку
+            yield target
+        finally:
+            target.close()
+
+    def append(self, upload_id, offset, stream):
+        """
+        Дописывает часть, начинающуюся со смещения offset. Возвращает новое смещение.
+        Смещение должно совпадать с числом уже принятых байт (иначе UploadOffsetMismatch),
+        поэтому после обрыва клиент узнает offset из get_session и продолжает с него.
+        Проверка смещения и запись идут под блокировкой файла сессии.
+        """
+        session = self.get_session(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        limit = min(self.max_bytes, session["size"] if session["size"] is not None else self.max_bytes)
+
+        with self._locked_part(upload_id) as target:
+            accepted = os.fstat(target.fileno()).st_size
+            if offset != accepted:
+                raise UploadOffsetMismatch(f"Expected offset {accepted}, got {offset}.", accepted)
+
+            with self._lock:
+                state = self._hashers.pop(upload_id, None)
+            digest = state[1] if state is not None and state[0] == offset else None
+            if digest is None and offset == 0:
+                digest = hashlib.sha256()
+
+            size = offset
+            target.seek(offset)
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    target.truncate(offset)
+                    with self._lock:
+                        self.rejected += 1
+                    raise UploadTooLarge(f"Upload exceeds {limit} bytes.")
+                if digest is not None:
+                    digest.update(chunk)
+                target.write(chunk)
+            target.flush()
+            os.utime(self._session_paths(upload_id)[0])  # Метка активности для уборщика
+            # При обрыве части хэш не сохраняется и досчитывается по файлу при завершении
+            if digest is not None:
+                with self._lock:
+                    self._hashers[upload_id] = (size, digest)
+        return size
+
+    def _hash_file(self, upload_id):
+        digest = hashlib.sha256()
+        with open(self._session_paths(upload_id)[1], "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest
+
+    def complete(self, upload_id, sha256=None):
+        """
+        Завершает докачку: проверяет размер (и хэш, если передан) и переносит файл в хранилище.
+        Возвращает (путь, sha256). Хэш считается по ходу докачки; заново файл читается,
+        только если части приходили в другой процесс.
+        """
+        # Под блокировкой: незаконченный PATCH не попадет в опубликованный файл
+        with self._locked_part(upload_id):
+            session = self.get_session(upload_id)
+            if session is None:
+                raise KeyError(upload_id)
+            if session["size"] is not None and session["offset"] != session["size"]:
+                raise UploadOffsetMismatch(
+                    f"Upload is incomplete: {session['offset']} of {session['size']} bytes.", session["offset"]
+                )
+            with self._lock:
+                state = self._hashers.pop(upload_id, None)
+            digest = state[1] if state is not None and state[0] == session["offset"] else self._hash_file(upload_id)
+            digest = digest.hexdigest()
+            if sha256 and sha256.lower() != digest:
+                raise UploadError(f"Checksum mismatch: expected {sha256}, got {digest}.")
+
+            meta_path, part_path = self._session_paths(upload_id)
+            file_path = self._publish(part_path, digest, session["filename"], session["offset"])
+            os.remove(meta_path)
+        return file_path, digest
+
+    def abort(self, upload_id):
+        """Удаляет сессию докачки. False, если ее нет."""
+        paths = self._session_paths(upload_id)
+        if paths is None or not os.path.exists(paths[0]):
+            return False
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        return True
+
+    def sweep(self, now=None):
+        """Удаляет загрузки старше retention и сессии без активности дольше session_ttl. Возвращает число файлов."""
+        now = time.time() if now is None else now
+        removed = 0
+        candidates = []
+        if self.retention > 0 and os.path.isdir(self.folder):
+            candidates += [
+                (os.path.join(self.folder, name), self.retention)
+                for name in os.listdir(self.folder)
+                if _STORED_NAME.match(name) or (name.startswith(".upload-") and name.endswith(".part"))
+            ]
+        if self.session_ttl > 0 and os.path.isdir(self.parts_folder):
+            candidates += [(os.path.join(self.parts_folder, name), self.session_ttl)
+                           for name in os.listdir(self.parts_folder)]
+        for path, max_age in candidates:
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    removed += 1
+            except (FileNotFoundError, IsADirectoryError):
+                continue
+        if removed:
+            logging.info(f"Upload janitor removed {removed} files.")
+        with self._lock:
+            self.removed += removed
+        return removed
+
+    def stats(self):
+        sessions = (
+            sum(1 for name in os.listdir(self.parts_folder) if name.endswith(".json"))
+            if os.path.isdir(self.parts_folder) else 0
+        )
+        with self._lock:
+            return {
+                "stored": self.stored,
+                "stored_bytes": self.stored_bytes,
+                "rejected": self.rejected,
+                "removed": self.removed,
+                "sessions": sessions,
+                "max_bytes": self.max_bytes,
+            }
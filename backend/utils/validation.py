@@ -0,0 +1,46 @@
+import os
+
+from utils.model_registry import registry
+
+# Настройки валидации текста документов
+VALIDATION_TASK = "text-classification"
+VALIDATION_MODEL = os.getenv("VALIDATION_MODEL", "distilbert-base-uncased-finetuned-sst-2-english")
+VALIDATION_BATCH_SIZE = int(os.getenv("VALIDATION_BATCH_SIZE", "16"))
+VALIDATION_MAX_CHARS = int(os.getenv("VALIDATION_MAX_CHARS", "2000"))  # Длиннее модель все равно обрежет
+
+
+def preload_validation_model():
+    registry.preload([(VALIDATION_TASK, VALIDATION_MODEL)])
+
+
+def validate_segments(segments, batch_size=VALIDATION_BATCH_SIZE):
+    """
+    Классифицирует список фрагментов текста одним пакетным вызовом модели.
+    Возвращает [{"label", "score"}] в порядке фрагментов.
+    """
+    if not segments:
+        return []
+    classifier = registry.get(VALIDATION_TASK, VALIDATION_MODEL)
+    texts = [segment[:VALIDATION_MAX_CHARS] for segment in segments]
+    results = classifier(texts, batch_size=batch_size, truncation=True)
+    return [{"label": result["label"], "score": round(float(result["score"]), 4)} for result in results]
+
+
+def validate_pages(pages, batch_size=VALIDATION_BATCH_SIZE):
+    """
+    Валидирует постраничный результат извлечения ({"page_number", "text", "method"}).
+    Пустые страницы не отправляются в модель и получают validation = None.
+    """
+    filled = [page for page in pages if page["text"].strip()]
+    validations = dict(zip(
+        (page["page_number"] for page in filled),
+        validate_segments([page["text"] for page in filled], batch_size),
+    ))
+    return [
+        {
+            "page_number": page["page_number"],
+            "method": page["method"],
+            "validation": validations.get(page["page_number"]),
+        }
+        for page in pages
+    ]
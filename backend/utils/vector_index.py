@@ -0,0 +1,336 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import zlib
+
+# NumPy импортируется внутри функций: индекс создается при старте приложения, а считает только при записи и поиске
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+# Настройки векторного индекса прошлых операций
+VECTOR_INDEX_FOLDER = os.getenv("VECTOR_INDEX_FOLDER", "static/vector_index")
+VECTOR_EMBEDDER = os.getenv("VECTOR_EMBEDDER", "hashing")  # hashing или sentence-transformers
+VECTOR_DIM = int(os.getenv("VECTOR_DIM", "512"))  # Размерность для hashing-эмбеддингов
+VECTOR_QUANTIZED = os.getenv("VECTOR_QUANTIZED", "0") == "1"  # int8 вместо float32 (в 4 раза меньше)
+VECTOR_MIN_SCORE = float(os.getenv("VECTOR_MIN_SCORE", "0.2"))
+SENTENCE_MODEL = os.getenv("SENTENCE_MODEL", "all-MiniLM-L6-v2")
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Эмбеддинги без модели и сети: слова и символьные триграммы хэшируются в вектор
+    фиксированной размерности (feature hashing). Триграммы ловят разные формы слов.
+    """
+
+    def __init__(self, dim=VECTOR_DIM):
+        self.dim = dim
+
+    def _features(self, text):
+        for word in _WORD.findall(text.lower()):
+            yield word
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3]
+
+    def embed(self, texts):
+        import numpy as np
+
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                # crc32 стабилен между процессами, в отличие от hash()
+                code = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, code % self.dim] += 1.0 if code & 0x80000000 else -1.0
+        return _normalize(np.sign(matrix) * np.log1p(np.abs(matrix)))
+
+
+class SentenceTransformerEmbedder:
+    """Эмбеддинги sentence-transformers (необязательная зависимость, модель грузится лениво)."""
+
+    def __init__(self, model_name=SENTENCE_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def dim(self):
+        return self._get_model().get_sentence_embedding_dimension()
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+
+                self._model = SentenceTransformer(self.model_name)
+            return self._model
+
+    def embed(self, texts):
+        import numpy as np
+
+        vectors = self._get_model().encode(list(texts), convert_to_numpy=True)
+        return _normalize(vectors.astype(np.float32))
+
+
+def create_embedder(name=VECTOR_EMBEDDER):
+    if name == "hashing":
+        return HashingEmbedder()
+    if name == "sentence-transformers":
+        return SentenceTransformerEmbedder()
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+def _normalize(matrix):
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def embedding_text(document):
+    """Текст, по которому ищется операция: инструкции — главный сигнал для похожих запросов."""
+    return document.get("instructions", "") or document.get("analysis", "")[:2000]
+
+
+class VectorIndex:
+    """
+    Встроенный векторный индекс прошлых операций.
+    Векторы (нормированные, float32 или int8) дописываются в файл и читаются как
+    np.memmap; документы — в documents.jsonl, позиция строки совпадает с номером вектора.
+    Поиск — косинусная близость одним матричным умножением и top-k через argpartition.
+    Реализует тот же интерфейс, что и хранилища из utils.search_store.
+    Подмену папки командой rebuild индекс замечает по inode папки и открывается заново.
+    """
+
+    def __init__(self, folder=VECTOR_INDEX_FOLDER, embedder=None, quantized=None, min_score=VECTOR_MIN_SCORE):
+        self.folder = folder
+        self.embedder = embedder or create_embedder()
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._open(quantized)
+
+    def _open(self, quantized=None):
+        """Читает параметры индекса из meta.json (или создает его) и сбрасывает загруженные смещения."""
+        folder = self.folder
+        # Параметры существующего индекса берутся из meta.json, иначе — из настроек
+        meta_path = os.path.join(folder, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != self.embedder.dim:
+                raise ValueError(f"Vector index in {folder} has dimension {meta['dim']}, embedder has {self.embedder.dim}")
+            quantized = meta["quantized"]
+        else:
+            quantized = VECTOR_QUANTIZED if quantized is None else quantized
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.embedder.dim, "quantized": quantized, "embedder": type(self.embedder).__name__}, f)
+        self.quantized = quantized
+        self.dtype = "int8" if quantized else "float32"
+        self.vectors_path = os.path.join(folder, "vectors.i8" if quantized else "vectors.f32")
+        self.documents_path = os.path.join(folder, "documents.jsonl")
+        self.lock_path = os.path.join(folder, ".lock")
+        self._matrix = None
+        self._offsets = []
+        self._documents_size = 0
+        self._inode = os.stat(folder).st_ino
+
+    def _row_bytes(self):
+        return self.embedder.dim * (1 if self.quantized else 4)
+
+    def _encode(self, vectors):
+        import numpy as np
+
+        if self.quantized:
+            return np.clip(np.rint(vectors * 127), -127, 127).astype(np.int8)
+        return vectors.astype(np.float32)
+
+    def _file_lock(self):
+        handle = open(self.lock_path, "a")
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def bulk_index(self, index, documents):
+        """Считает эмбеддинги пачкой и дописывает векторы и документы. Возвращает пустой список (нет отказов)."""
+        if not documents:
+            return []
+        vectors = self._encode(self.embedder.embed([embedding_text(document) for document in documents]))
+        with self._lock:
+            handle = self._file_lock()
+            try:
+                self._sync()
+                with open(self.vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self.documents_path, "ab") as f:
+                    for document in documents:
+                        f.write((json.dumps({"index": index, **document}) + "\n").encode("utf-8"))
+            finally:
+                handle.close()
+            self._matrix = None
+        return []
+
+    def index(self, index, document):
+        self.bulk_index(index, [document])
+        return str(self.count() - 1)
+
+    def _sync(self):
+        """Догружает смещения строк documents.jsonl, дописанных (в том числе другими процессами)."""
+        try:
+            inode = os.stat(self.folder).st_ino
+        except FileNotFoundError:
+            return  # rebuild подменяет папку прямо сейчас
+        if inode != self._inode:
+            logging.info(f"Vector index {self.folder} was rebuilt, reopening it.")
+            self._open()
+        if not os.path.exists(self.documents_path):
+            return
+        size = os.path.getsize(self.documents_path)
+        if size == self._documents_size:
+            return
+        with open(self.documents_path, "rb") as f:
+            f.seek(self._documents_size)
+            position = self._documents_size
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Строка еще дописывается
+                self._offsets.append(position)
+                position += len(line)
+        self._documents_size = position
+
+    def count(self):
+        with self._lock:
+            self._sync()
+            rows = os.path.getsize(self.vectors_path) // self._row_bytes() if os.path.exists(self.vectors_path) else 0
+            return min(rows, len(self._offsets))
+
+    def _get_matrix(self, rows):
+        import numpy as np
+
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.embedder.dim))
+        return self._matrix
+
+    def _document(self, row):
+        with open(self.documents_path, "rb") as f:
+            f.seek(self._offsets[row])
+            return json.loads(f.readline())
+
+    def search(self, index, query, size=10):
+        """Возвращает до size документов индекса index, ближайших к запросу по косинусу."""
+        import numpy as np
+
+        rows = self.count()
+        if not rows or not query.strip():
+            return []
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            matrix = self._get_matrix(rows)
+            scores = np.asarray(matrix @ query_vector, dtype=np.float32)
+            if self.quantized:
+                scores /= 127.0
+            # Берем кандидатов с запасом: часть строк может относиться к другим индексам
+            limit = min(rows, size * 4)
+            candidates = np.argpartition(-scores, limit - 1)[:limit] if limit < rows else np.arange(rows)
+            candidates = candidates[np.argsort(-scores[candidates])]
+            results = []
+            for row in candidates:
+                if scores[row] < self.min_score:
+                    break
+                document = self._document(int(row))
+                if document.pop("index", index) != index:
+                    continue
+                results.append(document)
+                if len(results) >= size:
+                    break
+        return results
+
+
+def load_operations_from_db():
+    """Читает обработанные промпты из таблицы user_requests в формате документов индекса."""
+    from models import Session, UserRequest
+    from utils.audit_log import decode_payload
+
+    db = Session()
+    try:
+        rows = (
+            db.query(UserRequest)
+            .filter(UserRequest.endpoint.in_(("/process_prompt", "/process_prompt_stream")))
+            .order_by(UserRequest.id)
+            .yield_per(500)
+        )
+        for row in rows:
+            try:
+                request_data = decode_payload(row.request_data) or {}
+                response_data = decode_payload(row.response_data) or {}
+            except ValueError:
+                continue
+            if "analysis" not in response_data:
+                continue  # Ошибочные запросы не индексируем
+            yield {
+                "instructions": request_data.get("instructions", ""),
+                "document_text": request_data.get("document_text", ""),
+                "analysis": response_data.get("analysis", ""),
+                "explanation": response_data.get("explanation", ""),
+                "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+            }
+    finally:
+        db.close()
+
+
+def rebuild(folder=VECTOR_INDEX_FOLDER, index="user_requests", batch_size=256, quantized=None):
+    """Перестраивает индекс из SQLite во временную папку и атомарно подменяет старый."""
+    tmp_folder = f"{folder}.rebuild"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    vector_index = VectorIndex(tmp_folder, quantized=quantized)
+    batch, total = [], 0
+    for document in load_operations_from_db():
+        batch.append(document)
+        if len(batch) >= batch_size:
+            vector_index.bulk_index(index, batch)
+            total += len(batch)
+            batch = []
+    vector_index.bulk_index(index, batch)
+    total += len(batch)
+
+    old_folder = f"{folder}.old"
+    shutil.rmtree(old_folder, ignore_errors=True)
+    if os.path.exists(folder):
+        os.replace(folder, old_folder)
+    os.replace(tmp_folder, folder)
+    shutil.rmtree(old_folder, ignore_errors=True)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local vector index of past operations.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Rebuild the index from the user_requests table.")
+    rebuild_parser.add_argument("--folder", default=VECTOR_INDEX_FOLDER)
+    rebuild_parser.add_argument("--quantized", action="store_true", default=None)
+    search_parser = subparsers.add_parser("search", help="Query the index.")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--folder", default=VECTOR_INDEX_FOLDER)
+    search_parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "rebuild":
+        total = rebuild(args.folder, quantized=args.quantized)
+        logging.info(f"Indexed {total} operations into {args.folder}.")
+    else:
+        for document in VectorIndex(args.folder).search("user_requests", args.query, size=args.k):
+            print(json.dumps({"instructions": document.get("instructions"), "timestamp": document.get("timestamp")}))
+
+
+if __name__ == "__main__":
+    main()
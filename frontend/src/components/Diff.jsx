@@ -40,7 +40,7 @@ const useStyles = makeStyles({
   },
 });
 
-const DiffComponent = ({ type, text, originalText, newText }) => {
+const DiffComponent = ({ type, text, originalText, newText, onResolve }) => {
   const classes = useStyles();
   const [status, setStatus] = useState("pending"); // 'pending', 'accepted', 'rejected', 'editing'
   const [editedNewText, setEditedNewText] = useState(newText || text || "");
@@ -58,13 +58,21 @@ const DiffComponent = ({ type, text, originalText, newText }) => {
     setAnchorEl(null);
   };
 
+  // Сообщаем странице, какой текст пользователь оставил для этого фрагмента
+  const resolve = (nextStatus, keptText) => {
+    setStatus(nextStatus);
+    if (onResolve) {
+      onResolve(nextStatus, keptText);
+    }
+  };
+
   const handleAccept = () => {
-    setStatus("accepted");
+    resolve("accepted", editedNewText);
     setAnchorEl(null); // Закрываем попап
   };
 
   const handleReject = () => {
-    setStatus("rejected");
+    resolve("rejected", editedNewText);
     setAnchorEl(null); // Закрываем попап
   };
 
@@ -74,11 +82,11 @@ const DiffComponent = ({ type, text, originalText, newText }) => {
   };
 
   const saveEdit = () => {
-    setStatus("accepted");
+    resolve("accepted", editedNewText);
   };
 
   const cancelEdit = () => {
-    setStatus("pending");
+    resolve("pending", newText || text || "");
     setEditedNewText(newText || text || ""); // Сбрасываем изменения
   };
 
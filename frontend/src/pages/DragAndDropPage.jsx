@@ -23,7 +23,13 @@ function DragAndDropPage() {
   const [isResponseReceived, setIsResponseReceived] = useState(false); // Tracks if model response is received
   const [explanation, setExplanation] = useState(""); // Explanation of changes
   const [isDropdownVisible, setIsDropdownVisible] = useState(false); // Controls dropdown visibility
+  const [sessionId, setSessionId] = useState(null); // Server-side session holding the latest changes
+  const [documentId, setDocumentId] = useState(null); // Server-side versioned document for follow-up prompts
+  const [currentText, setCurrentText] = useState(""); // Latest version of the document text
+  const [version, setVersion] = useState(null); // Server-side version number of currentText
   const fileInputRef = useRef(null);
+  const diffsRef = useRef([]); // Diff parts of the latest suggestions
+  const resolutionsRef = useRef({}); // Diff index -> { status, text } chosen by the user
   const recognitionRef = useRef(null);
 
   const dmp = new DiffMatchPatch();
@@ -38,12 +44,16 @@ function DragAndDropPage() {
     setErrorMessage("");
     setPdfText(""); // Reset PDF text when a new file is selected
     setAiSuggestions([]); // Reset AI suggestions
+    setDocumentId(null); // A new file starts a new document
+    setVersion(null);
   };
 
   const handleCancelUpload = () => {
     setPdfFile(null);
     setPdfText("");
     setAiSuggestions([]);
+    setDocumentId(null);
+    setVersion(null);
     fileInputRef.current.value = null; // Reset file input
   };
 
@@ -53,6 +63,38 @@ function DragAndDropPage() {
       return;
     }
 
+    if (documentId) {
+      // Follow-up prompt: the server re-processes only the targeted parts of the latest version
+      if (!instructions.trim()) {
+        setErrorMessage("Please provide instructions.");
+        return;
+      }
+      try {
+        // The accepted/rejected/edited suggestions become the version the follow-up works on
+        const keptText = getKeptText();
+        let baseVersion = version;
+        if (keptText !== currentText) {
+          const versionResponse = await axios.post(
+            `http://127.0.0.1:5000/documents/${documentId}/versions`,
+            { text: keptText, base_version: version }
+          );
+          baseVersion = versionResponse.data.version;
+        }
+        const promptResponse = await axios.post("http://127.0.0.1:5000/process_prompt", {
+          instructions,
+          document_id: documentId,
+          base_version: baseVersion,
+          document_text: keptText,
+          session_id: sessionId,
+        });
+        applyPromptResponse(keptText, promptResponse.data);
+      } catch (error) {
+        setErrorMessage("Error processing the instructions. Please try again.");
+        console.error(error);
+      }
+      return;
+    }
+
     const formData = new FormData();
     formData.append("file", pdfFile);
 
@@ -69,14 +111,9 @@ function DragAndDropPage() {
         const promptResponse = await axios.post("http://127.0.0.1:5000/process_prompt", {
           instructions,
           document_text: extractedText,
+          session_id: sessionId,
         });
-
-        const { analysis, explanation } = promptResponse.data;
-
-        setAiSuggestions(highlightDifferences(extractedText, analysis || ""));
-        setExplanation(explanation.trim());
-
-        setIsResponseReceived(true);
+        applyPromptResponse(extractedText, promptResponse.data);
       } else {
         setErrorMessage("Please provide instructions and ensure the text is extracted successfully.");
       }
@@ -86,9 +123,23 @@ function DragAndDropPage() {
     }
   };
 
+  const applyPromptResponse = (baseText, data) => {
+    const { analysis, explanation, session_id, document_id, version } = data;
+    setSessionId(session_id);
+    setDocumentId(document_id);
+    setVersion(version);
+    setCurrentText(analysis || "");
+
+    setAiSuggestions(highlightDifferences(baseText, analysis || ""));
+    setExplanation(explanation.trim());
+
+    setIsResponseReceived(true);
+  };
+
   const handleSpeakChanges = async () => {
     try {
       const response = await axios.get("http://127.0.0.1:5000/speak_changes", {
+        params: { session_id: sessionId },
         responseType: "blob", // Expecting an audio file
       });
 
@@ -102,6 +153,23 @@ function DragAndDropPage() {
     }
   };
 
+  // Document text with the user's decisions applied; undecided suggestions keep the model's text
+  const getKeptText = () => {
+    const parts = diffsRef.current.map((diff, index) => {
+      const resolution = resolutionsRef.current[index];
+      const status = resolution ? resolution.status : "pending";
+      if (diff.type === "substitution") {
+        return status === "rejected" ? diff.originalText : status === "accepted" ? resolution.text : diff.newText;
+      } else if (diff.type === "added") {
+        return status === "rejected" ? "" : status === "accepted" ? resolution.text : diff.text;
+      } else if (diff.type === "removed") {
+        return status === "rejected" ? diff.text : "";
+      }
+      return diff.text;
+    });
+    return parts.join("").trim();
+  };
+
   const toggleDropdownVisibility = () => {
     setIsDropdownVisible(!isDropdownVisible);
   };
@@ -144,6 +212,12 @@ function DragAndDropPage() {
       }
     }
 
+    diffsRef.current = processedDiffs;
+    resolutionsRef.current = {};
+    const handleResolve = (index) => (status, text) => {
+      resolutionsRef.current[index] = { status, text };
+    };
+
     return processedDiffs.map((diff, index) => {
       if (diff.type === "substitution") {
         return (
@@ -152,6 +226,7 @@ function DragAndDropPage() {
             type="substitution"
             originalText={diff.originalText}
             newText={diff.newText}
+            onResolve={handleResolve(index)}
           />
         );
       } else if (diff.type === "added") {
@@ -161,6 +236,7 @@ function DragAndDropPage() {
             type="added"
             text={diff.text}
             originalText=""
+            onResolve={handleResolve(index)}
           />
         );
       } else if (diff.type === "removed") {
@@ -170,6 +246,7 @@ function DragAndDropPage() {
             type="removed"
             text={diff.text}
             originalText={diff.text}
+            onResolve={handleResolve(index)}
           />
         );
       } else {